@@ -1,15 +1,28 @@
 import datetime
 import os
+import uuid
 
 import streamlit as st
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
 from langchain_anthropic import ChatAnthropic
-from langchain_community.chat_message_histories import \
-    StreamlitChatMessageHistory
+from langchain_community.chat_message_histories import StreamlitChatMessageHistory
 from langchain_openai import ChatOpenAI
-from pages import (PrintRetrievalHandler, RetrieveDocuments, StreamHandler,
-                   footer, save_conversation_history, set_bg_local, set_llm)
+from pages import (
+    IndexRetriever,
+    PrintRetrievalHandler,
+    StreamHandler,
+    check_collection_password,
+    collection_saves_enabled,
+    footer,
+    get_collection,
+    get_session_indexes,
+    list_collections,
+    save_collection,
+    save_conversation_history,
+    set_bg_local,
+    set_llm,
+)
 
 # Initialize LangSmith tracing
 os.environ["LANGCHAIN_TRACING_V2"] = "true"
@@ -42,28 +55,185 @@ else:
 
 # Stop the process if no API key is provided
 if not openai_api_key and not anthropic_api_key:
-    st.error("You must provide at least one API key, either for OpenAI or Anthropic, to continue.", icon="🚨")
+    st.error(
+        "You must provide at least one API key, either for OpenAI or Anthropic, to continue.",
+        icon="🚨",
+    )
     st.stop()
 
-# Add file-upload button
-uploaded_files = st.sidebar.file_uploader(
-    label="Upload a PDF or text file",
-    type=["pdf", "doc", "docx", "txt", "md", "html", "py", "ipynb", "eml", "json", "csv", "rtf", "log"],
-    help="Processing speed varies by server load. Consider the size of your files before you upload.",
-    accept_multiple_files=True,
-)
-if not uploaded_files:
-    st.info("Please upload documents to continue.")
-    st.stop()
+# Search a saved collection, or upload files to index
+UPLOAD = "Upload files"
+collections = list_collections()
+source = UPLOAD
+if collections:
+    source = st.sidebar.selectbox(
+        label="Documents",
+        options=[UPLOAD, *collections],
+        key="document_source",
+        help="Search a prebuilt collection instead of uploading files.",
+    )
+
+if source == UPLOAD:
+    # Add file-upload button
+    uploaded_files = st.sidebar.file_uploader(
+        label="Upload a PDF or text file",
+        type=[
+            "pdf",
+            "doc",
+            "docx",
+            "txt",
+            "md",
+            "html",
+            "py",
+            "ipynb",
+            "eml",
+            "json",
+            "csv",
+            "rtf",
+            "log",
+        ],
+        help="Processing speed varies by server load. Consider the size of your files before you upload.",
+        accept_multiple_files=True,
+    )
+    # Index every session's files once, in one index shared through the memory-budgeted
+    # retriever cache, and search only this session's files. New files are indexed in the
+    # background; an evicted index is rebuilt on the next rerun.
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    session_indexes = get_session_indexes()
+    if not uploaded_files:
+        # Drop removed files from the shared index now rather than when the session expires
+        session_indexes.release(st.session_state.session_id)
+        st.info("Please upload documents to continue.")
+        st.stop()
+    session_index = session_indexes.get(
+        st.session_state.session_id,
+        uploaded_files,
+        chunking="tokens",
+        max_context_tokens=2048,
+        compress_tokens=1024,
+    )
+    index = session_index.index
+
+    # Show the progress of each indexing stage while questions can already be asked
+    @st.fragment(run_every=1)
+    def show_indexing_progress(searchable: bool):
+        progress = session_index.progress
+        # Rerun the page once indexing is done, which stops the polling, or once the first
+        # batch is indexed, so questions can be asked
+        if progress.done or (not searchable and session_index.retriever is not None):
+            st.rerun()
+        st.progress(
+            progress.files_loaded / max(progress.files_total, 1),
+            text=f"Loaded {progress.files_loaded} of {progress.files_total} files",
+        )
+        st.progress(
+            progress.chunks_indexed / max(progress.chunks_split, 1),
+            text=f"Indexed {progress.chunks_indexed} of {progress.chunks_split} chunks "
+            f"({progress.chunks_per_second:.0f} chunks/s)",
+        )
+        # Account for the index as it grows
+        session_indexes.touch(st.session_state.session_id)
+
+    # Only poll while there is something to show
+    if not session_index.progress.done:
+        show_indexing_progress(session_index.retriever is not None)
+    retriever = session_index.retriever
+    if retriever is None:
+        if session_index.progress.done:
+            st.error("None of the uploaded files could be read.", icon="🚨")
+        st.stop()
+
+    # Let the session's files be saved so anyone can search them without uploading again, but
+    # only by whoever knows the deployment's collection passphrase
+    if session_index.progress.done and collection_saves_enabled():
+        with st.sidebar.expander("Save as collection"):
+            collection_name = st.text_input("Collection name", key="collection_name")
+            collection_password = st.text_input(
+                "Passphrase", type="password", key="collection_password"
+            )
+            overwrite = st.checkbox(
+                "Replace an existing collection", key="collection_overwrite"
+            )
+            if st.button("Save", use_container_width=True) and collection_name:
+                if not check_collection_password(collection_password):
+                    st.error("Wrong passphrase.", icon="🚨")
+                else:
+                    # The shared index holds other sessions' files, so save these on their own
+                    collection = session_indexes.build_index(uploaded_files)
+                    try:
+                        save_collection(
+                            collection, collection_name, overwrite=overwrite
+                        )
+                        st.success(f"Saved {collection_name}.")
+                    except ValueError as e:
+                        st.error(str(e), icon="🚨")
+                    finally:
+                        collection.close()
+    sources = session_index.sources()
+    memory = session_index.memory_usage()
+else:
+    # Collections are loaded once, memory-mapped, and shared by every session
+    try:
+        index = get_collection(source)
+    except (OSError, ValueError) as e:
+        st.error(f"Could not load {source}: {e}", icon="🚨")
+        st.stop()
+    retriever = index.retriever
+    with index.lock:
+        sources = index.metadata_index.values("source")
+    memory = index.memory_usage()
 
-retriever = RetrieveDocuments().configure_retriever(uploaded_files)
+# Let questions be scoped to some of the files, so only their chunks are searched
+if len(sources) > 1:
+    # Forget selected files that have since been removed
+    if "source_scope" in st.session_state:
+        st.session_state.source_scope = [
+            name for name in st.session_state.source_scope if name in sources
+        ]
+    scope = st.sidebar.multiselect(
+        label="Search only",
+        options=sources,
+        key="source_scope",
+        help="Answer questions from the selected files only. Leave empty to search all files.",
+    )
+    if scope and source == UPLOAD:
+        retriever = session_index.scoped_retriever(scope)
+    elif scope:
+        retriever = IndexRetriever(
+            index=index, search_kwargs=index.search_kwargs, filters={"source": scope}
+        )
+
+# Show how much memory this session's index holds, how full the process-wide retriever
+# cache is, and how often chunks skip the model
+st.sidebar.caption(f"Index memory: {memory['total'] / 1024**2:.1f} MB")
+cache_usage = get_session_indexes().usage()
+st.sidebar.caption(
+    f"Retriever cache: {cache_usage['bytes'] / 1024**2:.1f} of "
+    f"{cache_usage['max_bytes'] / 1024**2:.0f} MB, used by "
+    f"{len(cache_usage['sessions'].keys() - {'shared'})} session(s)"
+)
+if getattr(index.embeddings, "store", None) is not None:
+    st.sidebar.caption(
+        f"Embedding cache hit rate: {index.embeddings.store.hit_rate:.0%}"
+    )
+if index.query_cache is not None:
+    query_cache = index.query_cache
+    st.sidebar.caption(
+        f"Query cache: {query_cache.hits} hits, {query_cache.misses} misses "
+        f"({query_cache.hit_rate:.0%})"
+    )
+if index.compressor is not None and index.compressor.queries:
+    compressor = index.compressor
+    st.sidebar.caption(
+        f"Context compression: {compressor.last_saved} tokens saved on the last question, "
+        f"{compressor.saved_ratio:.0%} overall"
+    )
 
 # Add temperature header
-temperature_header = st.sidebar.markdown(
-    """
+temperature_header = st.sidebar.markdown("""
     ## Temperature Slider
-    """
-)
+    """)
 # Add the sidebar temperature slider
 temperature_slider = st.sidebar.slider(
     label=""":orange[Set LLM Temperature]. The :blue[lower] the temperature, the :blue[less] random the model will be. The :blue[higher] the temperature, the :blue[more] random the model will be.""",
@@ -95,12 +265,12 @@ openai_models = {
         max_retries=1,  # Set the maximum number of retries for the model
     ),
     "GPT-4o": ChatOpenAI(
-       model="gpt-4o",
-       openai_api_key=openai_api_key,
-       temperature=temperature_slider,
-       streaming=True,
-       max_tokens=4096,
-       max_retries=1,
+        model="gpt-4o",
+        openai_api_key=openai_api_key,
+        temperature=temperature_slider,
+        streaming=True,
+        max_tokens=4096,
+        max_retries=1,
     ),
     # "GPT-o1-mini": ChatOpenAI(  # Define a dictionary entry for the "ChatOpenAI GPT-3.5 Turbo" model
     #     model="o1-mini",  # Set the OpenAI model name
@@ -189,7 +359,7 @@ st.sidebar.download_button(
     mime="text/plain",
     key="download_conversation_history_button",
     help="Download the conversation history as a text file with some formatting.",
-    use_container_width=True,   
+    use_container_width=True,
 )
 
 ## Create an on/off switch for the GIF background
@@ -215,4 +385,3 @@ if user_query := st.chat_input(placeholder="Ask me about your documents!"):
         response = qa_chain.run(
             user_query, callbacks=[retrieval_handler, stream_handler]
         )
-
@@ -1,10 +1,18 @@
 from .utils import (
+    IndexRetriever,
+    check_collection_password,
+    collection_saves_enabled,
     PrintRetrievalHandler,
     RetrieveDocuments,
     StreamHandler,
     footer,
+    get_collection,
+    get_retriever_cache,
+    get_session_indexes,
+    list_collections,
     set_llm,
     set_bg_url,
     set_bg_local,
+    save_collection,
     save_conversation_history,
 )
@@ -1,4 +1,13 @@
+from .cache_operators import *
+from .dedup_operators import *
+from .embedding_operators import *
+from .vector_operators import *
+from .lexical_operators import *
+from .filter_operators import *
+from .compression_operators import *
 from .chatbot_operators import *
+from .collection_operators import *
 from .streamlit_operators import *
 from .lc_premade import *
 from .styles import *
+from .benchmark_operators import *
@@ -0,0 +1,600 @@
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores.utils import (
+    maximal_marginal_relevance as langchain_mmr,
+)
+
+from .cache_operators import EmbeddingStore
+from .chatbot_operators import RetrieveDocuments
+from .embedding_operators import EmbeddingEngine
+from .lexical_operators import LEXICAL_MODES
+from .vector_operators import (
+    UnitVectors,
+    configure_search,
+    create_faiss_index,
+    maximal_marginal_relevance,
+    vector_bytes,
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# The RetrieveDocuments settings compared by `benchmark_chunking` unless others are given
+CHUNKING_CONFIGS = {
+    "characters": {"chunking": "characters"},
+    "tokens": {"chunking": "tokens", "max_context_tokens": 2048},
+}
+
+
+class LocalFile:
+    """
+    A local file that quacks like a Streamlit `UploadedFile`, for running ingestion outside the app.
+
+    Attributes:
+        name (str): The base name of the file.
+        path (str): The path of the file.
+        size (int): The size of the file in bytes.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the LocalFile object.
+
+        Args:
+            path (str): The path of the file.
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def _time_to_first_token(llm: Any, prompt: str) -> float:
+    start = time.perf_counter()
+    for _ in llm.stream(prompt):
+        break
+    return time.perf_counter() - start
+
+
+def benchmark_chunking(
+    filepaths: List[str],
+    questions: List[str],
+    configs: Optional[Dict[str, dict]] = None,
+    llm: Optional[Any] = None,
+) -> List[dict]:
+    """
+    Compare the prompt size and latency of chunking settings on a set of local files.
+
+    For each configuration, the files are indexed from scratch with the document cache and the
+    embedding store disabled, then every question is run through the retriever. Context size is counted with the embedding
+    model's tokenizer so every configuration is measured the same way. If an LLM is given, the
+    time to first token of a prompt stuffed with the retrieved context is measured as well.
+
+    Args:
+        filepaths (List[str]): The files to index.
+        questions (List[str]): The questions to retrieve context for.
+        configs (dict, optional): Keyword arguments for `RetrieveDocuments`, keyed by a label.
+            Defaults to `CHUNKING_CONFIGS`.
+        llm (BaseChatModel, optional): A chat model to measure time to first token with.
+
+    Returns:
+        list: One row of results per configuration.
+    """
+    files = [LocalFile(filepath) for filepath in filepaths]
+    embeddings = EmbeddingEngine()
+    rows = []
+    for label, kwargs in (configs or CHUNKING_CONFIGS).items():
+        index = RetrieveDocuments(cache_dir=None, embeddings=embeddings, **kwargs)
+
+        start = time.perf_counter()
+        retriever = index.update_retriever(files)
+        index_seconds = time.perf_counter() - start
+        if retriever is None:
+            logger.warning("Skipped %s: none of the files could be indexed", label)
+            continue
+
+        context_tokens = []
+        retrieval_seconds = []
+        first_token_seconds = []
+        for question in questions:
+            start = time.perf_counter()
+            docs = retriever.invoke(question)
+            retrieval_seconds.append(time.perf_counter() - start)
+
+            context = "\n\n".join(doc.page_content for doc in docs)
+            context_tokens.append(index.count_tokens(context))
+            if llm is not None:
+                prompt = f"Use the following context to answer the question.\n\n{context}\n\nQuestion: {question}"
+                first_token_seconds.append(_time_to_first_token(llm, prompt))
+
+        rows.append(
+            {
+                "config": label,
+                "chunks": sum(len(ids) for ids in index.file_chunk_ids.values()),
+                "index_seconds": index_seconds,
+                "mean_context_tokens": statistics.mean(context_tokens),
+                "max_context_tokens": max(context_tokens),
+                "mean_retrieval_ms": 1000 * statistics.mean(retrieval_seconds),
+                "mean_first_token_ms": (
+                    1000 * statistics.mean(first_token_seconds)
+                    if first_token_seconds
+                    else None
+                ),
+            }
+        )
+        index.close()
+
+    embeddings.close()
+    return rows
+
+
+def benchmark_embedding_concurrency(
+    texts: List[str],
+    queries: List[str],
+    sessions: List[int] = (1, 2, 4, 8),
+    batch_size: int = 32,
+) -> List[dict]:
+    """
+    Measure embedding throughput and query latency with several sessions embedding at once.
+
+    Each simulated session embeds all of `texts` in batches of `batch_size`, asking one of the
+    queries between batches, the way a user asks questions while their files are indexed. The
+    embedding store is disabled so every text reaches the model.
+
+    Args:
+        texts (List[str]): The chunks each session embeds.
+        queries (List[str]): The queries the sessions ask.
+        sessions (List[int]): The numbers of concurrent sessions to measure.
+        batch_size (int): The number of chunks per embedding call.
+
+    Returns:
+        list: One row of results per number of sessions.
+    """
+    engine = EmbeddingEngine()
+    engine.embed_documents(texts[:batch_size])  # Load the model and warm up
+    rows = []
+    for count in sessions:
+        latencies = []
+        requests, batches = engine.requests, engine.batches
+
+        def run_session():
+            for i, start in enumerate(range(0, len(texts), batch_size)):
+                engine.embed_documents(texts[start : start + batch_size])
+                query_start = time.perf_counter()
+                engine.embed_query(queries[i % len(queries)])
+                latencies.append(time.perf_counter() - query_start)
+
+        threads = [threading.Thread(target=run_session) for _ in range(count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        rows.append(
+            {
+                "sessions": count,
+                "chunks_per_second": count * len(texts) / seconds,
+                "p50_query_ms": 1000 * statistics.median(latencies),
+                "requests_per_batch": (engine.requests - requests)
+                / max(engine.batches - batches, 1),
+            }
+        )
+    engine.close()
+    return rows
+
+
+def _benchmark_recall(
+    filepaths: List[str], questions: List[str], configs: Dict[str, dict], k: int
+) -> List[dict]:
+    """
+    Index local files once per configuration and compare each index's `k` nearest chunks to
+    each question with those of a full-width float32 index.
+
+    Recall is reported with and without the exact re-ranking of compact indexes' candidates.
+    Chunks are embedded once, through a temporary embedding store shared by every index.
+    """
+    files = [LocalFile(filepath) for filepath in filepaths]
+    with tempfile.TemporaryDirectory() as store_dir:
+        embeddings = EmbeddingEngine(store=EmbeddingStore(store_dir, "benchmark"))
+        queries = [embeddings.embed_query(question) for question in questions]
+
+        indexes = {}
+        for label, kwargs in {"baseline": {}, **configs}.items():
+            index = RetrieveDocuments(
+                cache_dir=None,
+                chunking="tokens",
+                embeddings=embeddings,
+                **{"vector_storage": "float32", "reduce_dim": None, **kwargs},
+            )
+            if index.update_retriever(files) is None:
+                logger.warning("None of the files could be indexed")
+                return []
+            indexes[label] = index
+
+        baseline = indexes.pop("baseline")
+        baseline_bytes = vector_bytes(baseline.vectordb.index)
+        truth = [set(baseline.candidates(baseline.project(q), k)[0]) for q in queries]
+        rows = []
+        for label, index in indexes.items():
+            recall = []
+            recall_unranked = []
+            for query, expected in zip(queries, truth):
+                query = index.project(query)
+                found = index.candidates(query, k)[0]
+                recall.append(len(expected.intersection(found)) / len(expected))
+                found = index.candidates(query, k, rerank=False)[0]
+                recall_unranked.append(
+                    len(expected.intersection(found)) / len(expected)
+                )
+            rows.append(
+                {
+                    "config": label,
+                    "dims": index.vectordb.index.d,
+                    "vector_mb": vector_bytes(index.vectordb.index) / 1024**2,
+                    "saved": 1 - vector_bytes(index.vectordb.index) / baseline_bytes,
+                    f"recall_at_{k}": statistics.mean(recall),
+                    f"recall_at_{k}_without_rerank": statistics.mean(recall_unranked),
+                }
+            )
+        for index in (baseline, *indexes.values()):
+            index.close()
+        embeddings.close()
+    return rows
+
+
+def benchmark_vector_storage(
+    filepaths: List[str],
+    questions: List[str],
+    storages: List[str] = ("float32", "float16", "int8"),
+    k: int = 10,
+) -> List[dict]:
+    """
+    Compare the vector memory and recall@k of compact vector storage on a set of local files.
+
+    The files are indexed once per storage type, and the `k` nearest chunks to each question
+    are compared with those of the float32 index. Recall is reported with and without the
+    exact re-ranking of candidates, to show how much of it the re-ranking recovers.
+
+    Args:
+        filepaths (List[str]): The files to index.
+        questions (List[str]): The questions to search for.
+        storages (List[str]): The vector storage types to compare.
+        k (int): The number of nearest chunks compared per question.
+
+    Returns:
+        list: One row of results per storage type.
+    """
+    configs = {storage: {"vector_storage": storage} for storage in storages}
+    return _benchmark_recall(filepaths, questions, configs, k)
+
+
+def benchmark_reduction(
+    filepaths: List[str],
+    questions: List[str],
+    dims: List[int] = (64, 128, 192),
+    reduction: str = "pca",
+    k: int = 10,
+) -> List[dict]:
+    """
+    Compare the vector memory and recall@k of reduced embedding widths on a set of local files.
+
+    The files are indexed once per width, and the `k` nearest chunks to each question are
+    compared with those of the full-width index. A PCA is only fitted once the files yield
+    `PCA_MIN_SAMPLE` chunks, so smaller sets are compared at full width.
+
+    Args:
+        filepaths (List[str]): The files to index.
+        questions (List[str]): The questions to search for.
+        dims (List[int]): The reduced widths to compare.
+        reduction (str): "pca" or "truncate".
+        k (int): The number of nearest chunks compared per question.
+
+    Returns:
+        list: One row of results per width.
+    """
+    configs = {
+        f"{reduction}-{dim}": {"reduce_dim": dim, "reduction": reduction}
+        for dim in dims
+    }
+    return _benchmark_recall(filepaths, questions, configs, k)
+
+
+def benchmark_lexical(
+    filepaths: List[str], questions: List[str], repeats: int = 20
+) -> List[dict]:
+    """
+    Compare the search latency and results of each lexical mode on a set of local files.
+
+    The files are indexed once. Each question is then searched in every mode with the index's
+    own search settings, and the chunks picked are compared with those of a purely dense
+    search.
+
+    Args:
+        filepaths (List[str]): The files to index.
+        questions (List[str]): The questions to search for. Keyword-heavy questions, such as
+            error codes or function names, show the difference between the modes best.
+        repeats (int): How many times each question is searched per mode.
+
+    Returns:
+        list: One row of results per lexical mode.
+    """
+    index = RetrieveDocuments(cache_dir=None, chunking="tokens", lexical="hybrid")
+    if index.update_retriever([LocalFile(filepath) for filepath in filepaths]) is None:
+        logger.warning("None of the files could be indexed")
+        return []
+    queries = [index.embeddings.embed_query(question) for question in questions]
+    lexical_mb = index.bm25.nbytes() / 1024**2
+
+    results = {}
+    rows = []
+    for mode in LEXICAL_MODES:
+        index.lexical = mode
+        seconds = []
+        results[mode] = []
+        for question, query in zip(questions, queries):
+            for _ in range(repeats):
+                start = time.perf_counter()
+                docs = index.search(query, text=question, **index.search_kwargs)
+                seconds.append(time.perf_counter() - start)
+            results[mode].append([doc.page_content for doc in docs])
+        overlap = [
+            len(set(found).intersection(dense)) / max(len(dense), 1)
+            for found, dense in zip(results[mode], results["off"])
+        ]
+        rows.append(
+            {
+                "mode": mode,
+                "p50_ms": 1000 * statistics.median(seconds),
+                "p95_ms": 1000 * statistics.quantiles(seconds, n=20)[-1],
+                "same_as_dense": statistics.mean(overlap),
+                "lexical_mb": lexical_mb if mode != "off" else 0.0,
+            }
+        )
+    index.close()
+    return rows
+
+
+def synthetic_vectors(size: int, dim: int = 384, seed: int = 0) -> np.ndarray:
+    """
+    Generate normalized, clustered vectors that stand in for chunk embeddings.
+
+    Args:
+        size (int): The number of vectors.
+        dim (int): Their dimension.
+        seed (int): The random seed.
+
+    Returns:
+        np.ndarray: The vectors, one per row.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(size // 100, 1), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=size)]
+    vectors += 0.5 * rng.normal(size=(size, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def benchmark_index_types(
+    sizes: List[int] = (10_000, 100_000),
+    vectors: Optional[np.ndarray] = None,
+    queries: int = 200,
+    k: int = 10,
+    nprobes: List[int] = (8, 32, 128),
+    ef_searches: List[int] = (32, 64, 256),
+) -> List[dict]:
+    """
+    Compare the build time, memory, latency and recall@k of each index type at several corpus
+    sizes.
+
+    Every approximate index is searched with each `nprobe` or `ef_search` setting, one query at
+    a time as in the app, and compared with an exact flat search. Recall is also reported after
+    re-ranking 4 * k candidates at full precision, as `RetrieveDocuments` does.
+
+    Args:
+        sizes (List[int]): The corpus sizes to measure.
+        vectors (np.ndarray, optional): The corpus, e.g. the exact vectors of a collection.
+            Defaults to `synthetic_vectors`.
+        queries (int): The number of queries, drawn from the corpus and perturbed.
+        k (int): The number of nearest neighbors compared per query.
+        nprobes (List[int]): The IVF `nprobe` settings to measure.
+        ef_searches (List[int]): The HNSW `efSearch` settings to measure.
+
+    Returns:
+        list: One row of results per size, index type and setting.
+    """
+    if vectors is None:
+        vectors = synthetic_vectors(max(sizes))
+    rng = np.random.default_rng(1)
+    rows = []
+    for size in sizes:
+        corpus = np.ascontiguousarray(vectors[:size], dtype=np.float32)
+        picks = corpus[rng.integers(size, size=queries)]
+        query_vectors = picks + 0.1 * rng.normal(size=picks.shape).astype(np.float32)
+
+        indexes = {}
+        for index_type in ("flat", "ivf", "ivfpq", "hnsw"):
+            start = time.perf_counter()
+            index = create_faiss_index("float32", corpus, index_type)
+            index.add(corpus)
+            indexes[index_type] = (index, time.perf_counter() - start)
+        truth = indexes["flat"][0].search(query_vectors, k)[1]
+
+        for index_type, (index, build_seconds) in indexes.items():
+            if index_type in ("ivf", "ivfpq"):
+                settings = [("nprobe", value, {"nprobe": value}) for value in nprobes]
+            elif index_type == "hnsw":
+                settings = [
+                    ("ef_search", value, {"ef_search": value}) for value in ef_searches
+                ]
+            else:
+                settings = [("", None, {})]
+            for name, value, kwargs in settings:
+                configure_search(index, **kwargs)
+                latencies = []
+                recall = []
+                recall_reranked = []
+                for query, expected in zip(query_vectors, truth):
+                    start = time.perf_counter()
+                    _, found = index.search(query[None], 4 * k)
+                    latencies.append(time.perf_counter() - start)
+                    found = found[0][found[0] != -1]
+                    recall.append(len(np.intersect1d(expected, found[:k])) / k)
+                    distances = ((corpus[found] - query) ** 2).sum(axis=1)
+                    reranked = found[np.argsort(distances)[:k]]
+                    recall_reranked.append(len(np.intersect1d(expected, reranked)) / k)
+                rows.append(
+                    {
+                        "size": size,
+                        "index": index_type,
+                        "setting": f"{name}={value}" if name else "exact",
+                        "build_seconds": build_seconds,
+                        "vector_mb": vector_bytes(index) / 1024**2,
+                        "p50_ms": 1000 * statistics.median(latencies),
+                        f"recall_at_{k}": statistics.mean(recall),
+                        f"recall_at_{k}_reranked": statistics.mean(recall_reranked),
+                    }
+                )
+    return rows
+
+
+def benchmark_mmr(
+    size: int = 20_000,
+    fetch_ks: List[int] = (7, 20, 100, 500),
+    k: int = 8,
+    lambda_mult: float = 0.2,
+    queries: int = 200,
+) -> List[dict]:
+    """
+    Compare the latency of LangChain's MMR with the vectorized one `RetrieveDocuments` uses.
+
+    Both search the same flat index for the `fetch_k` nearest vectors. LangChain's path then
+    reconstructs each candidate from the index and selects in Python loops; the vectorized
+    path gathers resident normalized vectors and selects with matrix-vector products.
+
+    Args:
+        size (int): The number of synthetic vectors indexed.
+        fetch_ks (List[int]): The candidate counts to measure.
+        k (int): The number of chunks selected per query.
+        lambda_mult (float): The MMR trade-off between relevance and diversity.
+        queries (int): The number of queries per setting.
+
+    Returns:
+        list: One row of results per `fetch_k`.
+    """
+    vectors = synthetic_vectors(size)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    unit = UnitVectors(vectors.shape[1])
+    unit.add(vectors)
+    rng = np.random.default_rng(1)
+    query_vectors = vectors[rng.integers(size, size=queries)]
+    query_vectors += 0.1 * rng.normal(size=query_vectors.shape).astype(np.float32)
+
+    rows = []
+    for fetch_k in fetch_ks:
+        langchain_seconds = []
+        vectorized_seconds = []
+        agree = 0
+        for query in query_vectors:
+            start = time.perf_counter()
+            _, positions = index.search(query[None], fetch_k)
+            candidates = np.array([index.reconstruct(int(i)) for i in positions[0]])
+            expected = langchain_mmr(query, candidates, k=k, lambda_mult=lambda_mult)
+            langchain_seconds.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            _, positions = index.search(query[None], fetch_k)
+            selected = maximal_marginal_relevance(
+                query, unit.get(positions[0]), k=k, lambda_mult=lambda_mult
+            )
+            vectorized_seconds.append(time.perf_counter() - start)
+            agree += selected == expected
+        rows.append(
+            {
+                "fetch_k": fetch_k,
+                "langchain_p50_ms": 1000 * statistics.median(langchain_seconds),
+                "vectorized_p50_ms": 1000 * statistics.median(vectorized_seconds),
+                "same_selection": agree / queries,
+            }
+        )
+    return rows
+
+
+def print_rows(rows: List[dict]):
+    """
+    Print benchmark results as an aligned table.
+
+    Args:
+        rows (List[dict]): The rows returned by a benchmark function.
+    """
+    if not rows:
+        print("No results.")
+        return
+    columns = list(rows[0])
+    cells = [
+        [f"{row[c]:.2f}" if isinstance(row[c], float) else str(row[c]) for c in columns]
+        for row in rows
+    ]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark RAGbot indexing settings.")
+    parser.add_argument("files", nargs="*", help="Files to index.")
+    parser.add_argument("-q", "--question", action="append", help="A question to ask.")
+    parser.add_argument(
+        "--benchmark",
+        choices=["chunking", "storage", "reduction", "lexical", "index", "mmr"],
+        default="chunking",
+        help="Compare chunking settings, compact vector storage, reduced embedding widths, "
+        "lexical search modes, or, on synthetic vectors, index types and MMR implementations.",
+    )
+    parser.add_argument(
+        "--size",
+        action="append",
+        type=int,
+        help="A corpus size for the index benchmark. Defaults to 10,000 and 100,000.",
+    )
+    parser.add_argument(
+        "--reduction",
+        choices=["pca", "truncate"],
+        default="pca",
+        help="How embeddings are reduced in the reduction benchmark.",
+    )
+    args = parser.parse_args()
+    if args.benchmark == "index":
+        print_rows(benchmark_index_types(args.size or (10_000, 100_000)))
+        sys.exit()
+    if args.benchmark == "mmr":
+        print_rows(benchmark_mmr())
+        sys.exit()
+    if not args.files or not args.question:
+        parser.error("the files and at least one --question are required")
+    if args.benchmark == "storage":
+        print_rows(benchmark_vector_storage(args.files, args.question))
+    elif args.benchmark == "lexical":
+        print_rows(benchmark_lexical(args.files, args.question))
+    elif args.benchmark == "reduction":
+        print_rows(
+            benchmark_reduction(args.files, args.question, reduction=args.reduction)
+        )
+    else:
+        print_rows(benchmark_chunking(args.files, args.question))
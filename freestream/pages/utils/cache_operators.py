@@ -0,0 +1,778 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# Default location for persistent caches, shared by every session on this machine
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "freestream")
+
+# Memory budget of the process-wide retriever cache, overridable per deployment
+DEFAULT_RETRIEVER_CACHE_BYTES = int(
+    os.environ.get("FREESTREAM_RETRIEVER_CACHE_BYTES", 2 * 1024**3)
+)
+
+# Memory budget for parsed files that no index holds any more, overridable per deployment
+DEFAULT_SEGMENT_STORE_BYTES = int(
+    os.environ.get("FREESTREAM_SEGMENT_STORE_BYTES", 256 * 1024**2)
+)
+
+# Number of recent search results each index keeps, overridable per deployment
+DEFAULT_QUERY_CACHE_SIZE = int(os.environ.get("FREESTREAM_QUERY_CACHE_SIZE", 256))
+
+# Seconds a session can go unseen before its uploads leave the shared index, overridable per
+# deployment
+DEFAULT_SESSION_TTL = float(os.environ.get("FREESTREAM_SESSION_TTL", 3600))
+
+# Bump when the on-disk entry layout changes so stale entries are never read
+CACHE_FORMAT_VERSION = 1
+
+# Disk budget of each model's persistent embedding store, overridable per deployment
+DEFAULT_EMBEDDING_STORE_BYTES = int(
+    os.environ.get("FREESTREAM_EMBEDDING_STORE_BYTES", 1024**3)
+)
+
+
+class DocumentCache:
+    """
+    A persistent, content-addressed cache of parsed documents and their chunks.
+
+    Entries are keyed by the SHA-256 of a file's bytes combined with the loader and splitter
+    settings, so a file that has been seen before skips parsing and splitting entirely, even
+    after a server restart. Each entry is stored as zlib-compressed JSON in its own file.
+    When the cache grows past `max_bytes`, the least recently used entries are evicted.
+
+    Attributes:
+        cache_dir (str): The directory holding the cache entries.
+        max_bytes (int): The maximum total size of the cache on disk.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024**3):
+        """
+        Initialize the DocumentCache object.
+
+        Args:
+            cache_dir (str): The directory holding the cache entries. It is created if missing.
+            max_bytes (int): The maximum total size of the cache on disk. Defaults to 1 GiB.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data: bytes, settings: Dict[str, Any]) -> str:
+        """
+        Build a cache key from a file's bytes and the settings used to process it.
+
+        Args:
+            data (bytes): The raw bytes of the file.
+            settings (dict): The loader and splitter settings. Must be JSON-serializable.
+
+        Returns:
+            str: A hex digest identifying the file contents and settings.
+        """
+        digest = hashlib.sha256(data)
+        digest.update(
+            json.dumps(
+                {"version": CACHE_FORMAT_VERSION, **settings}, sort_keys=True
+            ).encode()
+        )
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json.z")
+
+    def get(self, key: str) -> Optional[Tuple[List[Document], List[Document]]]:
+        """
+        Look up the documents and chunks stored under a key.
+
+        Args:
+            key (str): The cache key, as returned by `make_key`.
+
+        Returns:
+            tuple: The parsed documents and their chunks, or `None` on a cache miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = json.loads(zlib.decompress(f.read()))
+            # Mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning("Discarding unreadable cache entry %s: %s", key, e)
+            self._remove(path)
+            return None
+
+        docs = [Document(**doc) for doc in payload["docs"]]
+        chunks = [Document(**chunk) for chunk in payload["chunks"]]
+        return docs, chunks
+
+    def put(self, key: str, docs: List[Document], chunks: List[Document]):
+        """
+        Store the documents and chunks for a key, then evict entries if over budget.
+
+        Args:
+            key (str): The cache key, as returned by `make_key`.
+            docs (List[Document]): The parsed documents.
+            chunks (List[Document]): The chunks split from the documents.
+        """
+        payload = {
+            "docs": [
+                {"page_content": d.page_content, "metadata": d.metadata} for d in docs
+            ],
+            "chunks": [
+                {"page_content": c.page_content, "metadata": c.metadata} for c in chunks
+            ],
+        }
+        data = zlib.compress(json.dumps(payload, default=str).encode(), 6)
+
+        # Write atomically so concurrent readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            logger.warning("Failed to write cache entry %s: %s", key, e)
+            self._remove(temp_path)
+            return
+
+        self.evict()
+
+    def size(self) -> int:
+        """
+        Return the total size of the cache entries on disk, in bytes.
+        """
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits within `max_bytes`.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                logger.info("Evicted cache entry: %s", os.path.basename(path))
+
+    def _entries(self) -> List[Tuple[str, float, int]]:
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json.z"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class RetrieverCache:
+    """
+    A process-wide, memory-budgeted LRU cache of document indexes.
+
+    Each entry is an object exposing `memory_usage()`, returning a dict of byte counts with a
+    "total" key, and `close()`, which releases its resources. An entry's size is re-measured
+    whenever it is stored or looked up, so indexes that are still growing are accounted for.
+    When the total passes `max_bytes`, the least recently used entries are closed and dropped.
+    Entries can be attributed to an owner, e.g. a Streamlit session, for per-owner accounting;
+    see `SessionIndexes.usage` for how the index shared by every session's uploads is charged.
+
+    Attributes:
+        max_bytes (int): The memory budget of the cache.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Initialize the RetrieverCache object.
+
+        Args:
+            max_bytes (int): The memory budget of the cache.
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Any, Tuple[Any, int, Optional[str]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        """
+        Look up an entry and mark it as recently used.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            The cached entry, or `None` on a cache miss.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            value, _, owner = self._entries[key]
+        self._store(key, value, owner)
+        return value
+
+    def put(self, key: Any, value: Any, owner: Optional[str] = None):
+        """
+        Store an entry, then evict least recently used entries if over budget.
+
+        Args:
+            key: The key of the entry.
+            value: The entry. Must provide `memory_usage()` and `close()`.
+            owner (str, optional): The session the entry belongs to. `None` for shared entries.
+        """
+        self._store(key, value, owner)
+
+    def _store(self, key: Any, value: Any, owner: Optional[str]):
+        size = value.memory_usage()["total"]
+        evicted = []
+        with self._lock:
+            self._entries[key] = (value, size, owner)
+            self._entries.move_to_end(key)
+            total = sum(size for _, size, _ in self._entries.values())
+            # Never evict the entry being used
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, (old_value, old_size, old_owner) = self._entries.popitem(last=False)
+                total -= old_size
+                evicted.append((old_value, old_size, old_owner))
+
+        for old_value, old_size, old_owner in evicted:
+            logger.info(
+                "Evicted retriever of %s (%d bytes)",
+                old_owner or "shared cache",
+                old_size,
+            )
+            old_value.close()
+        if evicted:
+            logger.info("Retriever cache usage: %d of %d bytes", total, self.max_bytes)
+        if total > self.max_bytes:
+            logger.warning(
+                "Retriever of %s alone exceeds the cache budget: %d of %d bytes",
+                owner or "shared cache",
+                size,
+                self.max_bytes,
+            )
+
+    def size(self, key: Any) -> Optional[int]:
+        """
+        The size of an entry when it was last measured, without marking it as used.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            int: The entry's size in bytes, or `None` if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[1]
+
+    def usage(self) -> Dict[str, Any]:
+        """
+        Report the current memory usage of the cache.
+
+        Returns:
+            dict: The number of entries, the total and maximum bytes, and the bytes used by
+                each owner ("shared" for entries without one).
+        """
+        with self._lock:
+            sessions: Dict[str, int] = {}
+            for _, size, owner in self._entries.values():
+                sessions[owner or "shared"] = sessions.get(owner or "shared", 0) + size
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(sessions.values()),
+                "max_bytes": self.max_bytes,
+                "sessions": sessions,
+            }
+
+
+class FileSegment(NamedTuple):
+    """
+    The parsed documents and chunks of one file, shared read-only by every index holding it.
+    """
+
+    docs: List[Document]
+    chunks: List[Document]
+    nbytes: int
+
+
+class SegmentStore:
+    """
+    A process-wide, reference-counted store of parsed files, keyed by their document cache key.
+
+    However many sessions upload a file, it is parsed and split once per process, and every
+    index holding it reuses the same text. Indexes `acquire` the files they hold and `release`
+    them when they drop them. Segments no index holds are kept for later uploads until their
+    total size passes `max_bytes`, when the least recently released are dropped.
+
+    Attributes:
+        max_bytes (int): The budget for segments no index holds.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_SEGMENT_STORE_BYTES):
+        """
+        Initialize the SegmentStore object.
+
+        Args:
+            max_bytes (int): The budget for segments no index holds. Defaults to the
+                `FREESTREAM_SEGMENT_STORE_BYTES` environment variable, or 256 MiB.
+        """
+        self.max_bytes = max_bytes
+        self._segments: "OrderedDict[str, FileSegment]" = OrderedDict()
+        self._holders: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[FileSegment]:
+        """
+        Look up the segment of a file.
+
+        Args:
+            key (str): The cache key of the file.
+
+        Returns:
+            FileSegment: The segment, or `None` if the file is not in the store.
+        """
+        with self._lock:
+            return self._segments.get(key)
+
+    def put(
+        self, key: str, docs: List[Document], chunks: List[Document]
+    ) -> FileSegment:
+        """
+        Store the parsed documents and chunks of a file, unless another index stored them first.
+
+        The documents must not be changed afterwards.
+
+        Args:
+            key (str): The cache key of the file.
+            docs (List[Document]): The file's documents.
+            chunks (List[Document]): The file's chunks.
+
+        Returns:
+            FileSegment: The stored segment.
+        """
+        nbytes = sum(sys.getsizeof(doc.page_content) for doc in docs + chunks)
+        with self._lock:
+            if key not in self._segments:
+                self._segments[key] = FileSegment(docs, chunks, nbytes)
+                self._holders[key] = set()
+                self._trim(keep=key)
+            return self._segments[key]
+
+    def acquire(self, key: str, holder: str):
+        """
+        Record that an index holds a stored file, so the file is kept.
+
+        Args:
+            key (str): The cache key of the file.
+            holder (str): The ID of the index.
+        """
+        with self._lock:
+            if key in self._segments:
+                self._holders[key].add(holder)
+
+    def release(self, key: str, holder: str):
+        """
+        Record that an index no longer holds a file.
+
+        Args:
+            key (str): The cache key of the file.
+            holder (str): The ID of the index.
+        """
+        with self._lock:
+            holders = self._holders.get(key)
+            if holders is None or holder not in holders:
+                return
+            holders.discard(holder)
+            if not holders:
+                self._segments.move_to_end(key)
+                self._trim()
+
+    def _trim(self, keep: Optional[str] = None):
+        unheld = [
+            key for key in self._segments if not self._holders[key] and key != keep
+        ]
+        total = sum(self._segments[key].nbytes for key in unheld)
+        for key in unheld:
+            if total <= self.max_bytes:
+                break
+            total -= self._segments.pop(key).nbytes
+            del self._holders[key]
+
+    def charge(self, keys: List[str]) -> int:
+        """
+        Return an index's share of the memory of the files it holds.
+
+        Each file's bytes are split evenly between the indexes holding it, so the shares of
+        all indexes add up to the memory of the files they hold.
+
+        Args:
+            keys (List[str]): The cache keys of the files the index holds.
+
+        Returns:
+            int: The index's share, in bytes.
+        """
+        with self._lock:
+            return int(
+                sum(
+                    self._segments[key].nbytes / max(len(self._holders[key]), 1)
+                    for key in keys
+                    if key in self._segments
+                )
+            )
+
+    def usage(self) -> Dict[str, int]:
+        """
+        Report the current contents of the store.
+
+        Returns:
+            dict: The number of segments and their bytes, and how many of them are held.
+        """
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "held": sum(1 for holders in self._holders.values() if holders),
+                "bytes": sum(segment.nbytes for segment in self._segments.values()),
+            }
+
+
+def normalize_query(query: str) -> str:
+    """
+    Reduce a query to a form that ignores case, spacing and trailing punctuation.
+
+    Args:
+        query (str): The query text.
+
+    Returns:
+        str: The normalized query.
+    """
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+class QueryResult(NamedTuple):
+    """
+    A cached search result: the chunks found, their scores, and the context built from them.
+    """
+
+    ids: List[str]
+    scores: List[float]
+    context: Optional[List[Document]] = None
+
+
+class QueryCache:
+    """
+    An LRU cache of search results for one index, keyed by normalized query.
+
+    Each entry is tagged with the version of the index it was found in. Looking up or storing
+    a result for a newer version clears the cache, so results never outlive a change to the
+    index, and results of older versions are never stored.
+
+    Attributes:
+        max_entries (int): The maximum number of results kept.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups the cache could not answer.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_QUERY_CACHE_SIZE):
+        """
+        Initialize the QueryCache object.
+
+        Args:
+            max_entries (int): The maximum number of results kept. Defaults to the
+                `FREESTREAM_QUERY_CACHE_SIZE` environment variable, or 256.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._entries: "OrderedDict[Tuple, QueryResult]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: Any) -> bool:
+        if version != self._version:
+            if self._version is not None and version < self._version:
+                return False
+            self._entries.clear()
+            self._version = version
+        return True
+
+    def get(self, version: Any, query: str, scope: Tuple = ()) -> Optional[QueryResult]:
+        """
+        Look up the result of a query and mark it as recently used.
+
+        Args:
+            version: The current version of the index. Versions must increase over time.
+            query (str): The query text.
+            scope (tuple): Anything else the result depends on, e.g. filters and search settings.
+
+        Returns:
+            QueryResult: The stored result, or `None` on a cache miss.
+        """
+        key = (normalize_query(query), scope)
+        with self._lock:
+            result = self._entries.get(key) if self._check_version(version) else None
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(
+        self,
+        version: Any,
+        query: str,
+        ids: List[str],
+        scores: List[float],
+        scope: Tuple = (),
+        context: Optional[List[Document]] = None,
+    ):
+        """
+        Store the result of a query, evicting the least recently used result if full.
+
+        Args:
+            version: The version of the index the result was found in.
+            query (str): The query text.
+            ids (List[str]): The IDs of the chunks found.
+            scores (List[float]): The score of each chunk.
+            scope (tuple): Anything else the result depends on, as passed to `get`.
+            context (List[Document], optional): The documents handed to the LLM for the
+                result, e.g. after compression, so a hit needs no further work.
+        """
+        key = (normalize_query(query), scope)
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._entries[key] = QueryResult(list(ids), list(scores), context)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every result, keeping the hit and miss counts.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of lookups answered from the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class EmbeddingStore:
+    """
+    A persistent store of chunk embeddings, keyed by model and normalized chunk text.
+
+    Vectors are appended to a float32 file that is read through a memory map, so looking up
+    a vector never loads the whole store, and an index file records the text hash of each row.
+    Both files are append-only: the index is written after the vectors, so a crash can at worst
+    leave unindexed rows, which are ignored when the store is reopened. Once the store reaches
+    `max_bytes` it stops growing, but keeps serving the vectors it holds.
+
+    Attributes:
+        store_dir (str): The directory holding the store's files.
+        model_name (str): The model whose embeddings are stored.
+        max_bytes (int): The maximum size of the vector file.
+        hits (int): The number of lookups answered from the store.
+        misses (int): The number of lookups the store could not answer.
+    """
+
+    def __init__(
+        self,
+        store_dir: str,
+        model_name: str,
+        max_bytes: int = DEFAULT_EMBEDDING_STORE_BYTES,
+    ):
+        """
+        Initialize the EmbeddingStore object and read its index.
+
+        Args:
+            store_dir (str): The directory holding the store's files. It is created if missing.
+            model_name (str): The model whose embeddings are stored.
+            max_bytes (int): The maximum size of the vector file. Defaults to 1 GiB.
+        """
+        self.store_dir = store_dir
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        os.makedirs(store_dir, exist_ok=True)
+        self._vectors_path = os.path.join(store_dir, "vectors.f32")
+        self._index_path = os.path.join(store_dir, "index.txt")
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._index_path) as f:
+                header = f.readline().rstrip("\n").split(" ", 2)
+                digests = f.read().split("\n")
+        except FileNotFoundError:
+            return
+        if header[0] != str(CACHE_FORMAT_VERSION) or header[2:] != [self.model_name]:
+            logger.warning(
+                "Discarding embedding store of another format or model: %s",
+                self.store_dir,
+            )
+            self.clear()
+            return
+        self._dim = int(header[1])
+        try:
+            rows = os.path.getsize(self._vectors_path) // (4 * self._dim)
+        except FileNotFoundError:
+            rows = 0
+        # Drop the tail of an interrupted write: a partial digest, or digests without a vector
+        valid = 0
+        while valid < min(len(digests), rows) and len(digests[valid]) == 40:
+            valid += 1
+        self._rows = {digest: row for row, digest in enumerate(digests[:valid])}
+        if digests[valid:] != [""]:
+            self._write_index()
+        logger.info("Opened embedding store with %d vectors: %s", valid, self.store_dir)
+
+    def _write_index(self):
+        with open(self._index_path, "w") as f:
+            f.write(f"{CACHE_FORMAT_VERSION} {self._dim} {self.model_name}\n")
+            f.write("".join(f"{key}\n" for key in self._rows))
+
+    def key(self, text: str) -> str:
+        """
+        Hash a chunk's text, with its whitespace collapsed, together with the model name.
+
+        Args:
+            text (str): The text of the chunk.
+
+        Returns:
+            str: A hex digest identifying the text and model.
+        """
+        normalized = " ".join(text.split())
+        return hashlib.sha1(f"{self.model_name}\0{normalized}".encode()).hexdigest()
+
+    def get(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up stored embeddings.
+
+        Args:
+            keys (List[str]): The keys of the chunks, as returned by `key`.
+
+        Returns:
+            list: One vector per key, or `None` where the store has no vector for it.
+        """
+        with self._lock:
+            rows = [self._rows.get(key) for key in keys]
+            found = [row for row in rows if row is not None]
+            if found and (self._vectors is None or max(found) >= len(self._vectors)):
+                self._vectors = np.memmap(
+                    self._vectors_path,
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(len(self._rows), self._dim),
+                )
+            vectors = [
+                None if row is None else np.array(self._vectors[row]) for row in rows
+            ]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return vectors
+
+    def put(self, keys: List[str], vectors: List[List[float]]):
+        """
+        Append embeddings that are not stored yet.
+
+        Args:
+            keys (List[str]): The keys of the chunks, as returned by `key`.
+            vectors (List[List[float]]): The embeddings of the chunks.
+        """
+        with self._lock:
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self._rows:
+                    new[key] = vector
+            if not new:
+                return
+            array = np.asarray(list(new.values()), dtype=np.float32)
+            if self._dim is None:
+                self._dim = array.shape[1]
+                self._write_index()
+            if (len(self._rows) + len(new)) * self._dim * 4 > self.max_bytes:
+                return
+            try:
+                with open(self._vectors_path, "ab") as f:
+                    # Truncate any partial row left by an interrupted write
+                    f.truncate(len(self._rows) * self._dim * 4)
+                    f.write(array.tobytes())
+                with open(self._index_path, "a") as f:
+                    f.write("".join(f"{key}\n" for key in new))
+            except OSError as e:
+                logger.warning("Failed to write to the embedding store: %s", e)
+                return
+            for key in new:
+                self._rows[key] = len(self._rows)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of lookups answered from the store.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def size(self) -> int:
+        """
+        Return the size of the vector file on disk, in bytes.
+        """
+        try:
+            return os.path.getsize(self._vectors_path)
+        except FileNotFoundError:
+            return 0
+
+    def clear(self):
+        """
+        Delete every stored embedding.
+        """
+        self._rows = {}
+        self._dim = None
+        self._vectors = None
+        for path in (self._vectors_path, self._index_path):
+            DocumentCache._remove(path)
@@ -1,21 +1,833 @@
+import csv
+import io
+import itertools
+import json
 import logging
+import multiprocessing
 import os
 import tempfile
+import threading
+import time
 import sys
-from typing import List
+import uuid
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import closing
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
+import numpy as np
 import streamlit as st
-import torch
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.document_loaders import UnstructuredFileLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pypdf import PdfReader
+
+from .cache_operators import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_RETRIEVER_CACHE_BYTES,
+    DEFAULT_QUERY_CACHE_SIZE,
+    DEFAULT_SEGMENT_STORE_BYTES,
+    DEFAULT_SESSION_TTL,
+    DocumentCache,
+    FileSegment,
+    QueryCache,
+    RetrieverCache,
+    SegmentStore,
+)
+from .compression_operators import DEFAULT_COMPRESS_TOKENS, ContextCompressor
+from .dedup_operators import ChunkDeduplicator
+from .embedding_operators import get_embedding_engine
+from .filter_operators import MetadataIndex
+from .lexical_operators import (
+    DEFAULT_LEXICAL_MODE,
+    LEXICAL_MODES,
+    PREFILTER_HITS,
+    BM25Index,
+    reciprocal_rank_fusion,
+)
+from .vector_operators import (
+    DEFAULT_REDUCE_DIM,
+    DEFAULT_REDUCTION,
+    DEFAULT_VECTOR_STORAGE,
+    INDEX_TYPES,
+    MIN_TRAINING_VECTORS,
+    ExactVectors,
+    MappedUnitVectors,
+    UnitVectors,
+    VectorProjection,
+    choose_index_type,
+    configure_search,
+    create_faiss_index,
+    index_type_of,
+    maximal_marginal_relevance,
+    search_candidates,
+    vector_bytes,
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
+# Pools are started from indexing threads, next to Streamlit's and the embedding engine's own
+# threads, where forking could copy a lock mid-use into the worker, so workers are spawned
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Create a process pool whose workers are spawned rather than forked.
+
+    Args:
+        max_workers (int): The number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: The pool.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=_MP_CONTEXT)
+
+
+def _shutdown_pool(executor: ProcessPoolExecutor, futures: Collection[Future]):
+    """
+    Shut a process pool down without waiting on its workers.
+
+    Queued work is cancelled. If any of `futures` is still running, e.g. a file parsing past
+    its timeout, the workers are terminated so the task doesn't keep a core busy after its
+    result has been given up on.
+
+    Args:
+        executor (ProcessPoolExecutor): The pool.
+        futures (Collection[Future]): The tasks submitted to it that may still be running.
+    """
+    running = any(not future.done() for future in futures)
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    if running:
+        for process in processes:
+            process.terminate()
+        logger.warning("Terminated %d parsing worker(s)", len(processes))
+
+
+def _load_file(filepath: str) -> List[Document]:
+    """
+    Parse a single file into documents with Unstructured.
+
+    This is a module-level function so it can be pickled and run inside a worker process.
+
+    Args:
+        filepath (str): The path of the file to parse.
+
+    Returns:
+        List[Document]: The documents parsed from the file.
+    """
+    loader = UnstructuredFileLoader(filepath)
+    return loader.load()
+
+
+def _load_pdf_pages(filepath: str, start: int, stop: int) -> List[Document]:
+    """
+    Extract the text of a range of pages from a PDF, one document per page.
+
+    This is a module-level function so it can be pickled and run inside a worker process.
+    Only the requested pages are parsed.
+
+    Args:
+        filepath (str): The path of the PDF.
+        start (int): The index of the first page to extract.
+        stop (int): The index one past the last page to extract.
+
+    Returns:
+        List[Document]: The pages, with their zero-based page number in `metadata["page"]`.
+    """
+    reader = PdfReader(filepath)
+    return [
+        Document(
+            page_content=reader.pages[idx].extract_text(),
+            metadata={"source": filepath, "page": idx},
+        )
+        for idx in range(start, stop)
+    ]
+
+
+def _decode(data: bytes) -> str:
+    """
+    Decode file bytes as UTF-8, tolerating a byte order mark and invalid sequences.
+    """
+    return data.decode("utf-8-sig", errors="replace")
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    Collect the visible text of an HTML document, skipping scripts and styles.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip and data.strip():
+            self.parts.append(data.strip())
+
+
+def _load_text(data: bytes) -> str:
+    return _decode(data)
+
+
+def _load_html(data: bytes) -> str:
+    parser = _HTMLTextExtractor()
+    parser.feed(_decode(data))
+    parser.close()
+    return "\n".join(parser.parts)
+
+
+def _load_csv(data: bytes) -> str:
+    rows = csv.reader(io.StringIO(_decode(data)))
+    return "\n".join(", ".join(row) for row in rows)
+
+
+def _load_ipynb(data: bytes) -> str:
+    notebook = json.loads(_decode(data))
+    cells = []
+    for cell in notebook.get("cells", []):
+        source = cell.get("source", "")
+        cells.append("".join(source) if isinstance(source, list) else source)
+    return "\n\n".join(cells)
+
+
+# Lightweight in-memory decoders for plain-text formats, keyed by file extension.
+# Anything not listed here is parsed by Unstructured.
+TEXT_LOADERS: Dict[str, Callable[[bytes], str]] = {
+    ".txt": _load_text,
+    ".md": _load_text,
+    ".py": _load_text,
+    ".log": _load_text,
+    ".json": _load_text,
+    ".csv": _load_csv,
+    ".html": _load_html,
+    ".ipynb": _load_ipynb,
+}
+
+
+def get_loader_name(filename: str) -> str:
+    """
+    Return the name of the loader that handles a file, based on its extension.
+
+    Args:
+        filename (str): The name of the file.
+
+    Returns:
+        str: The name of the in-memory decoder, or "UnstructuredFileLoader".
+    """
+    loader = TEXT_LOADERS.get(os.path.splitext(filename)[1].lower())
+    return loader.__name__ if loader else "UnstructuredFileLoader"
+
+
+@dataclass
+class IndexingProgress:
+    """
+    The progress of an indexing run, counted separately for each pipeline stage.
+
+    Attributes:
+        files_total (int): The number of files to load.
+        files_loaded (int): The number of files loaded and split so far.
+        chunks_split (int): The number of chunks split from the files loaded so far.
+        chunks_collapsed (int): The number of chunks found to duplicate another chunk so far.
+        chunks_indexed (int): The number of chunks embedded and added to the index so far.
+        chunks_embedded (int): The number of chunks run through the embedding model so far.
+        embed_seconds (float): The time spent embedding those chunks.
+        done (bool): Whether the run has finished.
+    """
+
+    files_total: int = 0
+    files_loaded: int = 0
+    chunks_split: int = 0
+    chunks_collapsed: int = 0
+    chunks_indexed: int = 0
+    chunks_embedded: int = 0
+    embed_seconds: float = 0.0
+    done: bool = True
+
+    @property
+    def chunks_per_second(self) -> float:
+        """
+        The embedding throughput of the run so far.
+        """
+        return self.chunks_embedded / self.embed_seconds if self.embed_seconds else 0.0
+
+
+class _ChunkItem(NamedTuple):
+    """
+    A chunk on its way through the indexing pipeline.
+    """
+
+    key: str
+    id: str
+    chunk: Document
+    last: bool
+    duplicate: bool = False
+
+
+class IndexRetriever(BaseRetriever):
+    """
+    A retriever over the index of a `RetrieveDocuments` instance.
+
+    Searches take the index's lock, so the retriever can be queried while files are still
+    being added to or removed from the index on another thread. Results are trimmed to the
+    index's context token budget.
+
+    Results are kept in the index's query cache, so asking the same question again, up to
+    case, spacing and trailing punctuation, skips both the query embedding and the search
+    until the index changes. With a context compressor, results are then cut down to their
+    sentences most similar to the query; the cache keeps the compressed context, so a repeat
+    question is not compressed again either.
+
+    A retriever scoped to `files` only searches those files' chunks, and reports each chunk
+    under the names given for them, so an index shared by several sessions shows every
+    session its own file names and nothing of the other sessions' files.
+
+    Attributes:
+        index (RetrieveDocuments): The instance whose vector database is searched.
+        search_kwargs (dict): Keyword arguments for the maximal marginal relevance search.
+        filters (dict): The accepted metadata values of each field searches are scoped to,
+            e.g. `{"source": ["contract.pdf"]}`, or `None` to search every chunk.
+        files (dict): The cache keys of the files searches are scoped to, each with the name
+            its chunks are reported under, or `None` to search every file under its indexed
+            source.
+    """
+
+    index: Any
+    search_kwargs: dict
+    filters: Optional[Dict[str, list]] = None
+    files: Optional[Dict[str, str]] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        cache = self.index.query_cache
+        scope = (
+            tuple(
+                sorted(
+                    (field, tuple(values))
+                    for field, values in (self.filters or {}).items()
+                )
+            ),
+            tuple(sorted(self.search_kwargs.items())),
+            tuple(sorted((self.files or {}).items())),
+        )
+        if cache is not None:
+            with self.index.lock:
+                version = self.index.version
+            cached = cache.get(version, query, scope)
+            if cached is not None:
+                with self.index.lock:
+                    # Only use the result if the index hasn't changed since the lookup
+                    if self.index.version == version and cached.context is not None:
+                        return list(cached.context)
+
+        # Embed outside the lock so queries don't stall ingestion
+        embedding = self.index.embeddings.embed_query(query)
+        with self.index.lock:
+            within = None
+            if self.files is not None:
+                within = {
+                    id
+                    for key in self.files
+                    for id in self.index.file_chunk_ids.get(key, ())
+                }
+            if self.filters:
+                matches = self.index.metadata_index.ids(**self.filters)
+                within = matches if within is None else within & matches
+            ids, scores = self.index.search_ids(
+                embedding, text=query, within=within, **self.search_kwargs
+            )
+            version = self.index.version
+            docs = [self._document(id) for id in ids]
+        context = self.index.fit_context(self.index.compress(query, docs, embedding))
+        if cache is not None:
+            cache.put(version, query, ids, scores, scope, context)
+        return context
+
+    def _document(self, id: str) -> Document:
+        """
+        Look up a chunk, named after the scoped files it belongs to.
+        """
+        doc = self.index.vectordb.docstore.search(id)
+        if self.files is None:
+            return doc
+        owners = self.index.chunk_owners.get(id, {})
+        keys = [key for key in owners if key in self.files]
+        if not keys:
+            return doc
+        metadata = {
+            **owners[keys[0]],
+            "source": self.files[keys[0]],
+            "sources": sorted({self.files[key] for key in keys}),
+        }
+        return Document(page_content=doc.page_content, metadata=metadata)
+
+
+@st.cache_resource
+def get_retriever_cache(
+    max_bytes: int = DEFAULT_RETRIEVER_CACHE_BYTES,
+) -> RetrieverCache:
+    """
+    Return the process-wide retriever cache, shared by every session.
+
+    Args:
+        max_bytes (int): The memory budget of the cache. Defaults to the
+            `FREESTREAM_RETRIEVER_CACHE_BYTES` environment variable, or 2 GiB.
+
+    Returns:
+        RetrieverCache: The retriever cache.
+    """
+    return RetrieverCache(max_bytes)
+
+
+@st.cache_resource
+def get_segment_store(max_bytes: int = DEFAULT_SEGMENT_STORE_BYTES) -> SegmentStore:
+    """
+    Return the process-wide store of parsed files, shared by every session.
+
+    Args:
+        max_bytes (int): The budget for files no index holds. Defaults to the
+            `FREESTREAM_SEGMENT_STORE_BYTES` environment variable, or 256 MiB.
+
+    Returns:
+        SegmentStore: The segment store.
+    """
+    return SegmentStore(max_bytes)
+
+
+class SessionIndex:
+    """
+    A session's view of the index shared by every session's uploads.
+
+    Its retriever only searches the session's own files, and names their chunks after the
+    session's own uploads, so nothing of the other sessions' files shows through.
+
+    Attributes:
+        index (RetrieveDocuments): The shared index.
+        files (dict): The cache keys of the session's files, each with the name the session
+            uploaded it under.
+        upload_keys (dict): The cache key of each upload, by its Streamlit file ID, so an
+            upload is hashed once rather than on every rerun.
+        last_seen (float): When the session last used the index, from `time.monotonic`.
+    """
+
+    def __init__(self, indexes: "SessionIndexes", index: "RetrieveDocuments"):
+        """
+        Initialize the SessionIndex object.
+
+        Args:
+            indexes (SessionIndexes): The registry the session belongs to.
+            index (RetrieveDocuments): The shared index.
+        """
+        self.indexes = indexes
+        self.index = index
+        self.files: Dict[str, str] = {}
+        self.upload_keys: Dict[str, str] = {}
+        self.last_seen = time.monotonic()
+
+    @property
+    def progress(self) -> IndexingProgress:
+        """
+        The progress of the session's files through the shared indexing run.
+
+        Files are counted for the session alone, chunks for the whole run, which may include
+        files of other sessions.
+        """
+        keys = list(self.files)
+        pending = self.indexes.pending(keys)
+        run = self.index.progress
+        return IndexingProgress(
+            files_total=len(keys),
+            files_loaded=len(self.index.indexed_files(keys)),
+            chunks_split=run.chunks_split,
+            chunks_collapsed=run.chunks_collapsed,
+            chunks_indexed=run.chunks_indexed,
+            chunks_embedded=run.chunks_embedded,
+            embed_seconds=run.embed_seconds,
+            done=not pending,
+        )
+
+    @property
+    def retriever(self) -> Optional[IndexRetriever]:
+        """
+        A retriever over the session's files, or `None` until any of their chunks are indexed.
+        """
+        with self.index.lock:
+            if self.index.vectordb is None or not any(
+                self.index.file_chunk_ids.get(key) for key in self.files
+            ):
+                return None
+        return self.scoped_retriever()
+
+    def scoped_retriever(
+        self, names: Optional[Collection[str]] = None
+    ) -> IndexRetriever:
+        """
+        Return a retriever over some of the session's files.
+
+        Args:
+            names (Collection[str], optional): The names of the files to search. Defaults to
+                all of the session's files.
+
+        Returns:
+            IndexRetriever: The retriever.
+        """
+        return IndexRetriever(
+            index=self.index,
+            search_kwargs=self.index.search_kwargs,
+            files={
+                key: name
+                for key, name in self.files.items()
+                if names is None or name in names
+            },
+        )
+
+    def sources(self) -> List[str]:
+        """
+        The names of the session's files, sorted.
+        """
+        return sorted(set(self.files.values()))
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Report the session's share of the shared index's memory.
+
+        Each file is charged in equal parts to the sessions holding it, by its share of the
+        index's chunks.
+
+        Returns:
+            dict: The share of each part reported by `RetrieveDocuments.memory_usage`.
+        """
+        usage = self.index.memory_usage()
+        share = self.share(self.indexes.holders(), self.index.chunk_counts())
+        return {part: int(size * share) for part, size in usage.items()}
+
+    def share(self, holders: Counter, chunks: Dict[str, int]) -> float:
+        """
+        The fraction of the shared index charged to the session.
+
+        Args:
+            holders (Counter): The number of sessions holding each file, from `holders`.
+            chunks (dict): The number of chunks of each indexed file, from `chunk_counts`.
+
+        Returns:
+            float: The session's share, between 0 and 1.
+        """
+        total = sum(chunks.values())
+        if not total:
+            return 0.0
+        return (
+            sum(chunks.get(key, 0) / holders[key] for key in self.files if holders[key])
+            / total
+        )
+
+
+class SessionIndexes:
+    """
+    Indexes every session's uploads in one shared index, holding each distinct file once.
+
+    The shared index is kept in the retriever cache, and each session gets a `SessionIndex`
+    scoped to its own files, so memory grows with the number of distinct files rather than
+    with the number of sessions. New files are indexed on one background thread; a file that
+    another session has already uploaded is searchable straight away.
+
+    A file is removed from the shared index once no session holds it. Sessions that haven't
+    been seen for `session_ttl` seconds, e.g. closed browser tabs, let go of their files; if
+    one comes back, its files are indexed again, mostly from the document and embedding
+    caches. If the retriever cache evicts the shared index, the next session to use it
+    starts a new one.
+
+    Attributes:
+        retriever_cache (RetrieverCache): The cache the shared index is kept in.
+        session_ttl (float): Seconds a session can go unseen before its files are released.
+    """
+
+    _CACHE_KEY = ("uploads",)
+
+    def __init__(
+        self,
+        retriever_cache: RetrieverCache,
+        session_ttl: float = DEFAULT_SESSION_TTL,
+    ):
+        """
+        Initialize the SessionIndexes object.
+
+        Args:
+            retriever_cache (RetrieverCache): The cache the shared index is kept in.
+            session_ttl (float): Seconds a session can go unseen before its files are
+                released. Defaults to the `FREESTREAM_SESSION_TTL` environment variable,
+                or one hour.
+        """
+        self.retriever_cache = retriever_cache
+        self.session_ttl = session_ttl
+        self._index = None
+        self._kwargs = {}
+        self._sessions: Dict[str, SessionIndex] = {}
+        self._queued: Dict[str, Any] = {}
+        self._running = set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, uploaded_files: list, **kwargs) -> SessionIndex:
+        """
+        Return a session's view of the shared index, and queue its new files for indexing.
+
+        Args:
+            session_id (str): The ID of the session.
+            uploaded_files (list): The files currently uploaded in the session.
+            **kwargs: Keyword arguments for `RetrieveDocuments` when the shared index is
+                created. `segments` defaults to the process-wide segment store.
+
+        Returns:
+            SessionIndex: The session's view.
+        """
+        kwargs.setdefault("segments", get_segment_store())
+        with self._lock:
+            index = self._shared_index(kwargs)
+            session = self._sessions.get(session_id)
+            if session is None or session.index is not index:
+                session = self._sessions[session_id] = SessionIndex(self, index)
+        # File keys depend on the splitter settings, so the shared index computes them, once
+        # per upload
+        files = {}
+        upload_keys = {}
+        for file in uploaded_files:
+            file_id = getattr(file, "file_id", None)
+            key = session.upload_keys.get(file_id) or index.file_key(
+                file.name, file.getvalue()
+            )
+            if file_id is not None:
+                upload_keys[file_id] = key
+            files[key] = file
+        session.upload_keys = upload_keys
+        with self._lock:
+            session.files = {key: file.name for key, file in files.items()}
+            session.last_seen = time.monotonic()
+            if index is self._index:
+                self._prune()
+                self._sessions[session_id] = session
+                for key, file in files.items():
+                    if key not in index.file_chunk_ids and key not in self._running:
+                        self._queued.setdefault(key, file)
+                self._sweep()
+                if self._queued and self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run_indexing, daemon=True
+                    )
+                    self._thread.start()
+        return session
+
+    def release(self, session_id: str):
+        """
+        Let go of a session's files right away, e.g. once its user has removed every upload,
+        rather than when the session expires.
+
+        Args:
+            session_id (str): The ID of the session.
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None and session.index is self._index:
+                self._sweep()
+
+    def _shared_index(self, kwargs: dict) -> "RetrieveDocuments":
+        """
+        Return the shared index, creating it on first use or after an eviction.
+        """
+        index = self.retriever_cache.get(self._CACHE_KEY)
+        if index is None or index is not self._index:
+            index = RetrieveDocuments(**kwargs)
+            self.retriever_cache.put(self._CACHE_KEY, index)
+            self._index = index
+            self._kwargs = kwargs
+            self._queued = {}
+            self._running = set()
+        return index
+
+    def _prune(self):
+        """
+        Forget sessions that haven't been seen for `session_ttl` seconds.
+        """
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_seen > self.session_ttl:
+                del self._sessions[session_id]
+                logger.info("Session %s expired", session_id)
+
+    def _sweep(self):
+        """
+        Drop files that no session holds from the queue and the shared index.
+        """
+        held = {key for session in self._sessions.values() for key in session.files}
+        self._queued = {key: file for key, file in self._queued.items() if key in held}
+        # Files still being indexed are removed once their run ends
+        stale = [
+            key
+            for key in list(self._index.file_chunk_ids)
+            if key not in held and key not in self._running
+        ]
+        if stale:
+            self._index.remove_files(stale)
+
+    def _run_indexing(self):
+        while True:
+            with self._lock:
+                if not self._queued:
+                    self._thread = None
+                    return
+                index = self._index
+                files = self._queued
+                self._queued = {}
+                self._running = set(files)
+            try:
+                with closing(
+                    index.stream_index(
+                        list(files.values()), replace=False, keys=list(files)
+                    )
+                ) as stages:
+                    for _ in stages:
+                        # Stop feeding an index the retriever cache has evicted
+                        if index is not self._index:
+                            break
+            except Exception as e:
+                logger.error("Failed to index uploaded files: %s", e)
+            finally:
+                with self._lock:
+                    if index is self._index:
+                        self._running = set()
+                        self._sweep()
+
+    def pending(self, keys: Collection[str]) -> set:
+        """
+        Return which of some files are queued or being indexed.
+
+        Args:
+            keys (Collection[str]): The cache keys of the files.
+
+        Returns:
+            set: The keys of the files still to be indexed.
+        """
+        with self._lock:
+            return {key for key in keys if key in self._queued or key in self._running}
+
+    def holders(self) -> Counter:
+        """
+        Count the sessions holding each file.
+
+        Returns:
+            Counter: The number of sessions holding each cache key.
+        """
+        with self._lock:
+            return Counter(
+                key for session in self._sessions.values() for key in session.files
+            )
+
+    def usage(self) -> Dict[str, Any]:
+        """
+        Report the memory usage of the retriever cache, charging the shared index to sessions.
+
+        The shared index is kept in the cache without an owner, since every session uses it.
+        Its bytes, as last measured by the cache, are split between the sessions as in
+        `SessionIndex.memory_usage`, and only what no session is charged for, e.g. loaded
+        collections, is reported as "shared".
+
+        Returns:
+            dict: `RetrieverCache.usage`, with each session's share of the shared index under
+                its ID in "sessions".
+        """
+        usage = self.retriever_cache.usage()
+        with self._lock:
+            index = self._index
+            sessions = dict(self._sessions)
+        total = self.retriever_cache.size(self._CACHE_KEY)
+        if index is None or total is None or not sessions:
+            return usage
+        holders = self.holders()
+        chunks = index.chunk_counts()
+        shares = {
+            session_id: int(total * session.share(holders, chunks))
+            for session_id, session in sessions.items()
+        }
+        owners = dict(usage["sessions"])
+        # The cache may have re-measured the index in between; never report a negative rest
+        owners["shared"] = max(owners.get("shared", 0) - sum(shares.values()), 0)
+        usage["sessions"] = {**owners, **shares}
+        return usage
+
+    def touch(self, session_id: str):
+        """
+        Mark a session as recently seen and re-measure the shared index's memory.
+
+        Args:
+            session_id (str): The ID of the session.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_seen = time.monotonic()
+        self.retriever_cache.get(self._CACHE_KEY)
+
+    def build_index(self, uploaded_files: list) -> "RetrieveDocuments":
+        """
+        Index some files on their own, e.g. to save a session's files as a collection.
+
+        The shared index holds other sessions' files too, so it must never be saved as a
+        whole. Parsed files and embeddings come from the caches, so mostly the index itself
+        is built again.
+
+        Args:
+            uploaded_files (list): The files to index.
+
+        Returns:
+            RetrieveDocuments: A new index of the files, with the shared index's settings.
+        """
+        index = RetrieveDocuments(**self._kwargs)
+        index.update_retriever(uploaded_files)
+        return index
+
+
+@st.cache_resource
+def get_session_indexes() -> SessionIndexes:
+    """
+    Return the process-wide registry of session indexes, sharing one index kept in the
+    retriever cache.
+
+    Returns:
+        SessionIndexes: The registry.
+    """
+    return SessionIndexes(get_retriever_cache())
+
+
 class RetrieveDocuments:
     """
     A class for retrieving and managing documents for processing.
@@ -26,68 +838,1438 @@ class RetrieveDocuments:
     Attributes:
         uploaded_files (list): A list of uploaded files to be processed.
         docs (list): A list of documents loaded from the uploaded files.
-        temp_dir (TemporaryDirectory): A temporary directory for storing uploaded files.
+        temp_dir (TemporaryDirectory): A temporary directory for storing uploaded files, created on first use.
         text_splitter (RecursiveCharacterTextSplitter): An instance of a text splitter for dividing documents into chunks.
         vectordb (FAISS): A vector database for storing embeddings and facilitating document retrieval.
         retriever (Retriever): A configured retriever for retrieving documents based on embeddings.
-        embeddings (HuggingFaceEmbeddings): An instance for generating embeddings for document chunks.
+        embeddings (EmbeddingEngine): The shared embedding model used for document chunks and queries.
+        chunking (str): How chunks are sized, either "characters" or "tokens".
+        search_kwargs (dict): Keyword arguments for the maximal marginal relevance search.
+        max_context_tokens (int): The maximum number of tokens of retrieved context per question, or `None`.
+        max_workers (int): The number of worker processes used to parse uploaded files.
+        lazy_pdf_bytes (int): The size above which PDFs are streamed page by page, or `None`.
+        pages_per_task (int): The number of pages of a streamed PDF extracted by each worker task.
+        parse_timeout (float): Seconds to wait for a batch of files to parse before skipping the stragglers.
+        cache (DocumentCache): A persistent cache of parsed documents and chunks, or `None` if disabled.
+        file_docs (dict): The documents of each indexed file, keyed by the file's cache key.
+        file_chunk_ids (dict): The vector IDs of each indexed file's chunks, keyed by the file's cache key.
+        chunk_owners (dict): The chunk metadata of every file sharing a vector, keyed by vector ID and file key.
+        deduplicator (ChunkDeduplicator): Finds duplicate chunks before they are embedded, or `None` if disabled.
+        vector_storage (str): How the index stores vectors: "float32", "float16" or "int8".
+        exact_vectors (ExactVectors): Full-precision copies of a compact index's vectors, or `None`.
+        unit_vectors (UnitVectors): Normalized copies of the index's vectors for MMR, or `None` until the first search.
+            Read-only collections read them on demand through `MappedUnitVectors` instead.
+        lexical (str): How lexical search is combined with dense search: "off", "hybrid" or "prefilter".
+        bm25 (BM25Index): The lexical index of the chunks, or `None` if lexical search is off.
+        metadata_index (MetadataIndex): Maps the source, page and file type of chunks to their IDs, for scoped searches.
+        segments (SegmentStore): The process-wide store of parsed files this instance shares text through, or `None`.
+        query_cache (QueryCache): Recent search results of the retriever, or `None` if disabled.
+        version (int): Increases whenever chunks are added to or removed from the index.
+        compressor (ContextCompressor): Cuts retrieved chunks down to their most relevant sentences, or `None`.
+        projection (VectorProjection): Reduces embeddings before they are indexed or searched, or `None`.
+        index_type (str): The type of index to build: "auto", "flat", "ivf", "ivfpq" or "hnsw".
+        nprobe (int): The number of lists an IVF index scans per query, or `None` for a default.
+        ef_search (int): The candidate list size of an HNSW search, or `None` for a default.
+        read_only (bool): Whether the index is a memory-mapped collection that cannot be changed.
+        lock (RLock): Guards the vector database and file records against concurrent updates and searches.
+        progress (IndexingProgress): The progress of the latest indexing run.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        parse_timeout: Optional[float] = 600,
+        cache_dir: Optional[str] = os.path.join(DEFAULT_CACHE_DIR, "documents"),
+        cache_max_bytes: int = 1024**3,
+        chunking: str = "characters",
+        max_context_tokens: Optional[int] = None,
+        deduplicate: bool = True,
+        lazy_pdf_bytes: Optional[int] = 20 * 1024**2,
+        pages_per_task: int = 16,
+        embeddings: Optional[Embeddings] = None,
+        vector_storage: str = DEFAULT_VECTOR_STORAGE,
+        reduce_dim: Optional[int] = DEFAULT_REDUCE_DIM,
+        reduction: str = DEFAULT_REDUCTION,
+        index_type: str = "auto",
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        lexical: str = DEFAULT_LEXICAL_MODE,
+        segments: Optional[SegmentStore] = None,
+        query_cache_size: int = DEFAULT_QUERY_CACHE_SIZE,
+        compress_tokens: Optional[int] = DEFAULT_COMPRESS_TOKENS,
+    ):
         """
-        Initialize the RetrieveDocuments class with a list of uploaded files.
+        Initialize the RetrieveDocuments class.
 
         Args:
-            uploaded_files (list): A list of uploaded files to be processed.
+            max_workers (int, optional): The number of worker processes used to parse uploaded files.
+                Defaults to the number of CPU cores.
+            parse_timeout (float, optional): Seconds to wait for a batch of files to parse. Files that
+                are still parsing afterwards are skipped, and their workers terminated. `None` waits
+                indefinitely.
+            cache_dir (str, optional): The directory for the persistent document cache. `None` disables it.
+            cache_max_bytes (int): The maximum size of the document cache on disk. Defaults to 1 GiB.
+            chunking (str): How chunks are sized. "characters" splits at 10,000 characters;
+                "tokens" splits at the embedding model's maximum sequence length, less its
+                special tokens, measured with its own tokenizer, so no part of a chunk is
+                silently ignored when it is embedded.
+            max_context_tokens (int, optional): The maximum number of tokens of retrieved context
+                handed to the LLM per question. `None` disables the cap.
+            deduplicate (bool): Whether to collapse exact and near-duplicate chunks into one vector.
+            lazy_pdf_bytes (int, optional): PDFs larger than this are streamed page by page when
+                indexed, keeping memory flat regardless of their size. `None` disables streaming.
+            pages_per_task (int): The number of pages of a streamed PDF extracted by each worker task.
+            embeddings (Embeddings, optional): The embedding model. Defaults to the process-wide
+                engine from `get_embedding_engine`, so no model is loaded per instance.
+            vector_storage (str): How the index stores vectors. "float16" halves and "int8"
+                quarters their memory; searches on either re-rank their candidates against
+                full-precision copies kept on disk. Defaults to the `FREESTREAM_VECTOR_STORAGE`
+                environment variable, or "float32".
+            reduce_dim (int, optional): The number of dimensions embeddings are reduced to before
+                they are indexed. `None` keeps the model's full width. Defaults to the
+                `FREESTREAM_REDUCE_DIM` environment variable.
+            reduction (str): How embeddings are reduced: "pca", fitted once `PCA_MIN_SAMPLE`
+                chunks are indexed, which are kept at full width until then, or "truncate",
+                for models trained with Matryoshka representations.
+                Defaults to the `FREESTREAM_REDUCTION` environment variable, or "pca".
+            index_type (str): The type of index to build. "auto" starts with an exact flat
+                index and rebuilds it as IVF, then IVF-PQ, as the corpus grows past the sizes in
+                `INDEX_TIERS`. "ivf", "ivfpq" and "hnsw" are used as soon as there are enough
+                vectors to train them. Approximate indexes keep full-precision copies of their
+                vectors on disk, to re-rank candidates and to rebuild the index.
+            nprobe (int, optional): The number of lists an IVF index scans per query.
+            ef_search (int, optional): The candidate list size of an HNSW search.
+            lexical (str): How a BM25 index of the chunks is used alongside the vectors. "hybrid"
+                fuses its ranking with the dense one by reciprocal rank, so exact identifiers
+                such as error codes and function names are found even when their embeddings
+                are not close. "prefilter" only compares the query embedding with the chunks
+                BM25 finds, falling back to a dense search when it finds none. "off" skips the
+                lexical index. Defaults to the `FREESTREAM_LEXICAL_MODE` environment variable,
+                or "hybrid".
+            segments (SegmentStore, optional): A store of parsed files shared with other
+                instances, e.g. `get_segment_store()`. Files already in it are neither parsed
+                nor split again, and the text of their chunks is held once however many
+                instances index them. `None` keeps this instance's text to itself.
+            query_cache_size (int): The number of recent search results the retriever keeps,
+                keyed by normalized query and dropped whenever the index changes. 0 disables
+                the cache. Defaults to the `FREESTREAM_QUERY_CACHE_SIZE` environment variable,
+                or 256.
+            compress_tokens (int, optional): The token budget retrieved chunks are compressed
+                to, by keeping the sentences most similar to the question, before they are
+                trimmed to `max_context_tokens`. `None` hands chunks over verbatim. Defaults
+                to the `FREESTREAM_COMPRESS_TOKENS` environment variable.
         """
+        if index_type != "auto" and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
+        if lexical not in LEXICAL_MODES:
+            raise ValueError(f"Unknown lexical mode: {lexical}")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.lazy_pdf_bytes = lazy_pdf_bytes
+        self.pages_per_task = pages_per_task
+        self.parse_timeout = parse_timeout
+        self.cache = DocumentCache(cache_dir, cache_max_bytes) if cache_dir else None
         self.docs = []
-        self.temp_dir = tempfile.TemporaryDirectory()
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=10000, chunk_overlap=1000
+        self.file_docs: Dict[str, List[Document]] = {}
+        self.file_chunk_ids: Dict[str, List[str]] = {}
+        self.chunk_owners: Dict[str, Dict[str, dict]] = {}
+        self.deduplicator = ChunkDeduplicator() if deduplicate else None
+        self.vectordb = None
+        self.vector_storage = vector_storage
+        self.exact_vectors = None
+        self.unit_vectors = None
+        self._positions: Optional[Dict[str, int]] = None
+        self.lexical = lexical
+        self.bm25 = BM25Index() if lexical != "off" else None
+        self.metadata_index = MetadataIndex()
+        self.segments = segments
+        self._segment_keys = set()
+        self._holder = uuid.uuid4().hex
+        self.query_cache = (
+            QueryCache(query_cache_size) if query_cache_size > 0 else None
+        )
+        self.version = 0
+        self.reduce_dim = reduce_dim
+        self.reduction = reduction
+        self.projection = (
+            VectorProjection(reduction, reduce_dim) if reduce_dim else None
         )
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={"device": "cuda" if torch.cuda.is_available() else "cpu"},
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.read_only = False
+        self.retriever = None
+        self.lock = threading.RLock()
+        self.progress = IndexingProgress()
+        self._incomplete = set()
+        self._text_bytes = (None, 0, 0)
+        self._temp_dir = None
+        self.embeddings = embeddings or get_embedding_engine()
+        self.chunking = chunking
+        self.max_context_tokens = max_context_tokens
+        self.compressor = (
+            ContextCompressor(self.embeddings, self.count_tokens, compress_tokens)
+            if compress_tokens
+            else None
         )
+        if chunking == "characters":
+            self.chunk_size = 10000
+            self.chunk_overlap = 1000
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+            )
+            self.search_kwargs = {"k": 3, "fetch_k": 7, "lambda_mult": 0.2}
+        elif chunking == "tokens":
+            # The embedding model truncates its input, so size chunks to what it actually reads,
+            # less the special tokens, e.g. [CLS] and [SEP], the tokenizer adds around them
+            self.chunk_size = (
+                self.embeddings.max_seq_length
+                - self.embeddings.tokenizer.num_special_tokens_to_add()
+            )
+            self.chunk_overlap = self.chunk_size // 10
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                length_function=self.count_tokens,
+            )
+            # Smaller chunks need more of them to give the LLM the same amount of context
+            self.search_kwargs = {"k": 8, "fetch_k": 20, "lambda_mult": 0.2}
+        else:
+            raise ValueError(f"Unknown chunking mode: {chunking}")
+
+    @property
+    def temp_dir(self) -> tempfile.TemporaryDirectory:
+        """
+        The temporary directory for uploaded files, created on first use.
+        """
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.TemporaryDirectory()
+        return self._temp_dir
 
-    @st.cache_resource(ttl="1h")
-    def configure_retriever(_self, uploaded_files: List[Document]):
+    def upload_path(self, key: str, name: str) -> str:
         """
-        Configure the retriever by creating a vector database from the provided chunks and embeddings.
+        The temporary path of an uploaded file.
 
-        This method first splits the loaded documents into chunks using the text splitter.
-        It then generates embeddings for these chunks and creates a vector database (FAISS)
-        from these chunks and embeddings.
-        Finally, it configures a retriever using the vector database and returns the
-        configured retriever.
+        Each file gets a directory named after its key, so uploads that share a name don't
+        overwrite each other, while the path still ends in the name the user gave the file.
+
+        Args:
+            key (str): The file's cache key.
+            name (str): The file's name.
 
         Returns:
-            Retriever: A configured retriever for retrieving documents based on embeddings.
+            str: The path of the file within the temporary directory.
         """
+        directory = os.path.join(self.temp_dir.name, key)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, os.path.basename(name))
 
-        # Read documents
-        docs = _self.docs
-        temp_dir = _self.temp_dir
-        for file in uploaded_files:
-            temp_filepath = os.path.join(temp_dir.name, file.name)
+    @property
+    def cache_settings(self) -> dict:
+        """
+        The splitter settings that determine the contents of a document cache entry.
+        """
+        settings = {
+            "splitter": type(self.text_splitter).__name__,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+        }
+        if self.chunking == "tokens":
+            settings["tokenizer"] = self.embeddings.model_name
+        return settings
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens in a text with the embedding model's tokenizer.
+
+        This is used as an LLM-independent approximation of prompt size.
+
+        Args:
+            text (str): The text to count.
+
+        Returns:
+            int: The number of tokens, excluding special tokens.
+        """
+        return len(self.embeddings.tokenizer.tokenize(text))
+
+    def compress(
+        self,
+        query: str,
+        docs: List[Document],
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[Document]:
+        """
+        Cut retrieved documents down to their sentences most similar to the query.
+
+        See `ContextCompressor` for how sentences are chosen.
+
+        Args:
+            query (str): The query the documents were retrieved for.
+            docs (List[Document]): The retrieved documents, best first.
+            query_embedding (List[float], optional): The query's embedding, if already known.
+
+        Returns:
+            List[Document]: The compressed documents, or `docs` if compression is disabled.
+        """
+        if self.compressor is None or not docs:
+            return docs
+        return self.compressor.compress(query, docs, query_embedding)
+
+    def fit_context(self, docs: List[Document]) -> List[Document]:
+        """
+        Trim retrieved documents to fit within `max_context_tokens`.
+
+        Documents are kept in ranking order until the budget runs out. The document that crosses
+        the budget is truncated to the remaining tokens, and any after it are dropped.
+
+        Args:
+            docs (List[Document]): The retrieved documents, best first.
+
+        Returns:
+            List[Document]: The documents that fit in the budget.
+        """
+        if self.max_context_tokens is None:
+            return docs
+
+        fitted = []
+        remaining = self.max_context_tokens
+        for doc in docs:
+            tokens = self.count_tokens(doc.page_content)
+            if tokens <= remaining:
+                fitted.append(doc)
+                remaining -= tokens
+                continue
+            if remaining > 0:
+                # Cut proportionally; exact for the budget is not worth a second tokenizer pass
+                cut = len(doc.page_content) * remaining // tokens
+                fitted.append(
+                    Document(page_content=doc.page_content[:cut], metadata=doc.metadata)
+                )
+            break
+        return fitted
+
+    def file_key(self, filename: str, data: bytes) -> str:
+        """
+        Build the document cache key of a file from its bytes, its loader and the splitter settings.
+
+        Args:
+            filename (str): The name of the file, used to pick its loader.
+            data (bytes): The raw bytes of the file.
+
+        Returns:
+            str: The cache key of the file.
+        """
+        return DocumentCache.make_key(
+            data, {"loader": get_loader_name(filename), **self.cache_settings}
+        )
+
+    def iter_documents(
+        self, filepaths: List[str]
+    ) -> Iterator[Tuple[int, Optional[List[Document]]]]:
+        """
+        Parse files into documents on a process pool, yielding each file as soon as it is parsed.
+
+        At most two files per worker are in flight at a time, so parsed documents never pile up
+        faster than the caller consumes them. A file that fails to parse, or is still parsing
+        when `parse_timeout` expires, is logged and yielded as `None` so it cannot block or
+        break the rest of the batch.
+
+        Args:
+            filepaths (List[str]): The paths of the files to parse.
+
+        Yields:
+            tuple: The index of the file in `filepaths` and its documents, or `None` if it failed to load.
+        """
+        # A pool is not worth its startup cost for a single file
+        if self.max_workers <= 1 or len(filepaths) <= 1:
+            for idx, filepath in enumerate(filepaths):
+                try:
+                    docs = _load_file(filepath)
+                    logger.info("Loaded document: %s", os.path.basename(filepath))
+                except Exception as e:
+                    logger.error("Failed to load document %s: %s", filepath, e)
+                    docs = None
+                yield idx, docs
+            return
+
+        max_workers = min(self.max_workers, len(filepaths))
+        deadline = (
+            time.monotonic() + self.parse_timeout
+            if self.parse_timeout is not None
+            else None
+        )
+        queued = iter(enumerate(filepaths))
+        futures = {}
+        executor = _process_pool(max_workers)
+        try:
+            while True:
+                for idx, filepath in itertools.islice(
+                    queued, 2 * max_workers - len(futures)
+                ):
+                    futures[executor.submit(_load_file, filepath)] = idx
+                if not futures:
+                    break
+                timeout = (
+                    max(deadline - time.monotonic(), 0)
+                    if deadline is not None
+                    else None
+                )
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    idx = futures.pop(future)
+                    try:
+                        docs = future.result()
+                        logger.info(
+                            "Loaded document: %s", os.path.basename(filepaths[idx])
+                        )
+                    except Exception as e:
+                        logger.error(
+                            "Failed to load document %s: %s", filepaths[idx], e
+                        )
+                        docs = None
+                    yield idx, docs
+
+            # Whatever is left ran past the deadline
+            for future, idx in futures.items():
+                future.cancel()
+                logger.warning(
+                    "Skipped document %s: parsing exceeded %s seconds",
+                    filepaths[idx],
+                    self.parse_timeout,
+                )
+                yield idx, None
+            for idx, filepath in queued:
+                logger.warning(
+                    "Skipped document %s: parsing exceeded %s seconds",
+                    filepath,
+                    self.parse_timeout,
+                )
+                yield idx, None
+        finally:
+            # Don't wait on stragglers; queued work is cancelled and running work killed
+            _shutdown_pool(executor, futures)
+
+    def load_documents(self, filepaths: List[str]) -> List[Optional[List[Document]]]:
+        """
+        Parse files into documents on a process pool, one file per worker.
+
+        Results are returned in the order of `filepaths`. A file that fails to parse, or is
+        still parsing when `parse_timeout` expires, is logged and skipped so it cannot
+        block or break the rest of the batch.
+
+        Args:
+            filepaths (List[str]): The paths of the files to parse.
+
+        Returns:
+            list: The documents parsed from each file, or `None` for files that failed to load.
+        """
+        results = [None for _ in filepaths]
+        for idx, docs in self.iter_documents(filepaths):
+            results[idx] = docs
+        return results
+
+    def split_documents(self, key: str, docs: List[Document]) -> List[Document]:
+        """
+        Split a file's documents into chunks and store both in the document cache.
+
+        Args:
+            key (str): The cache key of the file.
+            docs (List[Document]): The documents parsed from the file.
+
+        Returns:
+            List[Document]: The chunks split from the documents.
+        """
+        chunks = self.text_splitter.split_documents(docs)
+        if self.cache:
+            self.cache.put(key, docs, chunks)
+        return chunks
+
+    def iter_uploads(
+        self, uploaded_files: list, keys: Optional[List[str]] = None
+    ) -> Iterator[Tuple[int, str, List[Document], List[Document]]]:
+        """
+        Load and split uploaded files, yielding each file as soon as its chunks are ready.
+
+        Each file is identified by the SHA-256 of its bytes and the current loader and splitter
+        settings. Cache hits skip parsing and splitting. Plain-text formats listed in
+        `TEXT_LOADERS` are decoded straight from the upload buffer; everything else is written
+        to a temporary file and parsed by Unstructured on the process pool. Misses are split
+        and written back to the cache.
+
+        With a segment store, files another instance has already loaded are taken from it
+        before the document cache is consulted, and loaded files are published to it. Either
+        way the instance holds the files' segments until it removes the files.
+
+        Files are yielded in completion order: cache hits and plain-text files first, then
+        Unstructured files as their workers finish.
+
+        Args:
+            uploaded_files (list): The files uploaded by the user.
+            keys (List[str], optional): The cache key of each file, if already computed with
+                `file_key`.
+
+        Yields:
+            tuple: The index of the file in `uploaded_files` and its `(key, docs, chunks)`.
+                Files that failed to load have empty `docs` and `chunks`.
+        """
+        pending = []
+        for idx, file in enumerate(uploaded_files):
+            data = file.getvalue()
+            key = keys[idx] if keys is not None else self.file_key(file.name, data)
+            temp_filepath = self.upload_path(key, file.name)
+
+            segment = self.segments.get(key) if self.segments is not None else None
+            if segment is not None:
+                logger.info("Loaded document from another session: %s", file.name)
+                yield idx, key, *self._share_segment(key, segment, temp_filepath)
+                continue
+
+            cached = self.cache.get(key) if self.cache else None
+            if cached is not None:
+                docs, chunks = cached
+                # The same bytes may have been uploaded under another name
+                for doc in docs + chunks:
+                    doc.metadata["source"] = temp_filepath
+                logger.info("Loaded document from cache: %s", file.name)
+                yield idx, key, *self._publish(key, docs, chunks, temp_filepath)
+                continue
+
+            text_loader = TEXT_LOADERS.get(os.path.splitext(file.name)[1].lower())
+            if text_loader is not None:
+                try:
+                    docs = [
+                        Document(
+                            page_content=text_loader(data),
+                            metadata={"source": temp_filepath},
+                        )
+                    ]
+                except Exception as e:
+                    logger.error("Failed to load document %s: %s", file.name, e)
+                    yield idx, key, [], []
+                    continue
+                logger.info("Loaded document: %s", file.name)
+                chunks = self.split_documents(key, docs)
+                yield idx, key, *self._publish(key, docs, chunks, temp_filepath)
+                continue
+
+            # Write uploads to disk so worker processes can read them
             with open(temp_filepath, "wb") as f:
-                f.write(file.getvalue())
-            loader = UnstructuredFileLoader(temp_filepath)
-            docs.extend(loader.load())
-            logger.info("Loaded document: %s", file.name)
+                f.write(data)
+            pending.append((idx, key, temp_filepath))
+
+        for pending_idx, docs in self.iter_documents(
+            [filepath for _, _, filepath in pending]
+        ):
+            idx, key, temp_filepath = pending[pending_idx]
+            if docs is None:
+                yield idx, key, [], []
+            else:
+                chunks = self.split_documents(key, docs)
+                yield idx, key, *self._publish(key, docs, chunks, temp_filepath)
+
+    def _publish(
+        self, key: str, docs: List[Document], chunks: List[Document], source: str
+    ) -> Tuple[List[Document], List[Document]]:
+        """
+        Add a loaded file to the segment store, and hold it.
+
+        Returns:
+            tuple: The documents and chunks this instance should use.
+        """
+        if self.segments is None or not docs:
+            return docs, chunks
+        return self._share_segment(key, self.segments.put(key, docs, chunks), source)
+
+    def _share_segment(
+        self, key: str, segment: FileSegment, source: str
+    ) -> Tuple[List[Document], List[Document]]:
+        """
+        Hold a stored file, and return copies of its documents and chunks that share its text.
+
+        The copies carry this instance's own source path, and their metadata can be changed
+        without affecting other instances.
+        """
+        self.segments.acquire(key, self._holder)
+        with self.lock:
+            self._segment_keys.add(key)
+        return tuple(
+            [
+                Document(
+                    page_content=doc.page_content,
+                    metadata={**doc.metadata, "source": source},
+                )
+                for doc in docs
+            ]
+            for docs in (segment.docs, segment.chunks)
+        )
+
+    def _release_segments(self, keys: Collection[str]):
+        """
+        Stop holding the stored files of removed files.
+        """
+        for key in keys:
+            if key in self._segment_keys:
+                self._segment_keys.discard(key)
+                self.segments.release(key, self._holder)
+
+    def configure_retriever(self, uploaded_files: list):
+        """
+        Index the uploaded files and return a retriever over them.
+
+        Kept for callers of the original API; this is `update_retriever`, so files indexed by
+        an earlier call are not processed again.
+
+        Args:
+            uploaded_files (list): The files uploaded by the user.
+
+        Returns:
+            Retriever: A retriever over the files, or `None` if none of them could be read.
+        """
+        return self.update_retriever(uploaded_files)
 
-        # Split documents
-        text_splitter = _self.text_splitter
-        chunks = text_splitter.split_documents(docs)
+    def search(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        text: Optional[str] = None,
+        within: Optional[Collection[str]] = None,
+    ) -> List[Document]:
+        """
+        Select chunks for a query by maximal marginal relevance.
+
+        See `search_ids` for how chunks are selected.
 
-        vectordb = FAISS.from_documents(chunks, _self.embeddings)
+        Returns:
+            List[Document]: The selected chunks.
+        """
+        with self.lock:
+            ids, _ = self.search_ids(embedding, k, fetch_k, lambda_mult, text, within)
+            return [self.vectordb.docstore.search(id) for id in ids]
 
-        # Define retriever
-        retriever = vectordb.as_retriever(
-            search_type="mmr", search_kwargs={"k": 3, "fetch_k": 7, "lambda_mult": 0.2}
+    def search_ids(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        text: Optional[str] = None,
+        within: Optional[Collection[str]] = None,
+    ) -> Tuple[List[str], List[float]]:
+        """
+        Select chunks for a query by maximal marginal relevance, returning their IDs.
+
+        The `fetch_k` nearest chunks are found with `candidates`, or combined with lexical
+        matches as set by `lexical`, and `k` of them are picked to balance relevance and
+        diversity from their resident normalized vectors, so large `fetch_k` values cost
+        little more than small ones. A search scoped with `within` only considers those
+        chunks, and costs time in proportion to them rather than to the whole index.
+
+        Args:
+            embedding (List[float]): The query embedding.
+            k (int): The number of chunks to return.
+            fetch_k (int): The number of candidates to pick from.
+            lambda_mult (float): 1 ranks purely by relevance, 0 purely by diversity.
+            text (str, optional): The query text, for lexical search.
+            within (Collection[str], optional): The IDs of the only chunks to consider, e.g.
+                from `metadata_index`. Defaults to every chunk.
+
+        Returns:
+            tuple: The docstore IDs of the selected chunks, in the order picked, and the
+                relevance of each, its cosine similarity to the query or its rescaled fused
+                score in "hybrid" mode.
+        """
+        with self.lock:
+            query = self.project(embedding)
+            relevance = None
+            if self.bm25 is None or self.lexical == "off" or not text:
+                ids, vectors = self.candidates(
+                    query, fetch_k, normalized=True, within=within
+                )
+            elif self.lexical == "prefilter":
+                ids, vectors = self._prefiltered_candidates(
+                    query, text, fetch_k, within
+                )
+            else:
+                ids, vectors, relevance = self._fused_candidates(
+                    query, text, fetch_k, within
+                )
+            if not len(ids):
+                return [], []
+            if relevance is None:
+                relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+            selected = maximal_marginal_relevance(
+                query, vectors, k=k, lambda_mult=lambda_mult, relevance=relevance
+            )
+            return [ids[i] for i in selected], [float(relevance[i]) for i in selected]
+
+    def _fused_candidates(
+        self,
+        query: np.ndarray,
+        text: str,
+        fetch_k: int,
+        within: Optional[Collection[str]] = None,
+    ) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Fuse the dense and BM25 rankings of a query by reciprocal rank.
+
+        Returns the `fetch_k` best fused candidates, their normalized vectors, and their fused
+        scores rescaled to span 0 to 1, which stand in for similarity to the query in MMR.
+        """
+        dense_ids, dense_vectors = self.candidates(
+            query, fetch_k, normalized=True, within=within
         )
+        lexical_ids, _ = self.bm25.search(text, fetch_k, within)
+        if not lexical_ids:
+            return dense_ids, dense_vectors, None
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids])[:fetch_k]
+        ids = [id for id, _ in fused]
+        scores = np.array([score for _, score in fused], dtype=np.float32)
+        scores -= scores[-1]
+        relevance = scores / scores[0] if scores[0] > 0 else np.ones_like(scores)
+        return ids, self._unit_vectors().get(self._positions_of(ids)), relevance
+
+    def _prefiltered_candidates(
+        self,
+        query: np.ndarray,
+        text: str,
+        fetch_k: int,
+        within: Optional[Collection[str]] = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        """
+        Rank only the chunks BM25 matches by cosine similarity to the query.
+
+        The best `PREFILTER_HITS` lexical matches are compared with the query through their
+        normalized vectors, so the vector index is not searched at all. Queries without
+        lexical matches fall back to a dense search.
+        """
+        lexical_ids, _ = self.bm25.search(text, PREFILTER_HITS, within)
+        if not lexical_ids:
+            return self.candidates(query, fetch_k, normalized=True, within=within)
+        vectors = self._unit_vectors().get(self._positions_of(lexical_ids))
+        order = np.argsort(-(vectors @ query), kind="stable")[:fetch_k]
+        return [lexical_ids[i] for i in order], vectors[order]
+
+    def _positions_of(self, ids: List[str]) -> np.ndarray:
+        """
+        Return the FAISS positions of docstore IDs, building the reverse map on first use.
+        """
+        if self._positions is None:
+            self._positions = {
+                id: position
+                for position, id in self.vectordb.index_to_docstore_id.items()
+            }
+        return np.array([self._positions[id] for id in ids], dtype=np.int64)
 
-        return retriever
+    def project(self, embedding: List[float]) -> np.ndarray:
+        """
+        Bring a query embedding into the space of the indexed vectors.
+
+        Args:
+            embedding (List[float]): The query embedding.
+
+        Returns:
+            np.ndarray: The embedding, reduced by `projection` once it is fitted.
+        """
+        query = np.array(embedding, dtype=np.float32)
+        # An unfitted PCA means the index still holds full-width vectors
+        if self.projection is None or not self.projection.fitted:
+            return query
+        return self.projection.transform(query[None])[0]
+
+    def candidates(
+        self,
+        query: np.ndarray,
+        fetch_k: int,
+        rerank: bool = True,
+        normalized: bool = False,
+        within: Optional[Collection[str]] = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        """
+        Find the nearest chunks to a projected query.
+
+        Args:
+            query (np.ndarray): The query embedding, as returned by `project`.
+            fetch_k (int): The number of chunks to find.
+            rerank (bool): Whether to re-rank the candidates of a compact index at full precision.
+            normalized (bool): Whether to return the chunks' resident normalized vectors
+                instead of their indexed ones.
+            within (Collection[str], optional): The IDs of the only chunks to consider.
+
+        Returns:
+            tuple: The vector IDs of the chunks, nearest first, and their vectors.
+        """
+        with self.lock:
+            if self.vectordb is None or (within is not None and not within):
+                return [], np.empty((0, 0), dtype=np.float32)
+            return search_candidates(
+                self.vectordb,
+                query,
+                fetch_k,
+                self.exact_vectors if rerank else None,
+                unit=self._unit_vectors() if normalized else None,
+                positions=(
+                    self._positions_of(list(within)) if within is not None else None
+                ),
+            )
+
+    def _unit_vectors(self) -> Union[UnitVectors, MappedUnitVectors]:
+        """
+        Return the normalized copies of the index's vectors, building them on first use.
+
+        A read-only collection's vectors are memory-mapped, so they are read and normalized
+        per search instead of copied into memory.
+        """
+        if self.unit_vectors is None and self.read_only:
+            self.unit_vectors = MappedUnitVectors(self.vectordb, self.exact_vectors)
+        if self.unit_vectors is None:
+            index = self.vectordb.index
+            self.unit_vectors = UnitVectors(index.d)
+            if self.exact_vectors is not None:
+                self.unit_vectors.add(
+                    self.exact_vectors.get(
+                        [
+                            self.vectordb.index_to_docstore_id[i]
+                            for i in range(index.ntotal)
+                        ]
+                    )
+                )
+            elif index.ntotal:
+                self.unit_vectors.add(index.reconstruct_n(0, index.ntotal))
+        return self.unit_vectors
+
+    def chunk_counts(self) -> Dict[str, int]:
+        """
+        The number of chunks of each indexed file, by cache key.
+        """
+        with self.lock:
+            return {key: len(ids) for key, ids in self.file_chunk_ids.items()}
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Estimate the memory held by this instance's index, in bytes.
+
+        Text shared through the segment store is not counted in the docstore and documents;
+        instead this instance is charged its share of the files it holds ("segments").
+
+        Returns:
+            dict: The bytes used by the vectors, the docstore text, the loaded documents, the
+                lexical index, the shared segments and the temporary files, plus their "total", and the bytes of memory-mapped files
+                ("mapped"), which are not part of the total.
+        """
+        with self.lock:
+            vectors = 0
+            docstore = 0
+            if self.vectordb is not None:
+                vectors = vector_bytes(self.vectordb.index)
+                # Text dominates, and re-measuring it is only needed when the index changes
+                version = (
+                    self.vectordb.index.ntotal,
+                    len(self.docs),
+                    len(self._segment_keys),
+                )
+                if self._text_bytes[0] != version:
+                    shared = {
+                        id
+                        for key in self._segment_keys
+                        for id in self.file_chunk_ids.get(key, [])
+                    }
+                    text_bytes = sum(
+                        sys.getsizeof(self.vectordb.docstore.search(id).page_content)
+                        for id in self.vectordb.index_to_docstore_id.values()
+                        if id not in shared
+                    )
+                    doc_bytes = sum(
+                        sys.getsizeof(doc.page_content)
+                        for key, docs in self.file_docs.items()
+                        if key not in self._segment_keys
+                        for doc in docs
+                    )
+                    self._text_bytes = (version, text_bytes, doc_bytes)
+                docstore = self._text_bytes[1]
+            docs = self._text_bytes[2] if self.vectordb is not None else 0
+            # The OS pages mapped files in and out, so they don't count against the memory budget
+            mapped = (
+                self.exact_vectors.nbytes() if self.exact_vectors is not None else 0
+            )
+            if self.read_only:
+                mapped += vectors
+                vectors = 0
+            if self.unit_vectors is not None:
+                vectors += self.unit_vectors.nbytes()
+            lexical = self.bm25.nbytes() if self.bm25 is not None else 0
+            segment_keys = list(self._segment_keys)
+        segments = self.segments.charge(segment_keys) if segment_keys else 0
+
+        temp_files = 0
+        if self._temp_dir is not None:
+            for directory, _, filenames in os.walk(self._temp_dir.name):
+                for filename in filenames:
+                    try:
+                        temp_files += os.path.getsize(os.path.join(directory, filename))
+                    except FileNotFoundError:
+                        continue
+
+        return {
+            "vectors": vectors,
+            "docstore": docstore,
+            "docs": docs,
+            "lexical": lexical,
+            "segments": segments,
+            "temp_files": temp_files,
+            "mapped": mapped,
+            "total": vectors + docstore + docs + lexical + segments + temp_files,
+        }
+
+    def close(self):
+        """
+        Release the index, documents and temporary files.
+
+        The instance is left empty; indexing files again rebuilds it from scratch.
+        """
+        with self.lock:
+            self.version += 1
+            self.vectordb = None
+            if self.query_cache is not None:
+                self.query_cache.clear()
+            if self.exact_vectors is not None:
+                self.exact_vectors.close()
+                self.exact_vectors = None
+            self.unit_vectors = None
+            self._positions = None
+            if self.bm25 is not None:
+                self.bm25 = BM25Index()
+            if self.projection is not None:
+                self.projection = VectorProjection(self.reduction, self.reduce_dim)
+            self.docs = []
+            self.file_docs.clear()
+            self.file_chunk_ids.clear()
+            self.chunk_owners.clear()
+            self.metadata_index = MetadataIndex()
+            if self.deduplicator is not None:
+                self.deduplicator = ChunkDeduplicator()
+            self._release_segments(list(self._segment_keys))
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+
+    def remove_files(self, keys: List[str]):
+        """
+        Delete the vectors and documents of indexed files.
+
+        A vector shared with a duplicate chunk of another file is kept, and its metadata is
+        updated to list only the sources that remain.
+
+        Args:
+            keys (List[str]): The cache keys of the files to remove.
+        """
+        if keys and self.read_only:
+            raise ValueError("Files cannot be removed from a read-only collection")
+        with self.lock:
+            if keys:
+                self.version += 1
+            deleted = []
+            for key in keys:
+                for id in set(self.file_chunk_ids.pop(key, [])):
+                    owners = self.chunk_owners.get(id, {})
+                    owners.pop(key, None)
+                    if owners:
+                        self._update_sources(id)
+                        continue
+                    self.chunk_owners.pop(id, None)
+                    self.metadata_index.remove(id)
+                    if self.deduplicator is not None:
+                        self.deduplicator.remove(id)
+                    deleted.append(id)
+                self.file_docs.pop(key, None)
+            self._release_segments(keys)
+            if deleted and self.vectordb is not None:
+                self._positions = None
+                if self.bm25 is not None:
+                    self.bm25.remove(deleted)
+                if self.unit_vectors is not None:
+                    removed = set(deleted)
+                    self.unit_vectors.remove(
+                        [
+                            i
+                            for i, id in self.vectordb.index_to_docstore_id.items()
+                            if id in removed
+                        ]
+                    )
+                if index_type_of(self.vectordb.index) == "flat":
+                    self.vectordb.delete(deleted)
+                    if self.exact_vectors is not None:
+                        self.exact_vectors.remove(deleted)
+                else:
+                    # Approximate indexes keep their own vector IDs, which the FAISS wrapper's
+                    # deletion doesn't expect, so they are rebuilt from the remaining vectors
+                    removed = set(deleted)
+                    self.vectordb.docstore.delete(deleted)
+                    self.exact_vectors.remove(deleted)
+                    self._rebuild_index(
+                        [
+                            id
+                            for _, id in sorted(
+                                self.vectordb.index_to_docstore_id.items()
+                            )
+                            if id not in removed
+                        ]
+                    )
+            self.docs = [doc for docs in self.file_docs.values() for doc in docs]
+        if keys:
+            logger.info("Removed %d file(s) from the index", len(keys))
+
+    def target_index_type(self, size: int) -> str:
+        """
+        Return the index type to use for a corpus of `size` vectors.
+        """
+        index_type = (
+            choose_index_type(size) if self.index_type == "auto" else self.index_type
+        )
+        return index_type if size >= MIN_TRAINING_VECTORS[index_type] else "flat"
+
+    def _rebuild_index(self, ids: List[str]):
+        """
+        Rebuild the FAISS index from the full-precision vectors of `ids`, as the index type
+        suited to their number.
+        """
+        vectordb = self.vectordb
+        if not ids:
+            vectordb.index.reset()
+            vectordb.index_to_docstore_id = {}
+            self.unit_vectors = None
+            self._positions = None
+            return
+        if self.exact_vectors is None:
+            # Only exact flat indexes go without copies, so their vectors are the copies
+            self.exact_vectors = ExactVectors(vectordb.index.d)
+            self.exact_vectors.add(
+                [
+                    vectordb.index_to_docstore_id[i]
+                    for i in range(vectordb.index.ntotal)
+                ],
+                vectordb.index.reconstruct_n(0, vectordb.index.ntotal),
+            )
+        start = time.perf_counter()
+        index_type = self.target_index_type(len(ids))
+        vectors = self.exact_vectors.get(ids)
+        index = create_faiss_index(self.vector_storage, vectors, index_type)
+        configure_search(index, self.nprobe, self.ef_search)
+        index.add(vectors)
+        vectordb.index = index
+        vectordb.index_to_docstore_id = dict(enumerate(ids))
+        self._positions = None
+        logger.info(
+            "Built a %s index of %d vectors in %.2f seconds",
+            index_type,
+            len(ids),
+            time.perf_counter() - start,
+        )
+
+    def _fit_projection(self):
+        """
+        Fit the PCA on the full-width vectors indexed so far, and rebuild the index from their
+        projections.
+        """
+        vectordb = self.vectordb
+        ids = [vectordb.index_to_docstore_id[i] for i in range(vectordb.index.ntotal)]
+        if self.exact_vectors is not None:
+            vectors = self.exact_vectors.get(ids)
+            self.exact_vectors.close()
+        else:
+            vectors = vectordb.index.reconstruct_n(0, vectordb.index.ntotal)
+        self.projection.fit(vectors)
+        self.exact_vectors = ExactVectors(self.projection.dim)
+        self.exact_vectors.add(ids, self.projection.transform(vectors))
+        self.unit_vectors = None
+        self._rebuild_index(ids)
+
+    def _update_sources(self, id: str):
+        """
+        Point a stored chunk's metadata at the files that currently share its vector.
+        """
+        doc = self.vectordb.docstore.search(id)
+        owners = list(self.chunk_owners[id].values())
+        sources = sorted({metadata["source"] for metadata in owners})
+        if doc.metadata.get("source") not in sources:
+            doc.metadata.update(owners[0])
+        doc.metadata["sources"] = sources
+        self.metadata_index.update(id, owners)
+
+    def _split_stage(
+        self, files: Dict[str, Any], progress: "IndexingProgress", incomplete: set
+    ) -> Iterator[_ChunkItem]:
+        """
+        Load and split files, given by cache key, yielding their chunks one at a time with a
+        vector ID.
+        """
+        regular = {}
+        large = {}
+        for key, file in files.items():
+            (large if self.is_large_pdf(file) else regular)[key] = file
+
+        for _, key, docs, chunks in self.iter_uploads(
+            list(regular.values()), keys=list(regular)
+        ):
+            with self.lock:
+                self.file_docs[key] = docs
+                self.file_chunk_ids[key] = []
+                self.docs.extend(docs)
+                if chunks:
+                    incomplete.add(key)
+            progress.files_loaded += 1
+            progress.chunks_split += len(chunks)
+            for idx, chunk in enumerate(chunks):
+                yield _ChunkItem(key, f"{key}-{idx}", chunk, idx == len(chunks) - 1)
+
+        # Large PDFs go last so the quick files become searchable first
+        for key, file in large.items():
+            yield from self._stream_large_pdf(file, key, progress, incomplete)
+
+    def is_large_pdf(self, file) -> bool:
+        """
+        Whether an uploaded file is a PDF big enough to be streamed page by page.
+
+        Args:
+            file (UploadedFile): The uploaded file.
+
+        Returns:
+            bool: `True` if the file should take the bounded-memory path.
+        """
+        return (
+            self.lazy_pdf_bytes is not None
+            and file.name.lower().endswith(".pdf")
+            and file.size > self.lazy_pdf_bytes
+        )
+
+    def iter_pdf_chunks(self, filepath: str) -> Iterator[Document]:
+        """
+        Read a PDF in page ranges on the process pool and split each page into chunks.
+
+        The PDF is cut into ranges of `pages_per_task` pages that are extracted concurrently,
+        so a single large document is parsed on every core. At most two ranges per worker are
+        in flight, and ranges are reassembled in page order, so memory stays flat no matter
+        how many pages the document has.
+
+        Args:
+            filepath (str): The path of the PDF.
+
+        Yields:
+            Document: The chunks of each page, in page order, with the page number in their metadata.
+        """
+        num_pages = len(PdfReader(filepath).pages)
+        ranges = [
+            (start, min(start + self.pages_per_task, num_pages))
+            for start in range(0, num_pages, self.pages_per_task)
+        ]
+
+        # A pool is not worth its startup cost for a single range
+        if self.max_workers <= 1 or len(ranges) <= 1:
+            for start, stop in ranges:
+                for page in _load_pdf_pages(filepath, start, stop):
+                    yield from self.text_splitter.split_documents([page])
+            return
+
+        max_workers = min(self.max_workers, len(ranges))
+        queued = iter(ranges)
+        futures = deque()
+        executor = _process_pool(max_workers)
+        try:
+            while True:
+                for start, stop in itertools.islice(
+                    queued, 2 * max_workers - len(futures)
+                ):
+                    futures.append(
+                        executor.submit(_load_pdf_pages, filepath, start, stop)
+                    )
+                if not futures:
+                    break
+                # Wait on the earliest range so pages come out in order
+                for page in futures.popleft().result():
+                    yield from self.text_splitter.split_documents([page])
+        finally:
+            _shutdown_pool(executor, futures)
+
+    def _stream_large_pdf(
+        self, file, key: str, progress: "IndexingProgress", incomplete: set
+    ) -> Iterator[_ChunkItem]:
+        """
+        Split a large PDF page by page, yielding its chunks without keeping its text around.
+
+        The file's documents are not retained and it is not written to the document cache,
+        since either would need the whole text in memory at once.
+        """
+        data = file.getvalue()
+        temp_filepath = self.upload_path(key, file.name)
+        with open(temp_filepath, "wb") as f:
+            f.write(data)
+        del data
+        with self.lock:
+            self.file_docs[key] = []
+            self.file_chunk_ids[key] = []
+            incomplete.add(key)
+
+        # Hold back one chunk so the last one can be flagged
+        previous = None
+        idx = 0
+        try:
+            for chunk in self.iter_pdf_chunks(temp_filepath):
+                progress.chunks_split += 1
+                if previous is not None:
+                    yield _ChunkItem(key, f"{key}-{idx - 1}", previous, False)
+                previous = chunk
+                idx += 1
+        except Exception as e:
+            logger.error("Failed to load document %s: %s", file.name, e)
+        finally:
+            os.remove(temp_filepath)
+
+        progress.files_loaded += 1
+        if previous is not None:
+            yield _ChunkItem(key, f"{key}-{idx - 1}", previous, True)
+        else:
+            incomplete.discard(key)
+        logger.info("Streamed document: %s (%d chunks)", file.name, idx)
+
+    def _dedup_stage(
+        self, items: Iterator[_ChunkItem], progress: "IndexingProgress", pending: set
+    ) -> Iterator[_ChunkItem]:
+        """
+        Mark chunks that duplicate an indexed or earlier chunk, so they share its vector.
+
+        A shared vector carries the text of the chunk it was embedded for, so chunks only
+        share the vector of another file's chunk if their texts are identical; near duplicates
+        are collapsed within a file.
+        """
+        for item in items:
+            if self.deduplicator is None:
+                yield item
+                continue
+            prefix = f"{item.key}-"
+            duplicate = self.deduplicator.find(
+                item.chunk.page_content, near=lambda id: id.startswith(prefix)
+            )
+            if duplicate is None:
+                self.deduplicator.add(item.id, item.chunk.page_content)
+                pending.add(item.id)
+                yield item
+            else:
+                progress.chunks_collapsed += 1
+                yield item._replace(id=duplicate, duplicate=True)
+
+    def _embed_stage(
+        self,
+        items: Iterator[_ChunkItem],
+        batch_size: int,
+        progress: "IndexingProgress",
+    ) -> Iterator[Tuple[List[_ChunkItem], List[List[float]]]]:
+        """
+        Group chunks into batches and embed the unique chunks of each batch.
+
+        Yields:
+            tuple: The batch of chunks and the embeddings of its non-duplicate chunks.
+        """
+        while batch := list(itertools.islice(items, batch_size)):
+            texts = [item.chunk.page_content for item in batch if not item.duplicate]
+            start = time.perf_counter()
+            vectors = self.embeddings.embed_documents(texts) if texts else []
+            progress.embed_seconds += time.perf_counter() - start
+            progress.chunks_embedded += len(texts)
+            yield batch, vectors
+
+    def _add_embeddings(self, batch: List[_ChunkItem], vectors: List[List[float]]):
+        """
+        Add a batch of embedded chunks to the vector database, creating it on the first batch.
+
+        Duplicate chunks add no vector; their file is recorded as sharing the original's.
+        """
+        unique = [item for item in batch if not item.duplicate]
+        metadatas = [
+            {**item.chunk.metadata, "sources": [item.chunk.metadata["source"]]}
+            for item in unique
+        ]
+        ids = [item.id for item in unique]
+        with self.lock:
+            self.version += 1
+            if unique:
+                array = np.array(vectors, dtype=np.float32)
+                if self.projection is not None and self.projection.fitted:
+                    array = self.projection.transform(array)
+                text_embeddings = [
+                    (item.chunk.page_content, vector.tolist())
+                    for item, vector in zip(unique, array)
+                ]
+                if self.vectordb is None:
+                    index_type = self.target_index_type(len(array))
+                    index = create_faiss_index(self.vector_storage, array, index_type)
+                    configure_search(index, self.nprobe, self.ef_search)
+                    self.vectordb = FAISS(
+                        self.embeddings, index, InMemoryDocstore(), {}
+                    )
+                    if self.vector_storage != "float32" or index_type != "flat":
+                        self.exact_vectors = ExactVectors(array.shape[1])
+                self.vectordb.add_embeddings(
+                    text_embeddings, metadatas=metadatas, ids=ids
+                )
+                if self.exact_vectors is not None:
+                    self.exact_vectors.add(ids, array)
+                if self.unit_vectors is not None:
+                    self.unit_vectors.add(array)
+                if self._positions is not None:
+                    start = self.vectordb.index.ntotal - len(ids)
+                    self._positions.update((id, start + i) for i, id in enumerate(ids))
+                if self.bm25 is not None:
+                    self.bm25.add(ids, [item.chunk.page_content for item in unique])
+                size = self.vectordb.index.ntotal
+                if (
+                    self.projection is not None
+                    and not self.projection.fitted
+                    and size >= self.projection.min_sample
+                ):
+                    self._fit_projection()
+                # Move to the next index type once the corpus has outgrown this one
+                elif self.target_index_type(size) != index_type_of(self.vectordb.index):
+                    self._rebuild_index(
+                        [self.vectordb.index_to_docstore_id[i] for i in range(size)]
+                    )
+            for item in batch:
+                self.file_chunk_ids[item.key].append(item.id)
+                self.chunk_owners.setdefault(item.id, {})[
+                    item.key
+                ] = item.chunk.metadata
+                if item.duplicate:
+                    self._update_sources(item.id)
+                else:
+                    self.metadata_index.update(
+                        item.id, self.chunk_owners[item.id].values()
+                    )
+            if self.retriever is None and self.vectordb is not None:
+                self.retriever = IndexRetriever(
+                    index=self, search_kwargs=self.search_kwargs
+                )
+
+    def stream_index(
+        self,
+        uploaded_files: list,
+        batch_size: int = 256,
+        replace: bool = True,
+        keys: Optional[List[str]] = None,
+    ) -> Iterator["IndexingProgress"]:
+        """
+        Incrementally bring the vector database in line with the current set of uploaded files.
+
+        Files that were removed since the last call have their vectors deleted, unless
+        `replace` is off, in which case the files are only added to the index. New files flow
+        through a pipeline of lazy generator stages: loading (see `iter_uploads`), splitting,
+        deduplication, and embedding in batches of `batch_size` chunks. Each batch is added to
+        the index as soon as it is embedded, so `retriever` can answer questions from the files
+        indexed so far while the rest are still being processed. Files are identified by their
+        content, so a byte-identical file uploaded under a second name is indexed once. PDFs
+        larger than `lazy_pdf_bytes` are read and split one page at a time after the other files,
+        and their text is not kept once it is indexed.
+
+        Chunks that duplicate a chunk already in the index (see `ChunkDeduplicator`) are not
+        embedded. They share the original's vector, whose `metadata["sources"]` lists every
+        file containing it. Near duplicates are only collapsed within a file; across files,
+        chunks must be identical, so no file's text is ever returned in place of another's.
+
+        If the generator is closed early, files whose chunks were only partly indexed are removed
+        again so the next call indexes them in full.
+
+        Args:
+            uploaded_files (list): The files currently uploaded by the user.
+            batch_size (int): The number of chunks embedded and added to the index at a time.
+            replace (bool): Whether to remove indexed files that are not in `uploaded_files`.
+            keys (List[str], optional): The cache key of each file, if already computed with
+                `file_key`, so the files are not hashed again.
+
+        Yields:
+            IndexingProgress: The progress of each stage, once up front and after every batch.
+        """
+        if self.read_only:
+            raise ValueError("Files cannot be added to a read-only collection")
+        if keys is None:
+            keys = [
+                self.file_key(file.name, file.getvalue()) for file in uploaded_files
+            ]
+        files = {}
+        for key, file in zip(keys, uploaded_files):
+            files.setdefault(key, file)
+        if replace:
+            self.remove_files([key for key in self.file_chunk_ids if key not in files])
+
+        added = {
+            key: file for key, file in files.items() if key not in self.file_chunk_ids
+        }
+        progress = IndexingProgress(files_total=len(added), done=False)
+        self.progress = progress
+        incomplete = self._incomplete = set()
+        pending = set()
+        try:
+            yield progress
+            items = self._split_stage(added, progress, incomplete)
+            items = self._dedup_stage(items, progress, pending)
+            for batch, vectors in self._embed_stage(items, batch_size, progress):
+                self._add_embeddings(batch, vectors)
+                pending.difference_update(item.id for item in batch)
+                incomplete.difference_update(item.key for item in batch if item.last)
+                progress.chunks_indexed += len(batch)
+                yield progress
+            if added:
+                logger.info(
+                    "Added %d file(s) to the index at %.1f chunks/s",
+                    len(added),
+                    progress.chunks_per_second,
+                )
+        finally:
+            self.remove_files(list(incomplete))
+            # Forget chunks that were deduplicated against but never made it into the index
+            if self.deduplicator is not None:
+                for id in pending:
+                    self.deduplicator.remove(id)
+            progress.done = True
+
+    def indexed_files(self, keys: Collection[str]) -> List[str]:
+        """
+        Return which of some files are fully indexed.
+
+        Args:
+            keys (Collection[str]): The cache keys of the files.
+
+        Returns:
+            List[str]: The keys of the files whose chunks are all in the index, including
+                files that had no chunks.
+        """
+        with self.lock:
+            return [
+                key
+                for key in keys
+                if key in self.file_chunk_ids and key not in self._incomplete
+            ]
+
+    def update_retriever(self, uploaded_files: list):
+        """
+        Incrementally bring the vector database in line with the current set of uploaded files.
+
+        This runs `stream_index` to completion on the calling thread; `SessionIndexes` runs it
+        on a background thread instead. Only files that are new since the last call are loaded,
+        embedded and added, and only the vectors of files that were removed are deleted, so the
+        cost of a call is proportional to what changed.
+
+        The instance must outlive a single Streamlit rerun for this to pay off, e.g. by being
+        kept in `st.session_state`.
+
+        Args:
+            uploaded_files (list): The files currently uploaded by the user.
+
+        Returns:
+            Retriever: A retriever over the updated vector database, or `None` if nothing is indexed.
+        """
+        for _ in self.stream_index(uploaded_files):
+            pass
+        return self.retriever
 
 
 # Define a callback function for selecting a model
@@ -109,4 +2291,4 @@ def set_llm(selected_model: str, model_names: dict):
             f"An unsupported model name was selected or injected. Error changing model: {e}\n{selected_model}"
         )
         # Display a more informative error message to the user
-        st.error(f"Failed to change model! Error: {e}\n{selected_model}")
\ No newline at end of file
+        st.error(f"Failed to change model! Error: {e}\n{selected_model}")
@@ -0,0 +1,351 @@
+import argparse
+import datetime
+import hmac
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import zlib
+from typing import List
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from .cache_operators import DEFAULT_CACHE_DIR
+from .chatbot_operators import IndexRetriever, RetrieveDocuments, get_retriever_cache
+from .lexical_operators import BM25Index
+from .vector_operators import ExactVectors, configure_search
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# Where named collections are saved, one directory each
+DEFAULT_COLLECTIONS_DIR = os.environ.get(
+    "FREESTREAM_COLLECTIONS_DIR", os.path.join(DEFAULT_CACHE_DIR, "collections")
+)
+
+# The passphrase required to save collections from the app; unset disables saving from the app
+COLLECTION_PASSWORD = os.environ.get("FREESTREAM_COLLECTION_PASSWORD") or None
+
+# Bump when the on-disk collection layout changes so stale collections are never loaded
+COLLECTION_FORMAT_VERSION = 1
+
+# Maps FAISS's flat vector storage instead of reading it, where this FAISS version supports it
+_MMAP_FLAG = (
+    getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+)
+
+_NAME_PATTERN = re.compile(r"^[\w][\w .-]{0,63}$")
+
+
+def _collection_dir(name: str, root: str) -> str:
+    if not _NAME_PATTERN.match(name):
+        raise ValueError(
+            "Collection names may only contain letters, digits, spaces, dots, dashes and "
+            "underscores, up to 64 characters"
+        )
+    return os.path.join(root, name)
+
+
+def _model_name(embeddings) -> str:
+    """
+    Name the embedding model of an index, to check a collection is searched with the model it
+    was embedded with. Models other than `EmbeddingEngine` and the LangChain wrappers that
+    expose `model_name` are named after their class.
+    """
+    return getattr(embeddings, "model_name", None) or type(embeddings).__name__
+
+
+def list_collections(root: str = DEFAULT_COLLECTIONS_DIR) -> List[str]:
+    """
+    List the saved collections.
+
+    Args:
+        root (str): The directory holding the collections.
+
+    Returns:
+        List[str]: The names of the collections, sorted.
+    """
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        entry.name
+        for entry in os.scandir(root)
+        if os.path.exists(os.path.join(entry.path, "collection.json"))
+    )
+
+
+def collection_saves_enabled() -> bool:
+    """
+    Return whether collections may be saved from the app, i.e. whether a passphrase is set.
+    """
+    return COLLECTION_PASSWORD is not None
+
+
+def check_collection_password(password: str) -> bool:
+    """
+    Check a passphrase against `FREESTREAM_COLLECTION_PASSWORD`, in constant time.
+
+    Args:
+        password (str): The passphrase entered.
+
+    Returns:
+        bool: Whether saving from the app is enabled and the passphrase matches.
+    """
+    if COLLECTION_PASSWORD is None:
+        return False
+    return hmac.compare_digest(password.encode(), COLLECTION_PASSWORD.encode())
+
+
+def save_collection(
+    index: RetrieveDocuments,
+    name: str,
+    root: str = DEFAULT_COLLECTIONS_DIR,
+    overwrite: bool = False,
+):
+    """
+    Save an index as a named collection.
+
+    The FAISS index, the docstore, the file records and the settings needed to search it are
+    written to a new directory. With `overwrite`, it then atomically takes the place of any
+    collection of that name; otherwise an existing collection is never replaced.
+
+    Args:
+        index (RetrieveDocuments): The index to save. It must hold at least one chunk.
+        name (str): The name of the collection.
+        root (str): The directory holding the collections.
+        overwrite (bool): Whether to replace a collection of the same name.
+    """
+    path = _collection_dir(name, root)
+    if not overwrite and os.path.exists(path):
+        raise ValueError(f"Collection {name} already exists")
+    os.makedirs(root, exist_ok=True)
+    with index.lock:
+        if index.vectordb is None:
+            raise ValueError("Cannot save an empty index")
+        vectordb = index.vectordb
+        staging = tempfile.mkdtemp(dir=root, prefix=".saving-")
+        try:
+            faiss.write_index(vectordb.index, os.path.join(staging, "index.faiss"))
+            payload = {
+                "index_to_docstore_id": [
+                    vectordb.index_to_docstore_id[i]
+                    for i in range(vectordb.index.ntotal)
+                ],
+                "docs": {
+                    id: {"page_content": doc.page_content, "metadata": doc.metadata}
+                    for id, doc in vectordb.docstore._dict.items()
+                },
+                "file_chunk_ids": index.file_chunk_ids,
+                "chunk_owners": index.chunk_owners,
+            }
+            if index.exact_vectors is not None:
+                payload["exact_ids"] = index.exact_vectors.save(
+                    os.path.join(staging, "exact.f32")
+                )
+            with open(os.path.join(staging, "docstore.json.z"), "wb") as f:
+                f.write(zlib.compress(json.dumps(payload, default=str).encode(), 6))
+
+            if index.bm25 is not None:
+                index.bm25.save(os.path.join(staging, "lexical.npz"))
+            if index.projection is not None:
+                np.savez(
+                    os.path.join(staging, "projection.npz"),
+                    mean=(
+                        index.projection.mean
+                        if index.projection.mean is not None
+                        else []
+                    ),
+                    components=(
+                        index.projection.components
+                        if index.projection.components is not None
+                        else []
+                    ),
+                )
+            metadata = {
+                "version": COLLECTION_FORMAT_VERSION,
+                "name": name,
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "model_name": _model_name(index.embeddings),
+                "files": len(index.file_chunk_ids),
+                "chunks": vectordb.index.ntotal,
+                "dim": vectordb.index.d,
+                "settings": {
+                    "chunking": index.chunking,
+                    "max_context_tokens": index.max_context_tokens,
+                    "vector_storage": index.vector_storage,
+                    "reduce_dim": index.reduce_dim,
+                    "reduction": index.reduction,
+                    "index_type": index.index_type,
+                    "nprobe": index.nprobe,
+                    "ef_search": index.ef_search,
+                    "lexical": index.lexical,
+                    "query_cache_size": (
+                        index.query_cache.max_entries
+                        if index.query_cache is not None
+                        else 0
+                    ),
+                    "compress_tokens": (
+                        index.compressor.max_tokens
+                        if index.compressor is not None
+                        else None
+                    ),
+                },
+            }
+            with open(os.path.join(staging, "collection.json"), "w") as f:
+                json.dump(metadata, f, indent=2)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    if not overwrite:
+        # Renaming onto an existing collection fails, so a concurrent save is never replaced
+        try:
+            os.rename(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise ValueError(f"Collection {name} already exists")
+        logger.info(
+            "Saved collection %s (%d chunks) to %s", name, metadata["chunks"], path
+        )
+        return
+
+    # Swap the new directory in, keeping the old one until the swap has happened
+    old = None
+    if os.path.exists(path):
+        old = tempfile.mkdtemp(dir=root, prefix=".replaced-")
+        os.replace(path, os.path.join(old, "collection"))
+    os.replace(staging, path)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+    logger.info("Saved collection %s (%d chunks) to %s", name, metadata["chunks"], path)
+
+
+def load_collection(
+    name: str, root: str = DEFAULT_COLLECTIONS_DIR, **kwargs
+) -> RetrieveDocuments:
+    """
+    Load a named collection as a read-only index.
+
+    The FAISS index is memory-mapped rather than read, so a cold start only pages in the
+    vectors that searches touch. The collection cannot be changed once loaded.
+
+    Args:
+        name (str): The name of the collection.
+        root (str): The directory holding the collections.
+        **kwargs: Further keyword arguments for `RetrieveDocuments`, e.g. `embeddings`, or
+            `nprobe` and `ef_search` to tune an approximate index.
+
+    Returns:
+        RetrieveDocuments: The loaded index, ready to search.
+    """
+    path = _collection_dir(name, root)
+    with open(os.path.join(path, "collection.json")) as f:
+        metadata = json.load(f)
+    if metadata["version"] != COLLECTION_FORMAT_VERSION:
+        raise ValueError(f"Collection {name} was saved in an unsupported format")
+
+    index = RetrieveDocuments(cache_dir=None, **{**metadata["settings"], **kwargs})
+    model_name = _model_name(index.embeddings)
+    if model_name != metadata["model_name"]:
+        raise ValueError(
+            f"Collection {name} was embedded with {metadata['model_name']}, "
+            f"not {model_name}"
+        )
+    with open(os.path.join(path, "docstore.json.z"), "rb") as f:
+        payload = json.loads(zlib.decompress(f.read()))
+
+    docstore = InMemoryDocstore(
+        {id: Document(**doc) for id, doc in payload["docs"].items()}
+    )
+    faiss_index = faiss.read_index(os.path.join(path, "index.faiss"), _MMAP_FLAG)
+    configure_search(faiss_index, index.nprobe, index.ef_search)
+    index.vectordb = FAISS(
+        index.embeddings,
+        faiss_index,
+        docstore,
+        dict(enumerate(payload["index_to_docstore_id"])),
+    )
+    if "exact_ids" in payload:
+        index.exact_vectors = ExactVectors(
+            metadata["dim"], os.path.join(path, "exact.f32"), payload["exact_ids"]
+        )
+    if index.projection is not None:
+        arrays = np.load(os.path.join(path, "projection.npz"))
+        if arrays["components"].size:
+            index.projection.mean = arrays["mean"]
+            index.projection.components = arrays["components"]
+    if index.bm25 is not None:
+        lexical_path = os.path.join(path, "lexical.npz")
+        if os.path.exists(lexical_path):
+            index.bm25 = BM25Index.load(lexical_path)
+        else:
+            # Saved without a lexical index, so build one from the chunks
+            ids = payload["index_to_docstore_id"]
+            index.bm25.add(ids, [docstore.search(id).page_content for id in ids])
+    index.file_chunk_ids = payload["file_chunk_ids"]
+    index.chunk_owners = payload["chunk_owners"]
+    for id, owners in index.chunk_owners.items():
+        index.metadata_index.update(id, owners.values())
+    index.read_only = True
+    index.retriever = IndexRetriever(index=index, search_kwargs=index.search_kwargs)
+    logger.info("Loaded collection %s (%d chunks)", name, metadata["chunks"])
+    return index
+
+
+def get_collection(name: str, root: str = DEFAULT_COLLECTIONS_DIR) -> RetrieveDocuments:
+    """
+    Return a loaded collection, shared by every session through the retriever cache.
+
+    Args:
+        name (str): The name of the collection.
+        root (str): The directory holding the collections.
+
+    Returns:
+        RetrieveDocuments: The loaded, read-only index.
+    """
+    retriever_cache = get_retriever_cache()
+    cache_key = ("collection", root, name)
+    index = retriever_cache.get(cache_key)
+    if index is None:
+        index = load_collection(name, root)
+        retriever_cache.put(cache_key, index)
+    return index
+
+
+if __name__ == "__main__":
+    from .benchmark_operators import LocalFile
+
+    parser = argparse.ArgumentParser(description="Build a named RAGbot collection.")
+    parser.add_argument("name", help="The name of the collection.")
+    parser.add_argument("files", nargs="+", help="Files to index.")
+    parser.add_argument("--root", default=DEFAULT_COLLECTIONS_DIR)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Replace a collection of the same name.",
+    )
+    parser.add_argument(
+        "--compress-tokens",
+        type=int,
+        default=1024,
+        help="The token budget retrieved context is compressed to; 0 disables compression.",
+    )
+    args = parser.parse_args()
+
+    index = RetrieveDocuments(
+        chunking="tokens",
+        max_context_tokens=2048,
+        compress_tokens=args.compress_tokens or None,
+    )
+    if index.update_retriever([LocalFile(filepath) for filepath in args.files]) is None:
+        sys.exit("None of the files could be indexed.")
+    save_collection(index, args.name, args.root, overwrite=args.overwrite)
+    index.close()
@@ -0,0 +1,175 @@
+import logging
+import os
+import re
+import sys
+import threading
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# Token budget retrieved context is compressed to, or unset to hand chunks to the LLM verbatim
+DEFAULT_COMPRESS_TOKENS = (
+    int(os.environ["FREESTREAM_COMPRESS_TOKENS"])
+    if os.environ.get("FREESTREAM_COMPRESS_TOKENS")
+    else None
+)
+
+# Sentences end at terminal punctuation followed by whitespace; lines and paragraphs, e.g. in
+# code, tables and lists, are split too
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split a text into sentences and lines.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The non-empty sentences, stripped, in order.
+    """
+    return [
+        sentence.strip()
+        for sentence in _SENTENCE_PATTERN.split(text)
+        if sentence.strip()
+    ]
+
+
+class ContextCompressor:
+    """
+    Shrinks retrieved chunks to the sentences most similar to the query, within a token budget.
+
+    When the chunks already fit in the budget they are returned unchanged. Otherwise every
+    sentence of every chunk is embedded in one batch, through the model's uncached path
+    (`embed_transient`) where it has one, and sentences are kept from the most similar to the
+    query down for as long as they fit. Each chunk keeps its kept sentences in their original
+    order, and chunks left without any are dropped.
+
+    Attributes:
+        embeddings (Embeddings): The model sentences and queries are embedded with.
+        count_tokens (Callable[[str], int]): Counts the tokens of a text.
+        max_tokens (int): The token budget of the compressed context.
+        queries (int): The number of contexts compressed.
+        tokens_in (int): The tokens of those contexts before compression.
+        tokens_out (int): The tokens of those contexts after compression.
+        last_saved (int): The tokens saved on the latest context.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        count_tokens: Callable[[str], int],
+        max_tokens: int,
+    ):
+        """
+        Initialize the ContextCompressor object.
+
+        Args:
+            embeddings (Embeddings): The model sentences and queries are embedded with.
+            count_tokens (Callable[[str], int]): Counts the tokens of a text.
+            max_tokens (int): The token budget of the compressed context.
+        """
+        if max_tokens <= 0:
+            raise ValueError("The compression token budget must be positive")
+        self.embeddings = embeddings
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.queries = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.last_saved = 0
+        self._lock = threading.Lock()
+
+    def compress(
+        self,
+        query: str,
+        docs: List[Document],
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[Document]:
+        """
+        Compress retrieved chunks to the sentences most similar to the query.
+
+        Args:
+            query (str): The query the chunks were retrieved for.
+            docs (List[Document]): The retrieved chunks, best first.
+            query_embedding (List[float], optional): The query's embedding, if already known.
+
+        Returns:
+            List[Document]: The compressed chunks, in retrieval order.
+        """
+        tokens_in = sum(self.count_tokens(doc.page_content) for doc in docs)
+        if tokens_in <= self.max_tokens:
+            self._record(tokens_in, tokens_in)
+            return docs
+
+        sentences: List[Tuple[int, str]] = [
+            (doc_idx, sentence)
+            for doc_idx, doc in enumerate(docs)
+            for sentence in split_sentences(doc.page_content)
+        ]
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+        # Sentences are throwaway, so keep them out of any persistent embedding store
+        embed = getattr(
+            self.embeddings, "embed_transient", self.embeddings.embed_documents
+        )
+        vectors = np.array(
+            embed([sentence for _, sentence in sentences]), dtype=np.float32
+        )
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * max(
+            float(np.linalg.norm(query_vector)), 1e-12
+        )
+        similarity = (vectors @ query_vector) / np.maximum(norms, 1e-12)
+
+        # Take the most similar sentences that still fit, skipping those that don't
+        kept = np.zeros(len(sentences), dtype=bool)
+        remaining = self.max_tokens
+        for idx in np.argsort(-similarity, kind="stable"):
+            tokens = self.count_tokens(sentences[idx][1])
+            if tokens <= remaining:
+                kept[idx] = True
+                remaining -= tokens
+        if not kept.any():
+            # Not even one sentence fits, so leave truncation to the caller
+            self._record(tokens_in, tokens_in)
+            return docs
+
+        compressed = []
+        for doc_idx, doc in enumerate(docs):
+            text = " ".join(
+                sentence
+                for (owner, sentence), keep in zip(sentences, kept)
+                if keep and owner == doc_idx
+            )
+            if text:
+                compressed.append(Document(page_content=text, metadata=doc.metadata))
+        self._record(tokens_in, self.max_tokens - remaining)
+        return compressed
+
+    def _record(self, tokens_in: int, tokens_out: int):
+        with self._lock:
+            self.queries += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+            self.last_saved = tokens_in - tokens_out
+        logger.info(
+            "Compressed context from %d to %d tokens (%d saved)",
+            tokens_in,
+            tokens_out,
+            tokens_in - tokens_out,
+        )
+
+    @property
+    def saved_ratio(self) -> float:
+        """
+        The fraction of context tokens saved across all contexts.
+        """
+        return 1 - self.tokens_out / self.tokens_in if self.tokens_in else 0.0
@@ -0,0 +1,223 @@
+import hashlib
+import logging
+import re
+import sys
+import zlib
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# A Mersenne prime larger than any 32-bit shingle hash, for the MinHash permutations
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+class ChunkDeduplicator:
+    """
+    Finds chunks that are exact or near duplicates of chunks seen before.
+
+    Exact duplicates are matched by a hash of the normalized text. Near duplicates are found
+    with MinHash signatures over word shingles, bucketed by locality-sensitive hashing (LSH) so
+    each lookup only compares against a handful of candidates. A candidate counts as a near
+    duplicate when its estimated Jaccard similarity reaches `threshold`. Lookups can limit
+    which chunks they match unless the texts are identical, e.g. to the chunks of one file.
+
+    Attributes:
+        num_perm (int): The number of hash permutations in each MinHash signature.
+        bands (int): The number of LSH bands the signature is cut into.
+        threshold (float): The minimum estimated Jaccard similarity of a near duplicate.
+        shingle_size (int): The number of words in each shingle.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 128,
+        bands: int = 32,
+        threshold: float = 0.85,
+        shingle_size: int = 5,
+        seed: int = 1,
+    ):
+        """
+        Initialize the ChunkDeduplicator object.
+
+        Args:
+            num_perm (int): The number of hash permutations in each MinHash signature.
+            bands (int): The number of LSH bands. Must divide `num_perm`.
+            threshold (float): The minimum estimated Jaccard similarity of a near duplicate.
+            shingle_size (int): The number of words in each shingle.
+            seed (int): The seed for the hash permutations.
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._identical: Dict[str, str] = {}
+        self._exact: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+        self._entries: Dict[str, Tuple[str, str, np.ndarray]] = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        Lowercase a text and collapse its whitespace.
+        """
+        return " ".join(text.lower().split())
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Compute the MinHash signature of a normalized text.
+
+        Args:
+            text (str): The normalized text.
+
+        Returns:
+            np.ndarray: The signature, one minimum hash per permutation.
+        """
+        words = re.findall(r"\w+", text)
+        shingles = {
+            " ".join(words[i : i + self.shingle_size])
+            for i in range(max(len(words) - self.shingle_size + 1, 1))
+        }
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode()) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        # Universal hashing as in datasketch; uint64 overflow wraps around deterministically
+        products = (np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(
+            _MERSENNE_PRIME
+        )
+        return products.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        rows = self.num_perm // self.bands
+        return [
+            (band, signature[band * rows : (band + 1) * rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def find(
+        self, text: str, near: Optional[Callable[[str], bool]] = None
+    ) -> Optional[str]:
+        """
+        Find a previously added chunk that the text duplicates.
+
+        Args:
+            text (str): The text of the chunk.
+            near (Callable[[str], bool], optional): Whether the chunk with a given ID may be
+                matched when its text is not identical, e.g. because the caller keeps only one
+                of them. Defaults to matching every chunk.
+
+        Returns:
+            str: The ID of the duplicated chunk, or `None` if the text is new.
+        """
+        identical = self._identical.get(hashlib.sha1(text.encode()).hexdigest())
+        if identical is not None:
+            return identical
+
+        normalized = self.normalize(text)
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        exact = self._exact.get(digest)
+        if exact is not None and (near is None or near(exact)):
+            return exact
+
+        signature = self.signature(normalized)
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+        for id in candidates:
+            if near is not None and not near(id):
+                continue
+            similarity = np.mean(self._entries[id][2] == signature)
+            if similarity >= self.threshold:
+                return id
+        return None
+
+    def add(self, id: str, text: str):
+        """
+        Remember a chunk so later duplicates of it can be found.
+
+        Args:
+            id (str): The ID of the chunk.
+            text (str): The text of the chunk.
+        """
+        identical = hashlib.sha1(text.encode()).hexdigest()
+        normalized = self.normalize(text)
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        signature = self.signature(normalized)
+        self._identical.setdefault(identical, id)
+        self._exact.setdefault(digest, id)
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(id)
+        self._entries[id] = (identical, digest, signature)
+
+    def remove(self, id: str):
+        """
+        Forget a chunk, e.g. because its vector was deleted.
+
+        Args:
+            id (str): The ID of the chunk.
+        """
+        entry = self._entries.pop(id, None)
+        if entry is None:
+            return
+        identical, digest, signature = entry
+        if self._identical.get(identical) == id:
+            del self._identical[identical]
+        if self._exact.get(digest) == id:
+            del self._exact[digest]
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(id)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def collapse(
+        self, chunks: List[Document], ids: Optional[List[str]] = None
+    ) -> List[Document]:
+        """
+        Drop chunks that duplicate an earlier chunk in the list, or one added before.
+
+        The surviving chunk records the source of every chunk in the list collapsed into it in
+        `metadata["sources"]`. Survivors are remembered, so later chunks are checked against
+        them too.
+
+        Args:
+            chunks (List[Document]): The chunks to deduplicate.
+            ids (List[str], optional): The ID of each chunk, e.g. its docstore ID, to remember
+                survivors under. Defaults to their positions in the list.
+
+        Returns:
+            List[Document]: The unique chunks, in their original order.
+        """
+        unique = {}
+        for idx, chunk in enumerate(chunks):
+            duplicate = self.find(chunk.page_content)
+            if duplicate is None:
+                id = ids[idx] if ids is not None else str(idx)
+                self.add(id, chunk.page_content)
+                unique[id] = chunk
+                chunk.metadata["sources"] = [chunk.metadata.get("source")]
+            elif duplicate in unique:
+                sources = unique[duplicate].metadata["sources"]
+                if chunk.metadata.get("source") not in sources:
+                    sources.append(chunk.metadata.get("source"))
+        if len(unique) < len(chunks):
+            logger.info("Collapsed %d duplicate chunk(s)", len(chunks) - len(unique))
+        return list(unique.values())
+
+    def __contains__(self, id: str) -> bool:
+        """
+        Whether a chunk is remembered under an ID.
+        """
+        return id in self._entries
@@ -0,0 +1,722 @@
+import argparse
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from .cache_operators import DEFAULT_CACHE_DIR, EmbeddingStore
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# The sentence-transformers model used to embed chunks and queries
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# "torch" runs the model through sentence-transformers; "onnx" runs an int8 export through
+# ONNX Runtime on the CPU, without importing torch
+DEFAULT_EMBEDDING_BACKEND = os.environ.get("FREESTREAM_EMBEDDING_BACKEND", "torch")
+
+# Where `export_onnx_model` writes exported models, one directory per model
+DEFAULT_ONNX_DIR = os.path.join(DEFAULT_CACHE_DIR, "onnx")
+
+# Where each model's persistent embedding store lives, one directory per backend and model
+DEFAULT_EMBEDDING_STORE_DIR = os.path.join(DEFAULT_CACHE_DIR, "embeddings")
+
+# How long the embedding worker waits for more requests once it has seen concurrent ones
+DEFAULT_BATCH_WINDOW = 0.005
+
+# Describes an exported model's pooling and limits, next to its ONNX file
+ONNX_CONFIG_NAME = "freestream_onnx.json"
+
+
+class TorchBackend:
+    """
+    Runs a sentence-transformers model on PyTorch, on the GPU when one is available.
+
+    Attributes:
+        model (HuggingFaceEmbeddings): The loaded model.
+        device (str): The device the model runs on.
+        hidden_size (int): The width of the model's hidden states.
+        intermediate_size (int): The width of the model's feed-forward layers.
+    """
+
+    def __init__(self, model_name: str, device: Optional[str] = None):
+        """
+        Initialize the TorchBackend object and load the model.
+
+        Args:
+            model_name (str): The name of the sentence-transformers model.
+            device (str, optional): The device to run the model on. Defaults to CUDA when
+                available, otherwise the CPU.
+        """
+        # Imported here so deployments on the ONNX backend never load torch
+        import torch
+
+        self._torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = HuggingFaceEmbeddings(
+            model_name=model_name, model_kwargs={"device": self.device}
+        )
+        config = self.model.client[0].auto_model.config
+        self.hidden_size = config.hidden_size
+        self.intermediate_size = config.intermediate_size
+
+    @property
+    def tokenizer(self):
+        return self.model.client.tokenizer
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.model.client.max_seq_length
+
+    @property
+    def num_threads(self) -> int:
+        return self._torch.get_num_threads()
+
+    def available_memory(self) -> Optional[int]:
+        """
+        The free GPU memory in bytes, or `None` when the model runs on the CPU.
+        """
+        if self.device == "cuda":
+            return self._torch.cuda.mem_get_info()[0]
+        return None
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        encode_kwargs = {
+            **self.model.encode_kwargs,
+            "batch_size": batch_size,
+            "show_progress_bar": False,
+        }
+        return np.asarray(self.model.client.encode(texts, **encode_kwargs))
+
+    def close(self):
+        if self.device == "cuda":
+            self._torch.cuda.empty_cache()
+
+
+class OnnxBackend:
+    """
+    Runs a model exported by `export_onnx_model` on ONNX Runtime's CPU provider.
+
+    Token embeddings are mean-pooled and, if the original model did so, L2-normalized in NumPy,
+    reproducing the sentence-transformers pipeline without importing torch.
+
+    Attributes:
+        model_dir (str): The directory holding the exported model.
+        num_threads (int): The number of threads ONNX Runtime may use.
+        hidden_size (int): The width of the model's hidden states.
+        intermediate_size (int): The width of the model's feed-forward layers.
+    """
+
+    def __init__(self, model_dir: str, num_threads: Optional[int] = None):
+        """
+        Initialize the OnnxBackend object and load the model.
+
+        Args:
+            model_dir (str): The directory holding the exported model.
+            num_threads (int, optional): The number of threads ONNX Runtime may use. Defaults
+                to the number of CPU cores.
+        """
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        config_path = os.path.join(model_dir, ONNX_CONFIG_NAME)
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(
+                f"No exported ONNX model in {model_dir}. Run "
+                "`python -m pages.utils.embedding_operators export` first."
+            )
+        with open(config_path) as f:
+            config = json.load(f)
+
+        self.model_dir = model_dir
+        self.max_seq_length = config["max_seq_length"]
+        self.normalize = config["normalize"]
+        self.hidden_size = config["hidden_size"]
+        self.intermediate_size = config["intermediate_size"]
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, config["model_file"]),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = [i.name for i in self.session.get_inputs()]
+
+    def available_memory(self) -> Optional[int]:
+        return None
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            inputs = {
+                name: encoded[name].astype(np.int64) for name in self._input_names
+            }
+            hidden = self.session.run(None, inputs)[0]
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(
+                    np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None
+                )
+            vectors.append(pooled)
+        return np.concatenate(vectors)
+
+    def close(self):
+        self.session = None
+
+
+class EmbeddingEngine(Embeddings):
+    """
+    An embedding model shared by every session in the process.
+
+    The model is loaded once, on first use, and it and its tokenizer are only ever called from
+    one worker thread; text splitters and token counts use a separate copy of the tokenizer
+    (`tokenizer`). So any number of sessions and indexing threads can share one instance
+    safely. Callers queue
+    requests with `submit`, which returns a future. The worker coalesces every queued request,
+    from documents and queries alike, into one micro-batch, so concurrent sessions share model
+    calls instead of competing for the same cores. A lone request is run as soon as it arrives;
+    only when several are already queued does the worker wait up to `batch_window` seconds for
+    more. `close()` releases the model; it is loaded again the next time it is needed.
+
+    Documents are embedded in batches sorted by token length, so each batch pads to a similar
+    length, and batch sizes adapt to a token budget derived from the available memory and
+    thread count. Results are returned in the original order.
+
+    The model runs on one of two backends: "torch" (`TorchBackend`), or "onnx" (`OnnxBackend`),
+    an int8-quantized export that is faster and smaller on CPU-only machines.
+
+    With an `EmbeddingStore`, documents embedded before, by any session or in any file, are
+    read from the store and only the rest go through the model.
+
+    Attributes:
+        model_name (str): The name of the sentence-transformers model.
+        backend (str): The backend the model runs on, "torch" or "onnx".
+        device (str): The device to run a torch model on, or `None` to pick one automatically.
+        onnx_dir (str): The directory holding the model's ONNX export.
+        store (EmbeddingStore): The persistent store of document embeddings, or `None`.
+        batch_window (float): How long to wait for more requests once several are queued.
+        max_batch_texts (int): The number of texts after which no more requests are coalesced.
+        requests (int): The number of requests run by the worker.
+        batches (int): The number of micro-batches those requests were coalesced into.
+        chunks_embedded (int): The number of documents embedded since the engine was created.
+        embed_seconds (float): The time spent embedding those documents.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        device: Optional[str] = None,
+        backend: str = "torch",
+        onnx_dir: Optional[str] = None,
+        store: Optional[EmbeddingStore] = None,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        max_batch_texts: int = 512,
+    ):
+        """
+        Initialize the EmbeddingEngine object. The model is not loaded until it is first used.
+
+        Args:
+            model_name (str): The name of the sentence-transformers model.
+            device (str, optional): The device to run a torch model on. Defaults to CUDA when
+                available, otherwise the CPU.
+            backend (str): "torch" or "onnx".
+            onnx_dir (str, optional): The directory holding the model's ONNX export. Defaults
+                to a directory named after the model under `DEFAULT_ONNX_DIR`.
+            store (EmbeddingStore, optional): A persistent store of document embeddings.
+            batch_window (float): How long to wait for more requests once several are queued,
+                in seconds.
+            max_batch_texts (int): The number of texts after which no more requests are
+                coalesced into a micro-batch.
+        """
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        self.model_name = model_name
+        self.device = device
+        self.backend = backend
+        self.onnx_dir = onnx_dir or os.path.join(DEFAULT_ONNX_DIR, model_name)
+        self.store = store
+        self.batch_window = batch_window
+        self.max_batch_texts = max_batch_texts
+        self.requests = 0
+        self.batches = 0
+        self.chunks_embedded = 0
+        self.embed_seconds = 0.0
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._tokenizer_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the model is currently loaded.
+        """
+        return self._model is not None
+
+    def load(self):
+        """
+        Load the model if it is not loaded yet.
+
+        Returns:
+            TorchBackend | OnnxBackend: The loaded model.
+        """
+        with self._lock:
+            if self._model is None:
+                start = time.perf_counter()
+                if self.backend == "onnx":
+                    self._model = OnnxBackend(self.onnx_dir)
+                else:
+                    self._model = TorchBackend(self.model_name, self.device)
+                logger.info(
+                    "Loaded embedding model %s on the %s backend in %.2f seconds",
+                    self.model_name,
+                    self.backend,
+                    time.perf_counter() - start,
+                )
+            return self._model
+
+    def close(self):
+        """
+        Release the model, once the worker has finished its current micro-batch.
+        """
+        with self._model_lock, self._lock:
+            if self._model is None:
+                return
+            self._model.close()
+            self._model = None
+        logger.info("Released embedding model %s", self.model_name)
+
+    @property
+    def tokenizer(self):
+        """
+        A copy of the model's tokenizer, for splitting texts and counting their tokens.
+
+        The worker thread truncates with the model's own tokenizer, which changes its settings,
+        and a fast tokenizer cannot be changed while another thread is using it. The copy is
+        only ever called with its default settings, so any number of threads can share it.
+        """
+        if self._tokenizer is None:
+            model = self.load()
+            with self._tokenizer_lock:
+                if self._tokenizer is None:
+                    self._tokenizer = copy.deepcopy(model.tokenizer)
+        return self._tokenizer
+
+    @property
+    def max_seq_length(self) -> int:
+        """
+        The maximum number of tokens the model reads from each input; the rest is truncated.
+        """
+        return self.load().max_seq_length
+
+    @property
+    def requests_per_batch(self) -> float:
+        """
+        The average number of requests coalesced into each micro-batch.
+        """
+        return self.requests / self.batches if self.batches else 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        """
+        The average embedding throughput since the engine was created.
+        """
+        return self.chunks_embedded / self.embed_seconds if self.embed_seconds else 0.0
+
+    def token_budget(self) -> int:
+        """
+        Pick how many (padded) tokens to embed per batch.
+
+        The budget grows with the number of threads, so every core gets enough work per batch,
+        and is capped at a quarter of the free memory, at a rough estimate of the activation
+        memory each token needs.
+
+        Returns:
+            int: The maximum number of padded tokens per batch.
+        """
+        model = self.load()
+        available = model.available_memory()
+        if available is not None:
+            budget = 64 * 1024
+        else:
+            try:
+                available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+            except (ValueError, OSError, AttributeError):
+                available = 2 * 1024**3
+            budget = 2048 * model.num_threads
+        # Float32 hidden states and feed-forward activations, with headroom for the rest
+        bytes_per_token = 4 * (model.hidden_size + model.intermediate_size) * 4
+        return max(model.max_seq_length, min(budget, available // 4 // bytes_per_token))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of texts, batched by token length.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in the order of `texts`.
+        """
+        if not texts:
+            return []
+        start = time.perf_counter()
+        # Match HuggingFaceEmbeddings, which embeds newlines as spaces
+        texts = [text.replace("\n", " ") for text in texts]
+        if self.store is None:
+            embeddings = self.submit(texts).result()
+            misses = len(texts)
+        else:
+            keys = [self.store.key(text) for text in texts]
+            embeddings = [
+                None if vector is None else vector.tolist()
+                for vector in self.store.get(keys)
+            ]
+            missing = [idx for idx, vector in enumerate(embeddings) if vector is None]
+            misses = len(missing)
+            if missing:
+                vectors = self.submit([texts[idx] for idx in missing]).result()
+                for idx, vector in zip(missing, vectors):
+                    embeddings[idx] = vector
+                self.store.put([keys[idx] for idx in missing], vectors)
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.chunks_embedded += len(texts)
+            self.embed_seconds += seconds
+        logger.info(
+            "Embedded %d chunks (%d from the model) in %.2f seconds (%.1f chunks/s)",
+            len(texts),
+            misses,
+            seconds,
+            len(texts) / seconds if seconds else 0.0,
+        )
+        return embeddings
+
+    def embed_transient(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed throwaway texts, such as the sentences of retrieved chunks, bypassing the store.
+
+        Unlike `embed_documents`, this neither reads nor fills the embedding store, so it
+        doesn't crowd out chunk embeddings or count towards the store's hit rate.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in the order of `texts`.
+        """
+        if not texts:
+            return []
+        return self.submit([text.replace("\n", " ") for text in texts]).result()
+
+    def submit(self, texts: List[str]) -> Future:
+        """
+        Queue texts for the worker to embed in its next micro-batch.
+
+        Args:
+            texts (List[str]): The texts to embed, with newlines already replaced.
+
+        Returns:
+            Future: Resolves to one embedding per text, in the order of `texts`.
+        """
+        future = Future()
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run_worker, name="embedding-worker", daemon=True
+                )
+                self._worker.start()
+        self._queue.put((texts, future))
+        return future
+
+    def _run_worker(self):
+        while True:
+            requests = [self._queue.get()]
+            size = len(requests[0][0])
+            deadline = None
+            while size < self.max_batch_texts:
+                try:
+                    if deadline is None:
+                        request = self._queue.get_nowait()
+                    else:
+                        timeout = max(deadline - time.monotonic(), 0)
+                        request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    # Requests were already waiting, so others are likely about to arrive
+                    if deadline is None and len(requests) > 1 and self.batch_window > 0:
+                        deadline = time.monotonic() + self.batch_window
+                        continue
+                    break
+                requests.append(request)
+                size += len(request[0])
+
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                vectors = self._embed_sorted(texts)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                self.requests += len(requests)
+                self.batches += 1
+            start = 0
+            for request_texts, future in requests:
+                future.set_result(vectors[start : start + len(request_texts)])
+                start += len(request_texts)
+
+    def _embed_sorted(self, texts: List[str]) -> List[List[float]]:
+        # Only the worker calls the model, so this just keeps `close` from releasing it
+        # mid-batch; `_lock` stays free for callers queueing requests in the meantime
+        with self._model_lock:
+            model = self.load()
+            budget = self.token_budget()
+            lengths = [
+                len(ids)
+                for ids in model.tokenizer(
+                    texts, truncation=True, max_length=model.max_seq_length
+                )["input_ids"]
+            ]
+            order = sorted(range(len(texts)), key=lengths.__getitem__)
+
+            embeddings = [None for _ in texts]
+            batch = []
+            for idx in order:
+                # Sorted ascending, so the newest text is the longest and sets the padding
+                if batch and (len(batch) + 1) * lengths[idx] > budget:
+                    self._embed_batch(model, texts, batch, embeddings)
+                    batch = []
+                batch.append(idx)
+            self._embed_batch(model, texts, batch, embeddings)
+        return embeddings
+
+    @staticmethod
+    def _embed_batch(
+        model,
+        texts: List[str],
+        batch: List[int],
+        embeddings: List[Optional[List[float]]],
+    ):
+        vectors = model.encode([texts[idx] for idx in batch], len(batch))
+        for idx, vector in zip(batch, vectors):
+            embeddings[idx] = vector.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        return self.submit([text.replace("\n", " ")]).result()[0]
+
+
+@st.cache_resource
+def get_embedding_engine(
+    model_name: str = DEFAULT_EMBEDDING_MODEL,
+    backend: str = DEFAULT_EMBEDDING_BACKEND,
+    store_dir: Optional[str] = DEFAULT_EMBEDDING_STORE_DIR,
+) -> EmbeddingEngine:
+    """
+    Return the process-wide embedding engine for a model, shared by every session.
+
+    Args:
+        model_name (str): The name of the sentence-transformers model.
+        backend (str): "torch" or "onnx". Defaults to the `FREESTREAM_EMBEDDING_BACKEND`
+            environment variable, or "torch".
+        store_dir (str, optional): The root directory of the persistent embedding stores.
+            `None` disables the store.
+
+    Returns:
+        EmbeddingEngine: The embedding engine.
+    """
+    store = None
+    if store_dir:
+        # The backends' embeddings differ slightly, so each gets its own store
+        store = EmbeddingStore(
+            os.path.join(store_dir, backend, model_name), f"{backend}:{model_name}"
+        )
+    return EmbeddingEngine(model_name, backend=backend, store=store)
+
+
+def export_onnx_model(
+    model_name: str = DEFAULT_EMBEDDING_MODEL,
+    output_dir: Optional[str] = None,
+    quantize: bool = True,
+) -> str:
+    """
+    Export a sentence-transformers model to ONNX, with int8 dynamic quantization, for `OnnxBackend`.
+
+    This needs torch and sentence-transformers, so run it once where they are installed, e.g.
+    when building the deployment image; serving the export only needs ONNX Runtime.
+
+    Args:
+        model_name (str): The name of the sentence-transformers model.
+        output_dir (str, optional): Where to write the export. Defaults to a directory named
+            after the model under `DEFAULT_ONNX_DIR`.
+        quantize (bool): Whether to quantize the weights to int8.
+
+    Returns:
+        str: The directory holding the export.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = output_dir or os.path.join(DEFAULT_ONNX_DIR, model_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    model = SentenceTransformer(model_name, device="cpu")
+    if not getattr(model[1], "pooling_mode_mean_tokens", False):
+        raise ValueError(
+            f"{model_name} does not use mean pooling, which OnnxBackend assumes"
+        )
+    transformer = model[0].auto_model.eval()
+
+    sample = model.tokenizer(["FreeStream exports this model."], return_tensors="pt")
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in sample
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_file = "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            os.path.join(output_dir, model_file),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    if quantize:
+        quantize_dynamic(
+            os.path.join(output_dir, model_file),
+            os.path.join(output_dir, "model_quantized.onnx"),
+            weight_type=QuantType.QInt8,
+        )
+        model_file = "model_quantized.onnx"
+
+    model.tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ONNX_CONFIG_NAME), "w") as f:
+        json.dump(
+            {
+                "model_name": model_name,
+                "model_file": model_file,
+                "max_seq_length": model.max_seq_length,
+                "normalize": any(
+                    type(module).__name__ == "Normalize" for module in model
+                ),
+                "hidden_size": transformer.config.hidden_size,
+                "intermediate_size": transformer.config.intermediate_size,
+            },
+            f,
+            indent=2,
+        )
+    logger.info("Exported %s to %s", model_name, output_dir)
+    return output_dir
+
+
+def compare_backends(
+    texts: List[str],
+    model_name: str = DEFAULT_EMBEDDING_MODEL,
+    onnx_dir: Optional[str] = None,
+) -> dict:
+    """
+    Check the ONNX backend against the torch backend on a set of texts.
+
+    Args:
+        texts (List[str]): The texts to embed with both backends.
+        model_name (str): The name of the sentence-transformers model.
+        onnx_dir (str, optional): The directory holding the model's ONNX export.
+
+    Returns:
+        dict: The mean and minimum cosine similarity between the two backends' embeddings,
+            and each backend's throughput in texts per second.
+    """
+    results = {}
+    vectors = {}
+    for backend in ("torch", "onnx"):
+        engine = EmbeddingEngine(
+            model_name, device="cpu", backend=backend, onnx_dir=onnx_dir
+        )
+        engine.load()
+        start = time.perf_counter()
+        embeddings = np.asarray(engine.embed_documents(texts))
+        results[f"{backend}_texts_per_second"] = len(texts) / (
+            time.perf_counter() - start
+        )
+        vectors[backend] = embeddings / np.linalg.norm(
+            embeddings, axis=1, keepdims=True
+        )
+        engine.close()
+
+    similarities = (vectors["torch"] * vectors["onnx"]).sum(axis=1)
+    results["mean_cosine_similarity"] = float(similarities.mean())
+    results["min_cosine_similarity"] = float(similarities.min())
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manage ONNX exports of the embedding model."
+    )
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--output-dir", default=None)
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument(
+        "--text-file", default=None, help="Texts for the parity check, one per line."
+    )
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx_model(args.model, args.output_dir, quantize=not args.no_quantize)
+    else:
+        if args.text_file:
+            with open(args.text_file) as f:
+                texts = [line.strip() for line in f if line.strip()]
+        else:
+            texts = [
+                "The quick brown fox jumps over the lazy dog.",
+                "Retrieval augmented generation grounds answers in uploaded documents.",
+                "def configure_retriever(self, uploaded_files): ...",
+                "Error code 0x80070005: access is denied.",
+            ]
+        print(
+            json.dumps(compare_backends(texts, args.model, args.output_dir), indent=2)
+        )
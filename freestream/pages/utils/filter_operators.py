@@ -0,0 +1,119 @@
+import logging
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# The chunk metadata fields a search can be scoped by
+FILTER_FIELDS = ("source", "page", "file_type")
+
+
+def filter_values(metadata: dict) -> Set[Tuple[str, Any]]:
+    """
+    Return the (field, value) pairs a chunk can be filtered by.
+
+    Sources are reduced to their file names, since uploads are saved under a temporary
+    directory, and file types are the lowercase extensions of the sources.
+
+    Args:
+        metadata (dict): The chunk's metadata.
+
+    Returns:
+        set: The chunk's (field, value) pairs.
+    """
+    values = set()
+    source = metadata.get("source")
+    if source:
+        values.add(("source", os.path.basename(source)))
+        values.add(("file_type", os.path.splitext(source)[1].lstrip(".").lower()))
+    if metadata.get("page") is not None:
+        values.add(("page", metadata["page"]))
+    return values
+
+
+class MetadataIndex:
+    """
+    Maps chunk metadata values to the IDs of the chunks that carry them.
+
+    A chunk shared by duplicate files carries the values of every file, so scoping a search
+    to any of them finds it.
+    """
+
+    def __init__(self):
+        """
+        Initialize the MetadataIndex object.
+        """
+        self._ids: Dict[Tuple[str, Any], Set[str]] = {}
+        self._values: Dict[str, Set[Tuple[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def update(self, id: str, metadatas: Iterable[dict]):
+        """
+        Set the metadata of a chunk, replacing what was recorded for it before.
+
+        Args:
+            id (str): The docstore ID of the chunk.
+            metadatas (Iterable[dict]): The metadata of each file the chunk belongs to.
+        """
+        values = set()
+        for metadata in metadatas:
+            values |= filter_values(metadata)
+        old = self._values.pop(id, set())
+        for value in old - values:
+            ids = self._ids[value]
+            ids.discard(id)
+            if not ids:
+                del self._ids[value]
+        for value in values - old:
+            self._ids.setdefault(value, set()).add(id)
+        if values:
+            self._values[id] = values
+
+    def remove(self, id: str):
+        """
+        Forget a chunk.
+
+        Args:
+            id (str): The docstore ID of the chunk.
+        """
+        self.update(id, [])
+
+    def values(self, field: str) -> List[Any]:
+        """
+        List the values of a field across all chunks.
+
+        Args:
+            field (str): One of `FILTER_FIELDS`.
+
+        Returns:
+            list: The distinct values, sorted.
+        """
+        return sorted(value for key, value in self._ids if key == field)
+
+    def ids(self, **filters: List[Any]) -> Set[str]:
+        """
+        Find the chunks matching filters.
+
+        A chunk matches when it has any of the values given for every field given, e.g.
+        `ids(source=["a.pdf", "b.pdf"], page=[0])` finds the first pages of two files.
+
+        Args:
+            **filters: The accepted values of each field in `FILTER_FIELDS`.
+
+        Returns:
+            set: The docstore IDs of the matching chunks.
+        """
+        matches = None
+        for field, values in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Unknown filter field: {field}")
+            found = set()
+            for value in values:
+                found |= self._ids.get((field, value), set())
+            matches = found if matches is None else matches & found
+        return set(self._values) if matches is None else matches
@@ -107,6 +107,14 @@ class PrintRetrievalHandler(BaseCallbackHandler):
         """
         for idx, doc in enumerate(documents):
             source = os.path.basename(doc.metadata["source"])
+            # Deduplicated chunks may appear in several files
+            others = [
+                os.path.basename(other)
+                for other in doc.metadata.get("sources", [])
+                if other != doc.metadata["source"]
+            ]
+            if others:
+                source += f" (also in {', '.join(others)})"
             self.status.write(f"**Document {idx} from {source}**")
             self.status.markdown(doc.page_content)
         self.status.update(state="complete")
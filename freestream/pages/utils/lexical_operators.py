@@ -0,0 +1,288 @@
+import array
+import logging
+import math
+import os
+import re
+import sys
+from collections import Counter
+from typing import Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# How `RetrieveDocuments` combines lexical and dense retrieval
+LEXICAL_MODES = ("off", "hybrid", "prefilter")
+DEFAULT_LEXICAL_MODE = os.environ.get("FREESTREAM_LEXICAL_MODE", "hybrid")
+
+# The rank offset of reciprocal-rank fusion, as proposed by Cormack et al.
+RRF_K = 60
+
+# The number of lexical hits the dense search is narrowed to in "prefilter" mode
+PREFILTER_HITS = 1_000
+
+# Identifiers such as "ERR-404", "get_retriever_cache" or "v1.2.3" are kept whole, and also
+# split into their alphanumeric parts so a query for any part finds them
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+_PART_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase terms for lexical search.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The terms, with compound identifiers followed by their parts.
+    """
+    terms = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        term = match.group()
+        terms.append(term)
+        parts = _PART_PATTERN.findall(term)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[str]], k: int = RRF_K
+) -> List[Tuple[str, float]]:
+    """
+    Merge rankings by summing 1 / (k + rank) for each ID across them.
+
+    Args:
+        rankings (List[List[str]]): The rankings, best first.
+        k (int): The rank offset, which damps the weight of the top few ranks.
+
+    Returns:
+        list: The IDs and their fused scores, best first.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """
+    An inverted index that ranks chunks by Okapi BM25.
+
+    Each term's postings are kept in two compact arrays, the numbers of the chunks containing
+    it (4 bytes each) and its count in each (2 bytes each), and are scored with NumPy, so a
+    query costs time in proportion to the postings of its terms. Removed chunks are skipped
+    until they outnumber the live ones, when the postings are compacted.
+
+    The index is not thread-safe; `RetrieveDocuments` guards it with its own lock.
+
+    Attributes:
+        k1 (float): How quickly repeated terms saturate.
+        b (float): How strongly scores are normalized by chunk length.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize the BM25Index object.
+
+        Args:
+            k1 (float): How quickly repeated terms saturate.
+            b (float): How strongly scores are normalized by chunk length, from 0 to 1.
+        """
+        self.k1 = k1
+        self.b = b
+        self._ids: List[Optional[str]] = []
+        self._numbers: Dict[str, int] = {}
+        self._lengths = array.array("I")
+        self._alive = array.array("B")
+        self._docs: Dict[str, array.array] = {}
+        self._freqs: Dict[str, array.array] = {}
+        self._live_length = 0
+        self._postings = 0
+        self._term_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def add(self, ids: List[str], texts: List[str]):
+        """
+        Index chunks. Chunks already in the index are skipped.
+
+        Args:
+            ids (List[str]): The docstore IDs of the chunks.
+            texts (List[str]): The text of each chunk.
+        """
+        for id, text in zip(ids, texts):
+            if id in self._numbers:
+                continue
+            number = len(self._ids)
+            counts = Counter(tokenize(text))
+            for term, count in counts.items():
+                docs = self._docs.get(term)
+                if docs is None:
+                    docs = self._docs[term] = array.array("I")
+                    self._freqs[term] = array.array("H")
+                    self._term_bytes += sys.getsizeof(term)
+                docs.append(number)
+                self._freqs[term].append(min(count, 0xFFFF))
+            self._postings += len(counts)
+            self._ids.append(id)
+            self._numbers[id] = number
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._alive.append(1)
+            self._live_length += length
+
+    def remove(self, ids: List[str]):
+        """
+        Remove chunks from the index.
+
+        Args:
+            ids (List[str]): The docstore IDs of the chunks.
+        """
+        for id in ids:
+            number = self._numbers.pop(id, None)
+            if number is None:
+                continue
+            self._ids[number] = None
+            self._alive[number] = 0
+            self._live_length -= self._lengths[number]
+        if len(self._ids) > 2 * len(self._numbers):
+            self._compact()
+
+    def _compact(self):
+        """
+        Drop the postings of removed chunks and renumber the live ones.
+        """
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        renumber = (np.cumsum(alive) - 1).astype(np.uint32)
+        self._postings = 0
+        for term in list(self._docs):
+            docs = np.frombuffer(self._docs[term], dtype=np.uint32)
+            keep = alive[docs]
+            if not keep.any():
+                del self._docs[term], self._freqs[term]
+                self._term_bytes -= sys.getsizeof(term)
+                continue
+            freqs = np.frombuffer(self._freqs[term], dtype=np.uint16)
+            self._docs[term] = array.array("I", renumber[docs[keep]].tobytes())
+            self._freqs[term] = array.array("H", freqs[keep].tobytes())
+            self._postings += int(keep.sum())
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)[alive]
+        self._lengths = array.array("I", lengths.tobytes())
+        self._alive = array.array("B", bytes([1]) * len(lengths))
+        self._ids = [id for id in self._ids if id is not None]
+        self._numbers = {id: number for number, id in enumerate(self._ids)}
+
+    def search(
+        self, query: str, k: int, within: Optional[Collection[str]] = None
+    ) -> Tuple[List[str], np.ndarray]:
+        """
+        Find the chunks that best match the terms of a query.
+
+        Args:
+            query (str): The query text.
+            k (int): The maximum number of chunks to return.
+            within (Collection[str], optional): The docstore IDs of the only chunks to return.
+
+        Returns:
+            tuple: The docstore IDs of the matching chunks, best first, and their scores.
+        """
+        size = len(self._numbers)
+        terms = set(tokenize(query))
+        if not size or not terms or k <= 0:
+            return [], np.empty(0, dtype=np.float32)
+        alive = np.frombuffer(self._alive, dtype=np.uint8)
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        average_length = max(self._live_length / size, 1.0)
+        scores = np.zeros(len(self._ids), dtype=np.float32)
+        for term in terms:
+            if term not in self._docs:
+                continue
+            docs = np.frombuffer(self._docs[term], dtype=np.uint32)
+            frequency = int(alive[docs].sum())
+            if not frequency:
+                continue
+            idf = math.log(1 + (size - frequency + 0.5) / (frequency + 0.5))
+            freqs = np.frombuffer(self._freqs[term], dtype=np.uint16).astype(np.float32)
+            norms = self.k1 * (1 - self.b + self.b * lengths[docs] / average_length)
+            # Each chunk appears once per term, so the fancy-indexed add is safe
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + norms)
+        scores *= alive
+        if within is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            numbers = [self._numbers[id] for id in within if id in self._numbers]
+            allowed[np.array(numbers, dtype=np.int64)] = True
+            scores *= allowed
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [self._ids[number] for number in matches], scores[matches]
+
+    def nbytes(self) -> int:
+        """
+        Return the memory held by the postings, chunk lengths and terms, in bytes.
+        """
+        return self._postings * 6 + len(self._ids) * 5 + self._term_bytes
+
+    def save(self, path: str):
+        """
+        Write the index to a `.npz` file that can be read back with `BM25Index.load`.
+
+        Args:
+            path (str): The file to write.
+        """
+        if len(self._ids) > len(self._numbers):
+            self._compact()
+        terms = list(self._docs)
+        sizes = [len(self._docs[term]) for term in terms]
+        np.savez(
+            path,
+            params=np.array([self.k1, self.b]),
+            ids=np.array(self._ids, dtype=str),
+            lengths=np.frombuffer(self._lengths, dtype=np.uint32),
+            terms=np.array(terms, dtype=str),
+            offsets=np.cumsum([0] + sizes),
+            docs=np.frombuffer(
+                b"".join(self._docs[term] for term in terms), dtype=np.uint32
+            ),
+            freqs=np.frombuffer(
+                b"".join(self._freqs[term] for term in terms), dtype=np.uint16
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Read an index written by `save`.
+
+        Args:
+            path (str): The file to read.
+
+        Returns:
+            BM25Index: The index.
+        """
+        with np.load(path) as arrays:
+            k1, b = arrays["params"].tolist()
+            index = cls(k1, b)
+            index._ids = arrays["ids"].tolist()
+            index._numbers = {id: number for number, id in enumerate(index._ids)}
+            index._lengths = array.array("I", arrays["lengths"].tobytes())
+            index._alive = array.array("B", bytes([1]) * len(index._ids))
+            index._live_length = int(arrays["lengths"].sum())
+            offsets = arrays["offsets"]
+            docs = arrays["docs"]
+            freqs = arrays["freqs"]
+            for term, start, stop in zip(
+                arrays["terms"].tolist(), offsets[:-1], offsets[1:]
+            ):
+                index._docs[term] = array.array("I", docs[start:stop].tobytes())
+                index._freqs[term] = array.array("H", freqs[start:stop].tobytes())
+                index._term_bytes += sys.getsizeof(term)
+            index._postings = len(docs)
+        return index
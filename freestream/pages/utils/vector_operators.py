@@ -0,0 +1,663 @@
+import logging
+import os
+import sys
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+# How vectors are held in the FAISS index, and the scalar quantizer used for each
+VECTOR_STORAGES = {
+    "float32": None,
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# The vector storage of new indexes, overridable per deployment
+DEFAULT_VECTOR_STORAGE = os.environ.get("FREESTREAM_VECTOR_STORAGE", "float32")
+
+# The index types `RetrieveDocuments` can build, and the corpus sizes (in vectors) below which
+# each tier is picked when the type is chosen automatically
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+INDEX_TIERS = (("flat", 50_000), ("ivf", 1_000_000), ("ivfpq", None))
+
+# The fewest vectors each trained index type is built from; smaller corpora stay flat
+MIN_TRAINING_VECTORS = {"flat": 0, "ivf": 1_000, "ivfpq": 10_000, "hnsw": 0}
+
+# The number of neighbors of each node in an HNSW graph
+HNSW_M = 32
+
+# Scoped searches over at most this many vectors compare the query with each of them directly
+# instead of searching the index with an ID selector
+SUBSET_SCAN_LIMIT = 20_000
+
+# The width new indexes reduce embeddings to, and how; unset keeps the model's full width
+DEFAULT_REDUCE_DIM = int(os.environ.get("FREESTREAM_REDUCE_DIM", 0)) or None
+DEFAULT_REDUCTION = os.environ.get("FREESTREAM_REDUCTION", "pca")
+
+# The fewest vectors a PCA is fitted on; smaller corpora are indexed at full width until then
+PCA_MIN_SAMPLE = 1_000
+
+
+class VectorProjection:
+    """
+    Reduces embeddings to fewer dimensions before they are indexed.
+
+    "pca" projects onto the principal components of the corpus, fitted once `min_sample`
+    vectors have been indexed; until then the index keeps the full width. "truncate" keeps the leading dimensions and re-normalizes them, which is only
+    sound for models trained with Matryoshka representation learning. The same projection
+    is applied to queries, so they are compared in the same space as the chunks.
+
+    Attributes:
+        method (str): "pca" or "truncate".
+        dim (int): The number of dimensions kept.
+        mean (np.ndarray): The mean the PCA centers vectors on, or `None`.
+        components (np.ndarray): The PCA components, one row per kept dimension, or `None`.
+        explained_variance (float): The fraction of the sample's variance the PCA keeps.
+    """
+
+    def __init__(self, method: str, dim: int):
+        """
+        Initialize the VectorProjection object.
+
+        Args:
+            method (str): "pca" or "truncate".
+            dim (int): The number of dimensions kept.
+        """
+        if method not in ("pca", "truncate"):
+            raise ValueError(f"Unknown projection method: {method}")
+        self.method = method
+        self.dim = dim
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+        self.explained_variance = 1.0
+
+    @property
+    def fitted(self) -> bool:
+        """
+        Whether the projection is ready to transform vectors.
+        """
+        return self.method == "truncate" or self.components is not None
+
+    @property
+    def min_sample(self) -> int:
+        """
+        The number of vectors the PCA needs to be fitted on.
+        """
+        return max(PCA_MIN_SAMPLE, self.dim)
+
+    def fit(self, sample: np.ndarray):
+        """
+        Fit the PCA on a sample of the corpus. Does nothing for truncation.
+
+        Args:
+            sample (np.ndarray): Embeddings representative of the corpus.
+        """
+        if self.method != "pca":
+            return
+        if sample.shape[0] < self.dim:
+            logger.warning(
+                "Fitting a %d-dimension PCA on only %d vectors; the rest carry no information",
+                self.dim,
+                sample.shape[0],
+            )
+        self.mean = sample.mean(axis=0)
+        _, singular_values, components = np.linalg.svd(
+            sample - self.mean, full_matrices=False
+        )
+        variance = singular_values**2
+        kept = min(self.dim, components.shape[0])
+        self.components = np.zeros((self.dim, sample.shape[1]), dtype=np.float32)
+        self.components[:kept] = components[:kept]
+        self.explained_variance = float(
+            variance[:kept].sum() / max(variance.sum(), 1e-12)
+        )
+        logger.info(
+            "Fitted a %d-dimension PCA keeping %.1f%% of the variance",
+            self.dim,
+            100 * self.explained_variance,
+        )
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Project embeddings.
+
+        Args:
+            vectors (np.ndarray): The embeddings, one per row.
+
+        Returns:
+            np.ndarray: The projected embeddings, `dim` columns wide.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.method == "truncate":
+            reduced = vectors[:, : self.dim]
+            return reduced / np.clip(
+                np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12, None
+            )
+        return ((vectors - self.mean) @ self.components.T).astype(np.float32)
+
+
+def choose_index_type(size: int) -> str:
+    """
+    Pick the index type for a corpus of `size` vectors, following `INDEX_TIERS`.
+    """
+    for index_type, limit in INDEX_TIERS:
+        if limit is None or size < limit:
+            return index_type
+    return INDEX_TIERS[-1][0]
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """
+    Return the type of a FAISS index, as named in `INDEX_TYPES`.
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def create_faiss_index(
+    storage: str, sample: np.ndarray, index_type: str = "flat"
+) -> faiss.Index:
+    """
+    Create an empty L2 FAISS index of `index_type` that stores vectors as `storage`.
+
+    Trained index types learn from `sample`: IVF types cluster it into about 4 * sqrt(n)
+    lists, so it should be the whole corpus, or a large part of it. A flat or HNSW int8
+    quantizer learns each dimension's range from it, mirrored around zero so a small first
+    batch still yields a usable range; values outside it are clipped, which the exact
+    re-ranking in `search_candidates` corrects for. IVF-PQ compresses vectors itself and
+    ignores `storage`.
+
+    Args:
+        storage (str): "float32", "float16" or "int8".
+        sample (np.ndarray): Vectors representative of the corpus.
+        index_type (str): "flat", "ivf", "ivfpq" or "hnsw".
+
+    Returns:
+        faiss.Index: The empty, trained index.
+    """
+    if storage not in VECTOR_STORAGES:
+        raise ValueError(f"Unknown vector storage: {storage}")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    sample = np.ascontiguousarray(sample, dtype=np.float32)
+    size, dim = sample.shape
+    qtype = VECTOR_STORAGES[storage]
+
+    if index_type in ("ivf", "ivfpq"):
+        nlist = int(max(1, min(4 * np.sqrt(size), size // 39, 65536)))
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivfpq":
+            # Sub-quantizers of at least 8 dimensions each, one byte per sub-quantizer
+            m = max(m for m in range(1, max(dim // 8, 1) + 1) if dim % m == 0)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, 8)
+        elif qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype)
+        index.train(sample)
+        return index
+
+    if index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        else:
+            index = faiss.IndexHNSWSQ(dim, qtype, HNSW_M)
+        index.hnsw.efConstruction = 80
+    elif qtype is None:
+        return faiss.IndexFlatL2(dim)
+    else:
+        index = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(np.vstack([sample, -sample]))
+    return index
+
+
+def configure_search(
+    index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+):
+    """
+    Set how thoroughly an approximate index searches. Exact indexes are left as they are.
+
+    Args:
+        index (faiss.Index): The index.
+        nprobe (int, optional): The number of lists an IVF index scans per query. Defaults to
+            1/32 of its lists, but at least 8. More is slower and finds more true neighbors.
+        ef_search (int, optional): The candidate list size of an HNSW search. Defaults to 64.
+            More is slower and finds more true neighbors.
+    """
+    index_type = index_type_of(index)
+    if index_type in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(nprobe or max(8, ivf.nlist // 32), ivf.nlist)
+    elif index_type == "hnsw":
+        index.hnsw.efSearch = ef_search or 64
+
+
+class ExactVectors:
+    """
+    Full-precision copies of a compact index's vectors, kept in a memory-mapped file.
+
+    The copies are only read to re-rank a handful of search candidates, so they stay on disk
+    and in the page cache rather than in the process's memory. Rows are keyed by docstore ID;
+    deleted rows are reclaimed once they outnumber the live ones.
+
+    Attributes:
+        dim (int): The dimension of the vectors.
+    """
+
+    def __init__(
+        self, dim: int, path: Optional[str] = None, ids: Optional[List[str]] = None
+    ):
+        """
+        Initialize the ExactVectors object.
+
+        Args:
+            dim (int): The dimension of the vectors.
+            path (str, optional): An existing file written by `save`, opened read-only and left
+                in place on `close`. Defaults to a new, empty temporary file.
+            ids (List[str], optional): The docstore IDs of the rows of `path`, in order.
+        """
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._map: Optional[np.memmap] = None
+        self._owned = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="freestream-vectors-", suffix=".f32")
+            os.close(fd)
+        self._path = path
+        self._rows: Dict[str, int] = {id: row for row, id in enumerate(ids or [])}
+        self._size = len(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, ids: List[str], vectors: np.ndarray):
+        """
+        Append vectors.
+
+        Args:
+            ids (List[str]): The docstore IDs of the vectors.
+            vectors (np.ndarray): The vectors, one row per ID.
+        """
+        with self._lock:
+            with open(self._path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            for id in ids:
+                self._rows[id] = self._size
+                self._size += 1
+            self._map = None
+
+    def get(self, ids: List[str]) -> np.ndarray:
+        """
+        Read vectors.
+
+        Args:
+            ids (List[str]): The docstore IDs of the vectors.
+
+        Returns:
+            np.ndarray: The vectors, one row per ID.
+        """
+        with self._lock:
+            if self._map is None:
+                self._map = np.memmap(
+                    self._path, dtype=np.float32, mode="r", shape=(self._size, self.dim)
+                )
+            return np.array(self._map[[self._rows[id] for id in ids]])
+
+    def remove(self, ids: List[str]):
+        """
+        Forget vectors, compacting the backing file if most of it is dead.
+
+        Args:
+            ids (List[str]): The docstore IDs of the vectors.
+        """
+        for id in ids:
+            self._rows.pop(id, None)
+        if self._size > 2 * len(self._rows):
+            ids = list(self._rows)
+            vectors = self.get(ids) if ids else np.empty((0, self.dim), np.float32)
+            with self._lock:
+                self._map = None
+                with open(self._path, "wb") as f:
+                    f.write(vectors.tobytes())
+                logger.info(
+                    "Compacted exact vectors from %d to %d rows", self._size, len(ids)
+                )
+                self._rows = {id: row for row, id in enumerate(ids)}
+                self._size = len(ids)
+
+    def save(self, path: str) -> List[str]:
+        """
+        Write the live vectors to a file that can be reopened with `ExactVectors(dim, path, ids)`.
+
+        Args:
+            path (str): The file to write.
+
+        Returns:
+            List[str]: The docstore IDs of the rows written, in order.
+        """
+        ids = list(self._rows)
+        vectors = self.get(ids) if ids else np.empty((0, self.dim), np.float32)
+        with open(path, "wb") as f:
+            f.write(vectors.tobytes())
+        return ids
+
+    def nbytes(self) -> int:
+        """
+        Return the size of the backing file, in bytes.
+        """
+        return self._size * self.dim * 4
+
+    def close(self):
+        """
+        Release the vectors, deleting the backing file unless it was opened from `save`.
+        """
+        with self._lock:
+            self._map = None
+            self._rows.clear()
+            self._size = 0
+            if not self._owned:
+                return
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
+
+
+class UnitVectors:
+    """
+    L2-normalized copies of an index's vectors, held in memory in FAISS position order.
+
+    Maximal marginal relevance compares candidates by cosine similarity. With the candidates
+    already normalized and resident, it needs one gather and a few matrix-vector products
+    instead of reconstructing every candidate from the index. The copies are float16, half the
+    size of a float32 flat index and ample for ranking by similarity.
+
+    Attributes:
+        dim (int): The dimension of the vectors.
+    """
+
+    def __init__(self, dim: int):
+        """
+        Initialize the UnitVectors object.
+
+        Args:
+            dim (int): The dimension of the vectors.
+        """
+        self.dim = dim
+        self._data = np.empty((0, dim), dtype=np.float16)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vectors: np.ndarray):
+        """
+        Normalize and append vectors, which take the next FAISS positions.
+
+        Args:
+            vectors (np.ndarray): The vectors, one per row.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        size = self._size + len(vectors)
+        if size > len(self._data):
+            # Grow geometrically so streaming many small batches stays linear
+            data = np.empty(
+                (max(size, 2 * len(self._data)), self.dim), dtype=np.float16
+            )
+            data[: self._size] = self._data[: self._size]
+            self._data = data
+        self._data[self._size : size] = vectors / np.maximum(norms, 1e-12)
+        self._size = size
+
+    def remove(self, positions: List[int]):
+        """
+        Drop vectors, shifting later ones down as FAISS does when removing from a flat index.
+
+        Args:
+            positions (List[int]): The FAISS positions of the vectors.
+        """
+        keep = np.ones(self._size, dtype=bool)
+        keep[np.asarray(positions, dtype=np.int64)] = False
+        self._data = self._data[: self._size][keep]
+        self._size = len(self._data)
+
+    def get(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Gather vectors.
+
+        Args:
+            positions (np.ndarray): The FAISS positions of the vectors.
+
+        Returns:
+            np.ndarray: The normalized vectors as float32, one row per position.
+        """
+        return self._data[positions].astype(np.float32)
+
+    def nbytes(self) -> int:
+        """
+        Return the memory held by the vectors, in bytes.
+        """
+        return self._data.nbytes
+
+
+class MappedUnitVectors:
+    """
+    L2-normalized vectors read on demand from a memory-mapped index or its full-precision copies.
+
+    Stands in for `UnitVectors` on memory-mapped collections, where copying every vector into
+    memory would defeat the mapping. Each lookup reads and normalizes only the vectors asked
+    for, so only the candidates of a search are paged in.
+
+    Attributes:
+        dim (int): The dimension of the vectors.
+    """
+
+    def __init__(self, vectordb: FAISS, exact: Optional[ExactVectors] = None):
+        """
+        Initialize the MappedUnitVectors object.
+
+        Args:
+            vectordb (FAISS): The vector database, whose index is read when there are no copies.
+            exact (ExactVectors, optional): Full-precision copies of the index's vectors.
+        """
+        self.dim = vectordb.index.d
+        self._vectordb = vectordb
+        self._exact = exact
+
+    def __len__(self) -> int:
+        return self._vectordb.index.ntotal
+
+    def get(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Read and normalize vectors.
+
+        Args:
+            positions (np.ndarray): The FAISS positions of the vectors.
+
+        Returns:
+            np.ndarray: The normalized vectors as float32, one row per position.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._exact is not None:
+            ids = self._vectordb.index_to_docstore_id
+            vectors = self._exact.get([ids[i] for i in positions.tolist()])
+        else:
+            vectors = self._vectordb.index.reconstruct_batch(positions)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def nbytes(self) -> int:
+        """
+        Return the memory held by the vectors, which is none: they are read on demand.
+        """
+        return 0
+
+
+def maximal_marginal_relevance(
+    query: np.ndarray,
+    vectors: np.ndarray,
+    k: int = 4,
+    lambda_mult: float = 0.5,
+    relevance: Optional[np.ndarray] = None,
+) -> List[int]:
+    """
+    Pick `k` of the candidate vectors that are relevant to the query but unlike each other.
+
+    Selects the same candidates as LangChain's implementation, but keeps each candidate's
+    highest similarity to the picks so far up to date with one matrix-vector product per pick,
+    rather than recomputing every similarity in a Python loop.
+
+    Args:
+        query (np.ndarray): The query embedding.
+        vectors (np.ndarray): The L2-normalized candidate vectors, one per row.
+        k (int): The number of candidates to pick.
+        lambda_mult (float): 1 ranks purely by relevance, 0 purely by diversity.
+        relevance (np.ndarray, optional): The relevance of each candidate, from 0 to 1, e.g.
+            fused from several rankings. Defaults to its cosine similarity to the query.
+
+    Returns:
+        List[int]: The row numbers of the picked candidates, in the order picked.
+    """
+    k = min(k, len(vectors))
+    if k <= 0:
+        return []
+    if relevance is None:
+        query = np.asarray(query, dtype=np.float32)
+        relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    selected = [int(np.argmax(relevance))]
+    redundancy = np.full(len(vectors), -np.inf, dtype=np.float32)
+    while len(selected) < k:
+        redundancy = np.maximum(redundancy, vectors @ vectors[selected[-1]])
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def vector_bytes(index: faiss.Index) -> int:
+    """
+    Return the bytes a FAISS index spends on its vectors and search structures.
+    """
+    index_type = index_type_of(index)
+    if index_type == "hnsw":
+        links = index.hnsw.neighbors.size() * 4
+        return vector_bytes(faiss.downcast_index(index.storage)) + links
+    if index_type in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        # Each vector is stored with its 8-byte ID, plus one centroid per list
+        return index.ntotal * (ivf.code_size + 8) + ivf.nlist * ivf.d * 4
+    return index.ntotal * index.sa_code_size()
+
+
+def selector_parameters(
+    index: faiss.Index, positions: np.ndarray
+) -> faiss.SearchParameters:
+    """
+    Return search parameters that limit a search to some of an index's vectors.
+
+    The index's own `nprobe` or `efSearch` is carried over, since parameters passed to a
+    search replace them.
+
+    Args:
+        index (faiss.Index): The index to search.
+        positions (np.ndarray): The FAISS positions of the vectors to consider.
+
+    Returns:
+        faiss.SearchParameters: The parameters to pass to `index.search`.
+    """
+    selector = faiss.IDSelectorBatch(np.asarray(positions, dtype=np.int64))
+    index_type = index_type_of(index)
+    if index_type in ("ivf", "ivfpq"):
+        nprobe = faiss.extract_index_ivf(index).nprobe
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_candidates(
+    vectordb: FAISS,
+    embedding: List[float],
+    fetch_k: int,
+    exact: Optional[ExactVectors] = None,
+    oversample: int = 4,
+    unit: Optional[UnitVectors] = None,
+    positions: Optional[np.ndarray] = None,
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Find the nearest vectors to a query, re-ranked at full precision if the index is compact.
+
+    A compact index is searched for `oversample` times as many candidates as needed, then the
+    candidates are re-ranked by their exact L2 distance, so quantization error only decides
+    which candidates are considered, not their order.
+
+    Args:
+        vectordb (FAISS): The vector database.
+        embedding (List[float]): The query embedding.
+        fetch_k (int): The number of candidates to return.
+        exact (ExactVectors, optional): Full-precision copies of the index's vectors. `None`
+            means the index itself is full precision.
+        oversample (int): How many more candidates to fetch from a compact index.
+        unit (UnitVectors, optional): Normalized copies of the index's vectors to return
+            instead of the vectors themselves, which spares reconstructing them.
+        positions (np.ndarray, optional): The FAISS positions of the only vectors to consider.
+            Up to `SUBSET_SCAN_LIMIT` of them are compared with the query one by one, so the
+            search costs time in proportion to them; more are searched through the index with
+            an ID selector. Defaults to all vectors.
+
+    Returns:
+        tuple: The docstore IDs of the candidates, nearest first, and their vectors.
+    """
+    query = np.array([embedding], dtype=np.float32)
+    if positions is not None and len(positions) <= SUBSET_SCAN_LIMIT:
+        positions = np.asarray(positions, dtype=np.int64)
+        ids = [vectordb.index_to_docstore_id[i] for i in positions.tolist()]
+        if exact is not None:
+            vectors = exact.get(ids)
+        else:
+            vectors = vectordb.index.reconstruct_batch(positions)
+        order = np.argsort(((vectors - query) ** 2).sum(axis=1), kind="stable")[
+            :fetch_k
+        ]
+        if unit is not None:
+            return [ids[i] for i in order], unit.get(positions[order])
+        return [ids[i] for i in order], vectors[order]
+
+    params = None
+    if positions is not None:
+        params = selector_parameters(vectordb.index, positions)
+    _, indices = vectordb.index.search(
+        query, fetch_k * (oversample if exact is not None else 1), params=params
+    )
+    positions = [int(i) for i in indices[0] if i != -1]
+    ids = [vectordb.index_to_docstore_id[i] for i in positions]
+    if not ids:
+        return [], np.empty((0, vectordb.index.d), dtype=np.float32)
+    if exact is None:
+        if unit is not None:
+            return ids, unit.get(np.array(positions))
+        return ids, np.array([vectordb.index.reconstruct(i) for i in positions])
+
+    vectors = exact.get(ids)
+    order = np.argsort(((vectors - query) ** 2).sum(axis=1))[:fetch_k]
+    if unit is not None:
+        return [ids[i] for i in order], unit.get(np.array(positions)[order])
+    return [ids[i] for i in order], vectors[order]
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app imports its modules as `pages.utils...` from the freestream directory, as Streamlit
+# runs it, so the tests do too
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "freestream")
+)
@@ -0,0 +1,200 @@
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+from pages.utils.cache_operators import (
+    DocumentCache,
+    EmbeddingStore,
+    QueryCache,
+    RetrieverCache,
+    SegmentStore,
+    normalize_query,
+)
+
+
+class Entry:
+    def __init__(self, size):
+        self.size = size
+        self.closed = False
+
+    def memory_usage(self):
+        return {"total": self.size}
+
+    def close(self):
+        self.closed = True
+
+
+def test_retriever_cache_evicts_least_recently_used():
+    cache = RetrieverCache(max_bytes=100)
+    a, b, c = Entry(40), Entry(40), Entry(40)
+    cache.put("a", a, owner="s1")
+    cache.put("b", b, owner="s2")
+    assert cache.get("a") is a
+    cache.put("c", c)
+    assert cache.get("b") is None and b.closed
+    assert not a.closed and not c.closed
+    assert cache.usage()["sessions"] == {"s1": 40, "shared": 40}
+
+
+def test_retriever_cache_remeasures_growing_entries():
+    cache = RetrieverCache(max_bytes=100)
+    a, b = Entry(10), Entry(10)
+    cache.put("a", a)
+    cache.put("b", b)
+    a.size = 95
+    # Looking an entry up re-measures it, and never evicts the entry being used
+    assert cache.get("a") is a
+    assert b.closed and not a.closed
+    assert cache.usage()["entries"] == 1
+
+
+def test_normalize_query():
+    assert normalize_query("  What  IS a Vector? ") == normalize_query(
+        "what is a vector"
+    )
+
+
+def test_query_cache_hits_and_evicts_least_recently_used():
+    cache = QueryCache(max_entries=2)
+    cache.put(1, "first", ["a"], [0.9])
+    cache.put(1, "second", ["b"], [0.8])
+    assert cache.get(1, "First?").ids == ["a"]
+    cache.put(1, "third", ["c"], [0.7])
+    assert cache.get(1, "second") is None
+    assert cache.get(1, "first") is not None
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert len(cache) == 2
+
+
+def test_query_cache_separates_scopes():
+    cache = QueryCache()
+    cache.put(1, "query", ["a"], [0.9], scope=("a.pdf",))
+    assert cache.get(1, "query") is None
+    assert cache.get(1, "query", scope=("a.pdf",)).ids == ["a"]
+
+
+def test_query_cache_drops_results_of_other_versions():
+    cache = QueryCache()
+    cache.put(1, "query", ["a"], [0.9], context=["context"])
+    assert cache.get(2, "query") is None
+    # Results found in an older version than the cache has seen are never stored
+    cache.put(1, "query", ["a"], [0.9])
+    assert cache.get(2, "query") is None
+    cache.put(2, "query", ["b"], [0.8], context=["new"])
+    assert cache.get(2, "query").context == ["new"]
+    cache.clear()
+    assert cache.get(2, "query") is None
+
+
+def segment(text):
+    return [Document(page_content=text)], [Document(page_content=text)]
+
+
+def test_segment_store_keeps_the_first_copy():
+    store = SegmentStore(max_bytes=0)
+    first = store.put("key", *segment("text"))
+    second = store.put("key", *segment("text"))
+    assert second is first
+
+
+def test_segment_store_keeps_held_segments_and_trims_released_ones():
+    store = SegmentStore(max_bytes=0)
+    stored = store.put("key", *segment("text"))
+    store.acquire("key", "index-1")
+    store.acquire("key", "index-2")
+    assert store.charge(["key"]) == stored.nbytes // 2
+    store.release("key", "index-1")
+    assert store.get("key") is stored
+    assert store.charge(["key"]) == stored.nbytes
+    store.release("key", "index-2")
+    # Nothing holds it and there is no budget for unheld segments
+    assert store.get("key") is None
+    assert store.usage() == {"segments": 0, "held": 0, "bytes": 0}
+
+
+def test_segment_store_drops_least_recently_released_first():
+    a = SegmentStore().put("a", *segment("a")).nbytes
+    store = SegmentStore(max_bytes=a)
+    for key in ("a", "b"):
+        store.put(key, *segment(key))
+        store.acquire(key, "index")
+    store.release("a", "index")
+    store.release("b", "index")
+    assert store.get("a") is None
+    assert store.get("b") is not None
+
+
+def fill(store, texts):
+    keys = [store.key(text) for text in texts]
+    vectors = np.arange(len(texts) * 4, dtype=np.float32).reshape(-1, 4)
+    store.put(keys, vectors)
+    return keys, vectors
+
+
+def test_embedding_store_round_trip(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    keys, vectors = fill(store, ["a", "b", "c"])
+    reopened = EmbeddingStore(str(tmp_path), "model")
+    np.testing.assert_array_equal(np.stack(reopened.get(keys)), vectors)
+    assert reopened.get([store.key("missing")]) == [None]
+    assert reopened.key(" a\n") == store.key("a")
+
+
+def test_embedding_store_recovers_from_an_interrupted_write(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    keys, vectors = fill(store, ["a", "b"])
+    # A crash mid-append leaves part of a vector and part of a digest behind
+    with open(os.path.join(tmp_path, "vectors.f32"), "ab") as f:
+        f.write(b"\0" * 6)
+    with open(os.path.join(tmp_path, "index.txt"), "a") as f:
+        f.write("0123456789")
+
+    reopened = EmbeddingStore(str(tmp_path), "model")
+    np.testing.assert_array_equal(np.stack(reopened.get(keys)), vectors)
+    more, more_vectors = fill(reopened, ["c"])
+    final = EmbeddingStore(str(tmp_path), "model")
+    np.testing.assert_array_equal(
+        np.stack(final.get(keys + more)), np.concatenate([vectors, more_vectors])
+    )
+    assert final.size() == 3 * 4 * 4
+
+
+def test_embedding_store_drops_digests_without_vectors(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    keys, _ = fill(store, ["a", "b"])
+    with open(os.path.join(tmp_path, "vectors.f32"), "r+b") as f:
+        f.truncate(4 * 4)
+    reopened = EmbeddingStore(str(tmp_path), "model")
+    found = reopened.get(keys)
+    assert found[0] is not None and found[1] is None
+
+
+def test_embedding_store_discards_another_model(tmp_path):
+    keys, _ = fill(EmbeddingStore(str(tmp_path), "model"), ["a"])
+    other = EmbeddingStore(str(tmp_path), "other")
+    assert other.get(keys) == [None]
+    assert other.size() == 0
+
+
+def test_document_cache_round_trips_and_evicts_least_recently_used(tmp_path):
+    cache = DocumentCache(str(tmp_path))
+    key = DocumentCache.make_key(b"data", {"loader": "_load_text"})
+    assert key != DocumentCache.make_key(b"data", {"loader": "_load_html"})
+    docs = [Document(page_content="whole text", metadata={"source": "a.txt"})]
+    chunks = [Document(page_content="whole", metadata={"source": "a.txt"})]
+    cache.put(key, docs, chunks)
+    assert cache.get(key) == (docs, chunks)
+
+    other = DocumentCache.make_key(b"other", {})
+    cache.put(other, docs, chunks)
+    os.utime(cache._path(key), (0, 0))
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert cache.get(key) is None and cache.get(other) is not None
+
+    # Unreadable entries are dropped instead of failing the upload
+    with open(cache._path(other), "wb") as f:
+        f.write(b"garbage")
+    assert cache.get(other) is None
+    assert not os.path.exists(cache._path(other))
@@ -0,0 +1,454 @@
+import hashlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from pages.utils import vector_operators
+from pages.utils.cache_operators import RetrieverCache, SegmentStore
+from pages.utils.chatbot_operators import (
+    TEXT_LOADERS,
+    RetrieveDocuments,
+    SessionIndexes,
+    _load_pdf_pages,
+    _process_pool,
+    _shutdown_pool,
+    get_loader_name,
+)
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic embeddings, so tests need no model.
+    """
+
+    def _embed(self, text):
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).normal(size=16)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class Upload(io.BytesIO):
+    def __init__(self, name, content):
+        data = content.encode() if isinstance(content, str) else content
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def write_pdf(path, texts):
+    """
+    Write a minimal PDF with one line of text per page.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids),
+        len(kids),
+    )
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+ALPHA = "Alpha reactors vent coolant through the north stack."
+BETA = "Beta reactors are cooled by the river intake."
+LEASE = " ".join(
+    f"Clause {i} of the lease binds the tenant named below." for i in range(40)
+)
+
+
+@pytest.fixture
+def indexes():
+    return SessionIndexes(RetrieverCache(10**9))
+
+
+def get(indexes, session_id, uploads):
+    session = indexes.get(
+        session_id,
+        uploads,
+        cache_dir=None,
+        embeddings=HashEmbeddings(),
+        segments=SegmentStore(),
+        compress_tokens=None,
+    )
+    deadline = time.monotonic() + 30
+    while not session.progress.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return session
+
+
+def test_sessions_share_files_but_only_see_their_own(indexes):
+    first = get(indexes, "first", [Upload("alpha.txt", ALPHA)])
+    second = get(
+        indexes, "second", [Upload("renamed.txt", ALPHA), Upload("beta.txt", BETA)]
+    )
+    assert first.index is second.index
+    # The shared file is indexed once
+    assert first.index.vectordb.index.ntotal == 2
+
+    docs = first.retriever.invoke("reactors")
+    assert [doc.metadata["source"] for doc in docs] == ["alpha.txt"]
+    sources = {doc.metadata["source"] for doc in second.retriever.invoke("reactors")}
+    assert sources == {"renamed.txt", "beta.txt"}
+    scoped = second.scoped_retriever(["beta.txt"]).invoke("reactors")
+    assert [doc.metadata["source"] for doc in scoped] == ["beta.txt"]
+    assert second.sources() == ["beta.txt", "renamed.txt"]
+
+
+def test_files_no_session_holds_leave_the_index(indexes):
+    first = get(indexes, "first", [Upload("alpha.txt", ALPHA)])
+    get(indexes, "second", [Upload("beta.txt", BETA)])
+    assert len(first.index.file_chunk_ids) == 2
+    get(indexes, "second", [])
+    assert len(first.index.file_chunk_ids) == 1
+    indexes.release("first")
+    assert not first.index.file_chunk_ids
+    get(indexes, "first", [Upload("alpha.txt", ALPHA)])
+
+    # Sessions that go unseen for too long let go of their files
+    indexes.session_ttl = 0
+    third = get(indexes, "third", [Upload("beta.txt", BETA)])
+    assert list(indexes._sessions) == ["third"]
+    assert list(first.index.file_chunk_ids) == list(third.files)
+
+
+def test_sessions_never_see_text_from_near_duplicate_files(indexes):
+    first = get(indexes, "first", [Upload("alice.txt", LEASE + " Tenant Alice Smith.")])
+    second = get(indexes, "second", [Upload("bob.txt", LEASE + " Tenant Bob Jones.")])
+    assert first.index is second.index
+
+    [doc] = first.retriever.invoke("tenant")
+    assert doc.metadata["source"] == "alice.txt"
+    assert doc.page_content.endswith("Alice Smith.")
+    [doc] = second.retriever.invoke("tenant")
+    assert doc.metadata["source"] == "bob.txt"
+    assert doc.page_content.endswith("Bob Jones.")
+
+
+def test_cache_usage_charges_the_shared_index_to_sessions(indexes):
+    get(indexes, "first", [Upload("alpha.txt", ALPHA)])
+    get(indexes, "second", [Upload("renamed.txt", ALPHA), Upload("beta.txt", BETA)])
+    usage = indexes.usage()
+    sessions = usage["sessions"]
+    assert set(sessions) == {"first", "second", "shared"}
+    # The first session holds half of one of two files, the second the rest
+    assert sessions["second"] == pytest.approx(3 * sessions["first"], abs=3)
+    assert sum(sessions.values()) == usage["bytes"]
+
+
+def test_configure_retriever_indexes_the_files():
+    index = RetrieveDocuments(
+        cache_dir=None, embeddings=HashEmbeddings(), compress_tokens=None
+    )
+    retriever = index.configure_retriever([Upload("alpha.txt", ALPHA)])
+    [doc] = retriever.invoke("reactors")
+    assert doc.page_content == ALPHA
+
+
+class WordTokenizer:
+    """
+    Counts words as tokens and, like BERT, adds [CLS] and [SEP] around each input.
+    """
+
+    def tokenize(self, text):
+        return text.split()
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+
+class TokenizedEmbeddings(HashEmbeddings):
+    model_name = "word-model"
+    max_seq_length = 16
+    tokenizer = WordTokenizer()
+
+
+def test_token_chunks_leave_room_for_special_tokens():
+    index = RetrieveDocuments(
+        cache_dir=None,
+        chunking="tokens",
+        embeddings=TokenizedEmbeddings(),
+        compress_tokens=None,
+    )
+    text = " ".join(f"word{i}" for i in range(200))
+    chunks = index.split_documents("key", [Document(page_content=text)])
+    assert len(chunks) > 1
+    assert max(index.count_tokens(chunk.page_content) for chunk in chunks) == 14
+
+
+def test_context_is_trimmed_to_the_token_budget():
+    index = RetrieveDocuments(
+        cache_dir=None,
+        chunking="tokens",
+        embeddings=TokenizedEmbeddings(),
+        max_context_tokens=25,
+        compress_tokens=None,
+    )
+    docs = [Document(page_content=" ".join([str(i)] * 10)) for i in range(4)]
+    fitted = index.fit_context(docs)
+    assert [index.count_tokens(doc.page_content) for doc in fitted] == [10, 10, 5]
+
+
+class CountingEmbeddings(HashEmbeddings):
+    def __init__(self):
+        self.queries = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+def test_query_cache_is_dropped_when_the_index_changes():
+    embeddings = CountingEmbeddings()
+    index = RetrieveDocuments(
+        cache_dir=None, embeddings=embeddings, compress_tokens=None
+    )
+    alpha = Upload("alpha.txt", ALPHA)
+    retriever = index.update_retriever([alpha])
+    first = retriever.invoke("Which reactors?")
+    # Repeats up to case, spacing and punctuation skip the embedding and the search
+    assert retriever.invoke("  which REACTORS ") == first
+    assert embeddings.queries == 1
+    assert index.query_cache.hits == 1
+
+    index.update_retriever([alpha, Upload("beta.txt", BETA)])
+    docs = retriever.invoke("Which reactors?")
+    assert embeddings.queries == 2
+    sources = {os.path.basename(doc.metadata["source"]) for doc in docs}
+    assert sources == {"alpha.txt", "beta.txt"}
+
+
+def test_large_pdfs_are_streamed_page_by_page(tmp_path):
+    path = tmp_path / "manual.pdf"
+    write_pdf(path, [f"Page {i} covers valve {i}." for i in range(3)])
+    pages = _load_pdf_pages(str(path), 1, 3)
+    assert [(page.metadata["page"], page.page_content) for page in pages] == [
+        (1, "Page 1 covers valve 1."),
+        (2, "Page 2 covers valve 2."),
+    ]
+
+    index = RetrieveDocuments(
+        cache_dir=None,
+        embeddings=HashEmbeddings(),
+        compress_tokens=None,
+        lazy_pdf_bytes=0,
+        max_workers=1,
+    )
+    index.update_retriever([Upload("manual.pdf", path.read_bytes())])
+    [(key, ids)] = index.file_chunk_ids.items()
+    docs = [index.vectordb.docstore.search(id) for id in ids]
+    assert [doc.metadata["page"] for doc in docs] == [0, 1, 2]
+    # Neither the text nor the uploaded file is kept once indexed
+    assert index.file_docs[key] == []
+    assert not os.listdir(os.path.join(index.temp_dir.name, key))
+
+
+def test_pdf_page_ranges_are_extracted_in_parallel_and_in_order(tmp_path):
+    path = tmp_path / "manual.pdf"
+    write_pdf(path, [f"Page {i} covers valve {i}." for i in range(7)])
+    index = RetrieveDocuments(
+        cache_dir=None,
+        embeddings=HashEmbeddings(),
+        compress_tokens=None,
+        max_workers=2,
+        pages_per_task=2,
+    )
+    chunks = list(index.iter_pdf_chunks(str(path)))
+    assert [chunk.metadata["page"] for chunk in chunks] == list(range(7))
+    assert chunks[6].page_content == "Page 6 covers valve 6."
+
+    # Abandoning the stream shuts the workers down
+    stream = index.iter_pdf_chunks(str(path))
+    assert next(stream).metadata["page"] == 0
+    stream.close()
+
+
+def topics(count):
+    return [
+        Upload(f"doc{i}.txt", f"Document {i} is about topic {i}.") for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_compact_indexes_find_the_exact_match(storage):
+    embeddings = HashEmbeddings()
+    index = RetrieveDocuments(
+        cache_dir=None,
+        embeddings=embeddings,
+        compress_tokens=None,
+        vector_storage=storage,
+        lexical="off",
+    )
+    uploads = topics(40)
+    index.update_retriever(uploads)
+    assert index.exact_vectors is not None
+    for upload in uploads:
+        text = upload.getvalue().decode()
+        [id], [score] = index.search_ids(embeddings.embed_query(text), k=1)
+        assert index.vectordb.docstore.search(id).page_content == text
+        assert score == pytest.approx(1.0, abs=1e-3)
+
+
+def test_pca_is_fitted_once_enough_chunks_are_indexed(monkeypatch):
+    monkeypatch.setattr(vector_operators, "PCA_MIN_SAMPLE", 20)
+    embeddings = HashEmbeddings()
+    index = RetrieveDocuments(
+        cache_dir=None,
+        embeddings=embeddings,
+        compress_tokens=None,
+        reduce_dim=4,
+        lexical="off",
+    )
+    uploads = topics(30)
+    index.update_retriever(uploads[:10])
+    # Too few chunks to fit on, so they are kept at full width
+    assert not index.projection.fitted
+    assert index.vectordb.index.d == 16
+
+    index.update_retriever(uploads)
+    assert index.projection.fitted
+    assert index.vectordb.index.d == 4
+    text = uploads[25].getvalue().decode()
+    [id], _ = index.search_ids(embeddings.embed_query(text), k=1)
+    assert index.vectordb.docstore.search(id).page_content == text
+
+
+def test_indexes_are_rebuilt_as_they_outgrow_their_type(monkeypatch):
+    monkeypatch.setattr(vector_operators, "INDEX_TIERS", (("flat", 20), ("ivf", None)))
+    monkeypatch.setitem(vector_operators.MIN_TRAINING_VECTORS, "ivf", 20)
+    embeddings = HashEmbeddings()
+    index = RetrieveDocuments(
+        cache_dir=None, embeddings=embeddings, compress_tokens=None, lexical="off"
+    )
+    uploads = topics(30)
+    index.update_retriever(uploads[:10])
+    assert vector_operators.index_type_of(index.vectordb.index) == "flat"
+
+    index.update_retriever(uploads)
+    assert vector_operators.index_type_of(index.vectordb.index) == "ivf"
+    assert index.vectordb.index.ntotal == 30
+    for upload in uploads:
+        text = upload.getvalue().decode()
+        [id], _ = index.search_ids(embeddings.embed_query(text), k=1, fetch_k=30)
+        assert index.vectordb.docstore.search(id).page_content == text
+
+
+def test_workers_still_running_are_terminated_on_shutdown():
+    executor = _process_pool(1)
+    future = executor.submit(time.sleep, 60)
+    deadline = time.monotonic() + 30
+    while not future.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    processes = list(executor._processes.values())
+    _shutdown_pool(executor, [future])
+    for process in processes:
+        process.join(10)
+        assert not process.is_alive()
+
+
+def test_uploads_sharing_a_name_are_indexed_apart(tmp_path):
+    index = RetrieveDocuments(
+        cache_dir=str(tmp_path), embeddings=HashEmbeddings(), compress_tokens=None
+    )
+    uploads = [Upload("notes.txt", ALPHA), Upload("notes.txt", BETA)]
+    index.update_retriever(uploads)
+    texts = {
+        index.vectordb.docstore.search(id).page_content
+        for ids in index.file_chunk_ids.values()
+        for id in ids
+    }
+    assert texts == {ALPHA, BETA}
+    assert (
+        len({index.upload_path(key, "notes.txt") for key in index.file_chunk_ids}) == 2
+    )
+
+    # A second index reads both files back from the document cache
+    other = RetrieveDocuments(
+        cache_dir=str(tmp_path), embeddings=HashEmbeddings(), compress_tokens=None
+    )
+    for key in index.file_chunk_ids:
+        docs, _ = other.cache.get(key)
+        assert docs[0].page_content in {ALPHA, BETA}
+
+
+class RecordingEmbeddings(HashEmbeddings):
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_only_changed_files_are_indexed_or_removed():
+    embeddings = RecordingEmbeddings()
+    index = RetrieveDocuments(
+        cache_dir=None, embeddings=embeddings, compress_tokens=None
+    )
+    alpha, beta = Upload("alpha.txt", ALPHA), Upload("beta.txt", BETA)
+    index.update_retriever([alpha, beta])
+    assert index.vectordb.index.ntotal == 2
+
+    index.update_retriever([alpha])
+    assert index.vectordb.index.ntotal == 1
+    [doc] = index.retriever.invoke("reactors")
+    assert doc.page_content == ALPHA
+
+    # Only the file that came back is embedded again
+    embeddings.embedded.clear()
+    index.update_retriever([alpha, beta])
+    assert embeddings.embedded == [BETA]
+    assert index.vectordb.index.ntotal == 2
+
+
+def test_plain_text_formats_are_decoded_in_memory():
+    html = (
+        b"<html><style>p {}</style><p>Hello</p><script>x()</script><p>world</p></html>"
+    )
+    notebook = json.dumps(
+        {"cells": [{"source": ["import os\n", "os.getcwd()"]}, {"source": "# Notes"}]}
+    ).encode()
+    assert TEXT_LOADERS[".html"](html) == "Hello\nworld"
+    assert TEXT_LOADERS[".csv"](b"a,b\n1,2\n") == "a, b\n1, 2"
+    assert TEXT_LOADERS[".ipynb"](notebook) == "import os\nos.getcwd()\n\n# Notes"
+    # A byte order mark is dropped and invalid bytes are replaced
+    assert TEXT_LOADERS[".txt"]("\ufeffcafé".encode() + b"\xff") == "café\ufffd"
+    assert get_loader_name("REPORT.MD") == "_load_text"
+    assert get_loader_name("report.pdf") == "UnstructuredFileLoader"
@@ -0,0 +1,41 @@
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from pages.utils.chatbot_operators import RetrieveDocuments
+from pages.utils.collection_operators import load_collection, save_collection
+
+from .test_chatbot_operators import ALPHA, BETA, HashEmbeddings, Upload
+
+
+class OtherEmbeddings(HashEmbeddings):
+    pass
+
+
+def build(embeddings: Embeddings) -> RetrieveDocuments:
+    index = RetrieveDocuments(
+        cache_dir=None, embeddings=embeddings, compress_tokens=None
+    )
+    index.update_retriever([Upload("alpha.txt", ALPHA), Upload("beta.txt", BETA)])
+    return index
+
+
+def test_collections_round_trip_with_any_embeddings(tmp_path):
+    index = build(HashEmbeddings())
+    save_collection(index, "reactors", root=str(tmp_path))
+    loaded = load_collection(
+        "reactors", root=str(tmp_path), embeddings=HashEmbeddings()
+    )
+
+    assert loaded.read_only
+    assert loaded.file_chunk_ids == index.file_chunk_ids
+    for query in ["alpha reactors", "river intake"]:
+        expected = [doc.page_content for doc in index.retriever.invoke(query)]
+        assert [doc.page_content for doc in loaded.retriever.invoke(query)] == expected
+    # Settings are restored from the collection
+    assert loaded.search_kwargs == index.search_kwargs
+    assert loaded.lexical == index.lexical
+
+    with pytest.raises(ValueError, match="already exists"):
+        save_collection(index, "reactors", root=str(tmp_path))
+    with pytest.raises(ValueError, match="HashEmbeddings"):
+        load_collection("reactors", root=str(tmp_path), embeddings=OtherEmbeddings())
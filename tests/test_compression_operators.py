@@ -0,0 +1,61 @@
+from langchain_core.documents import Document
+
+from pages.utils.compression_operators import ContextCompressor, split_sentences
+
+from .test_chatbot_operators import HashEmbeddings
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class KeywordEmbeddings(HashEmbeddings):
+    """
+    Embeds texts by whether they mention pumps, so relevance is predictable.
+    """
+
+    def _embed(self, text):
+        return [1.0, 0.0] if "pump" in text.lower() else [0.0, 1.0]
+
+    def embed_transient(self, texts):
+        self.transient = texts
+        return self.embed_documents(texts)
+
+
+def test_sentences_split_on_punctuation_and_lines():
+    assert split_sentences("One two. Three?\n\nfour\n") == [
+        "One two.",
+        "Three?",
+        "four",
+    ]
+
+
+def test_context_is_cut_to_the_most_relevant_sentences_within_budget():
+    embeddings = KeywordEmbeddings()
+    compressor = ContextCompressor(embeddings, count_words, max_tokens=8)
+    docs = [
+        Document(
+            page_content="The sky is blue today. Prime the pump first.",
+            metadata={"source": "a.txt"},
+        ),
+        Document(
+            page_content="Birds sing loudly at dawn.", metadata={"source": "b.txt"}
+        ),
+        Document(page_content="Check the pump seals.", metadata={"source": "c.txt"}),
+    ]
+    compressed = compressor.compress("How do I start the pump?", docs)
+    assert [(doc.page_content, doc.metadata["source"]) for doc in compressed] == [
+        ("Prime the pump first.", "a.txt"),
+        ("Check the pump seals.", "c.txt"),
+    ]
+    assert sum(count_words(doc.page_content) for doc in compressed) <= 8
+    # Sentences bypass any embedding store
+    assert len(embeddings.transient) == 4
+    assert compressor.last_saved == 18 - 8
+
+
+def test_context_within_budget_is_untouched():
+    compressor = ContextCompressor(KeywordEmbeddings(), count_words, max_tokens=100)
+    docs = [Document(page_content="Prime the pump first.")]
+    assert compressor.compress("pump", docs) is docs
+    assert compressor.saved_ratio == 0.0
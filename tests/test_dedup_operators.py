@@ -0,0 +1,39 @@
+from langchain_core.documents import Document
+
+from pages.utils.dedup_operators import ChunkDeduplicator
+
+TEXT = " ".join(f"Section {i} describes how the pump is primed." for i in range(30))
+
+
+def test_collapse_keeps_one_chunk_per_duplicate_and_records_sources():
+    dedup = ChunkDeduplicator()
+    chunks = [
+        Document(page_content=TEXT, metadata={"source": "a.txt"}),
+        Document(page_content=TEXT.upper(), metadata={"source": "b.txt"}),
+        Document(page_content=TEXT + " One more line.", metadata={"source": "c.txt"}),
+        Document(page_content="Something else entirely.", metadata={"source": "d.txt"}),
+    ]
+    unique = dedup.collapse(chunks, ["a-0", "b-0", "c-0", "d-0"])
+    assert [chunk.metadata["source"] for chunk in unique] == ["a.txt", "d.txt"]
+    assert unique[0].metadata["sources"] == ["a.txt", "b.txt", "c.txt"]
+    assert "a-0" in dedup and "b-0" not in dedup
+
+    # Chunks remembered by an earlier call are duplicates too
+    assert dedup.collapse([Document(page_content=TEXT, metadata={})]) == []
+
+
+def test_near_matches_can_be_limited_but_identical_texts_always_match():
+    dedup = ChunkDeduplicator()
+    dedup.add("a-0", TEXT)
+    near = TEXT + " One more line."
+    assert dedup.find(near) == "a-0"
+    assert dedup.find(near, near=lambda id: id.startswith("b-")) is None
+    assert dedup.find(TEXT, near=lambda id: id.startswith("b-")) == "a-0"
+
+
+def test_removed_chunks_are_forgotten():
+    dedup = ChunkDeduplicator()
+    dedup.add("a-0", TEXT)
+    dedup.remove("a-0")
+    assert dedup.find(TEXT) is None
+    assert "a-0" not in dedup
@@ -0,0 +1,166 @@
+import threading
+
+import numpy as np
+
+from pages.utils.embedding_operators import (
+    EmbeddingEngine,
+    OnnxBackend,
+    get_embedding_engine,
+)
+
+
+class WordTokenizer:
+    """
+    Counts words as tokens, and remembers the settings it was last called with.
+    """
+
+    def __init__(self):
+        self.settings = None
+
+    def __call__(self, texts, truncation, max_length):
+        self.settings = (truncation, max_length)
+        return {
+            "input_ids": [[0] * min(len(text.split()), max_length) for text in texts]
+        }
+
+
+class FakeModel:
+    """
+    Embeds a text as its word count, and can hold the worker inside a model call.
+    """
+
+    max_seq_length = 8
+    num_threads = 1
+    hidden_size = 4
+    intermediate_size = 4
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.tokenizer = WordTokenizer()
+
+    def available_memory(self):
+        return None
+
+    def encode(self, texts, batch_size):
+        self.calls.append(list(texts))
+        self.started.set()
+        self.release.wait()
+        return np.array([[len(text.split()), 1.0] for text in texts])
+
+    def close(self):
+        pass
+
+
+def engine_with(model):
+    engine = EmbeddingEngine(batch_window=0)
+    engine._model = model
+    return engine
+
+
+def test_documents_come_back_in_order_from_length_sorted_batches():
+    model = FakeModel()
+    engine = engine_with(model)
+    texts = ["one two three", "one", "one two"]
+    assert [vector[0] for vector in engine.embed_documents(texts)] == [3, 1, 2]
+    # Texts are sorted by token length before they reach the model
+    assert model.calls == [["one", "one two", "one two three"]]
+    assert engine.chunks_embedded == 3
+
+
+def test_callers_are_not_blocked_while_the_model_runs():
+    model = FakeModel()
+    model.release.clear()
+    engine = engine_with(model)
+    first = engine.submit(["a b"])
+    assert model.started.wait(5)
+
+    # Queueing more work and reading the model's limits don't wait for the running batch
+    second = engine.submit(["a b c"])
+    assert engine.max_seq_length == 8
+    model.release.set()
+    assert first.result(5) == [[2.0, 1.0]]
+    assert second.result(5) == [[3.0, 1.0]]
+
+
+def test_the_model_is_only_released_between_batches():
+    model = FakeModel()
+    model.release.clear()
+    engine = engine_with(model)
+    future = engine.submit(["a"])
+    assert model.started.wait(5)
+    closer = threading.Thread(target=engine.close)
+    closer.start()
+    closer.join(0.1)
+    assert closer.is_alive() and engine.loaded
+
+    model.release.set()
+    closer.join(5)
+    assert future.result(5) == [[1.0, 1.0]]
+    assert not engine.loaded
+
+
+def test_batches_stay_within_the_token_budget():
+    model = FakeModel()
+    engine = engine_with(model)
+    engine.token_budget = lambda: 6
+    texts = ["a b c", "a", "a b", "a b c d e f", "a"]
+    vectors = engine.embed_documents(texts)
+    assert [vector[0] for vector in vectors] == [3, 1, 2, 6, 1]
+    # Each batch pads to its longest text, and never past the budget
+    assert model.calls == [["a", "a", "a b"], ["a b c"], ["a b c d e f"]]
+
+
+def test_splitters_get_their_own_copy_of_the_tokenizer():
+    model = FakeModel()
+    engine = engine_with(model)
+    tokenizer = engine.tokenizer
+    assert tokenizer is not model.tokenizer and engine.tokenizer is tokenizer
+    # The worker's truncation settings never reach the copy
+    engine.embed_documents(["a b"])
+    assert model.tokenizer.settings == (True, 8)
+    assert tokenizer.settings is None
+
+
+def test_sessions_share_one_engine_per_model():
+    engine = get_embedding_engine(store_dir=None)
+    assert get_embedding_engine(store_dir=None) is engine
+    # The model is only loaded once something is embedded
+    assert not engine.loaded
+
+
+class PaddingTokenizer:
+    def __call__(self, texts, padding, truncation, max_length, return_tensors):
+        lengths = [min(len(text.split()), max_length) for text in texts]
+        width = max(lengths)
+        mask = np.array([[1] * n + [0] * (width - n) for n in lengths])
+        return {"input_ids": mask * 7, "attention_mask": mask}
+
+
+class TokenValueSession:
+    """
+    Returns each token's hidden state as [1, position], and garbage for padding.
+    """
+
+    def run(self, outputs, inputs):
+        mask = inputs["attention_mask"]
+        positions = np.broadcast_to(np.arange(mask.shape[1]), mask.shape)
+        hidden = np.stack([np.ones(mask.shape), positions], axis=-1)
+        return [np.where(mask[..., None] == 1, hidden, 100.0)]
+
+
+def test_onnx_backend_mean_pools_unpadded_tokens():
+    backend = OnnxBackend.__new__(OnnxBackend)
+    backend.tokenizer = PaddingTokenizer()
+    backend.session = TokenValueSession()
+    backend._input_names = ["input_ids", "attention_mask"]
+    backend.max_seq_length = 8
+    backend.normalize = False
+    vectors = backend.encode(["a b c", "a", "a b c d e"], batch_size=2)
+    np.testing.assert_allclose(vectors, [[1, 1], [1, 0], [1, 2]])
+
+    backend.normalize = True
+    vectors = backend.encode(["a b c"], batch_size=2)
+    np.testing.assert_allclose(vectors, [[2**-0.5, 2**-0.5]])
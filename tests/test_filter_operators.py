@@ -0,0 +1,48 @@
+import pytest
+
+from pages.utils.filter_operators import MetadataIndex, filter_values
+
+
+def test_filter_values_use_file_names_and_types():
+    assert filter_values({"source": "/tmp/upload/Report.PDF", "page": 0}) == {
+        ("source", "Report.PDF"),
+        ("file_type", "pdf"),
+        ("page", 0),
+    }
+    assert filter_values({}) == set()
+
+
+@pytest.fixture
+def index():
+    index = MetadataIndex()
+    index.update("1", [{"source": "/tmp/a.pdf", "page": 0}])
+    index.update("2", [{"source": "/tmp/a.pdf", "page": 1}])
+    index.update("3", [{"source": "/tmp/b.txt"}])
+    # A chunk shared by duplicate files carries both
+    index.update("4", [{"source": "/tmp/b.txt"}, {"source": "/tmp/c.md"}])
+    return index
+
+
+def test_scopes_by_any_value_of_every_field(index):
+    assert index.ids() == {"1", "2", "3", "4"}
+    assert index.ids(source=["a.pdf", "c.md"]) == {"1", "2", "4"}
+    assert index.ids(source=["a.pdf"], page=[1]) == {"2"}
+    assert index.ids(file_type=["txt"]) == {"3", "4"}
+    assert index.ids(source=["missing.pdf"]) == set()
+    assert index.values("source") == ["a.pdf", "b.txt", "c.md"]
+
+
+def test_rejects_unknown_fields(index):
+    with pytest.raises(ValueError):
+        index.ids(author=["me"])
+
+
+def test_update_and_remove_forget_old_values(index):
+    index.update("4", [{"source": "/tmp/b.txt"}])
+    assert index.ids(source=["c.md"]) == set()
+    assert index.values("source") == ["a.pdf", "b.txt"]
+    index.remove("3")
+    index.remove("4")
+    assert index.ids(source=["b.txt"]) == set()
+    assert index.values("file_type") == ["pdf"]
+    assert len(index) == 2
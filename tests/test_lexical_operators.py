@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from pages.utils.lexical_operators import BM25Index, reciprocal_rank_fusion, tokenize
+
+TEXTS = {
+    "a": "The parser raises ERR_TIMEOUT when the socket stalls.",
+    "b": "Retries back off exponentially after a timeout.",
+    "c": "The config loader reads settings.yaml on start.",
+    "d": "Socket errors are logged with their error code.",
+    "e": "Settings can be overridden with environment variables.",
+}
+
+
+def build(ids):
+    index = BM25Index()
+    index.add(ids, [TEXTS[id] for id in ids])
+    return index
+
+
+def test_tokenize_keeps_compound_identifiers_and_their_parts():
+    assert tokenize("Read settings.yaml, ERR_TIMEOUT") == [
+        "read",
+        "settings.yaml",
+        "settings",
+        "yaml",
+        "err_timeout",
+        "err",
+        "timeout",
+    ]
+
+
+def test_search_ranks_rare_exact_terms_first():
+    index = build(list(TEXTS))
+    ids, scores = index.search("err_timeout socket", k=3)
+    assert ids[0] == "a"
+    assert "c" not in ids
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_search_within_scope():
+    index = build(list(TEXTS))
+    ids, _ = index.search("socket", k=5, within={"d", "e"})
+    assert ids == ["d"]
+
+
+def test_add_skips_known_ids():
+    index = build(["a"])
+    index.add(["a"], ["something else entirely"])
+    assert len(index) == 1
+    assert index.search("parser", k=1)[0] == ["a"]
+
+
+def test_remove_and_compact_match_a_fresh_index():
+    index = build(list(TEXTS))
+    index.remove(["a", "b", "c"])
+    # Removed chunks now outnumber the live ones, so the postings were compacted
+    assert len(index._ids) == len(index) == 2
+    fresh = build(["d", "e"])
+    for query in ("socket error", "settings environment", "err_timeout"):
+        ids, scores = index.search(query, k=5)
+        fresh_ids, fresh_scores = fresh.search(query, k=5)
+        assert ids == fresh_ids
+        np.testing.assert_allclose(scores, fresh_scores)
+    assert index.nbytes() == fresh.nbytes()
+
+
+def test_removed_chunks_are_not_found_before_compaction():
+    index = build(list(TEXTS))
+    index.remove(["a"])
+    assert len(index._ids) == 5
+    assert "a" not in index.search("err_timeout socket", k=5)[0]
+
+
+def test_save_load_round_trip(tmp_path):
+    index = build(list(TEXTS))
+    index.remove(["c"])
+    path = str(tmp_path / "bm25.npz")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert (loaded.k1, loaded.b) == (index.k1, index.b)
+    assert len(loaded) == len(index) == 4
+    for query in ("socket", "settings", "timeout retries", "missing"):
+        ids, scores = index.search(query, k=5)
+        loaded_ids, loaded_scores = loaded.search(query, k=5)
+        assert loaded_ids == ids
+        np.testing.assert_allclose(loaded_scores, scores)
+    loaded.add(["c"], [TEXTS["c"]])
+    assert loaded.search("settings.yaml", k=1)[0] == ["c"]
+
+
+def test_reciprocal_rank_fusion():
+    fused = dict(reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60))
+    assert fused["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert fused["a"] == pytest.approx(1 / 61)
+    assert fused["d"] == pytest.approx(1 / 62)
+    ranked = [id for id, _ in reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]])]
+    assert ranked == ["b", "a", "d", "c"]
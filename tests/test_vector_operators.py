@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores.utils import (
+    maximal_marginal_relevance as langchain_mmr,
+)
+
+from pages.utils.vector_operators import (
+    INDEX_TYPES,
+    ExactVectors,
+    UnitVectors,
+    VectorProjection,
+    choose_index_type,
+    create_faiss_index,
+    index_type_of,
+    maximal_marginal_relevance,
+    vector_bytes,
+)
+
+
+def unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.2, 0.5, 1.0])
+@pytest.mark.parametrize("k", [1, 4, 20])
+def test_mmr_matches_langchain(lambda_mult, k):
+    rng = np.random.default_rng(k)
+    vectors = unit(rng.normal(size=(200, 32))).astype(np.float32)
+    query = rng.normal(size=32).astype(np.float32)
+    assert maximal_marginal_relevance(
+        query, vectors, k=k, lambda_mult=lambda_mult
+    ) == langchain_mmr(query, vectors, lambda_mult=lambda_mult, k=k)
+
+
+def test_mmr_with_fewer_candidates_than_k():
+    vectors = unit(np.eye(3, dtype=np.float32))
+    picked = maximal_marginal_relevance(np.ones(3, dtype=np.float32), vectors, k=10)
+    assert sorted(picked) == [0, 1, 2]
+    assert maximal_marginal_relevance(np.ones(3), vectors[:0], k=4) == []
+
+
+def test_mmr_uses_given_relevance():
+    vectors = unit(np.eye(3, dtype=np.float32))
+    relevance = np.array([0.1, 0.9, 0.5], dtype=np.float32)
+    assert maximal_marginal_relevance(
+        np.ones(3), vectors, k=3, lambda_mult=1.0, relevance=relevance
+    ) == [1, 2, 0]
+
+
+def test_unit_vectors_follow_faiss_positions():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(10, 8)).astype(np.float32)
+    store = UnitVectors(8)
+    store.add(vectors[:4])
+    store.add(vectors[4:])
+    store.remove([0, 5])
+    kept = np.delete(vectors, [0, 5], axis=0)
+    assert len(store) == 8
+    np.testing.assert_allclose(store.get(np.arange(8)), unit(kept), atol=1e-3)
+
+
+@pytest.mark.parametrize("storage, ratio", [("float16", 2), ("int8", 4)])
+def test_compact_storage_shrinks_vectors_and_keeps_exact_copies(storage, ratio):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+    index = create_faiss_index(storage, vectors)
+    index.add(vectors)
+    assert vector_bytes(index) * ratio == vectors.nbytes
+    _, found = index.search(vectors[:50], 1)
+    assert (found[:, 0] == np.arange(50)).mean() >= 0.9
+
+    exact = ExactVectors(16)
+    ids = [str(i) for i in range(300)]
+    exact.add(ids, vectors)
+    exact.remove(ids[:200])
+    np.testing.assert_array_equal(exact.get(["250", "201"]), vectors[[250, 201]])
+    exact.close()
+
+
+def test_pca_keeps_the_corpus_variance():
+    rng = np.random.default_rng(0)
+    # Vectors that only vary along 4 of their 16 dimensions
+    sample = rng.normal(size=(200, 4)) @ rng.normal(size=(4, 16))
+    projection = VectorProjection("pca", 4)
+    assert not projection.fitted
+    projection.fit(sample)
+    assert projection.explained_variance == pytest.approx(1.0)
+    assert projection.transform(sample).shape == (200, 4)
+
+    truncated = VectorProjection("truncate", 4).transform(sample)
+    np.testing.assert_allclose(np.linalg.norm(truncated, axis=1), 1.0, rtol=1e-5)
+
+
+def test_index_types_follow_the_corpus_size():
+    assert choose_index_type(10) == "flat"
+    assert choose_index_type(50_000) == "ivf"
+    assert choose_index_type(5_000_000) == "ivfpq"
+
+    vectors = np.random.default_rng(0).normal(size=(2_000, 16)).astype(np.float32)
+    for index_type in INDEX_TYPES:
+        index = create_faiss_index("float32", vectors, index_type)
+        assert index_type_of(index) == index_type